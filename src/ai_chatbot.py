@@ -7,27 +7,51 @@ AIチャットボットモジュール
 実装の詳細:
 - sentence_transformersライブラリは初回呼び出し時にインポート
 - SentenceTransformerモデルは初回呼び出し時にロード
-- 埋め込みデータは初回呼び出し時にロード
+- 埋め込みデータは初回呼び出し時にロードし、L2正規化済みの行列として常駐
 - 2回目以降の呼び出しではキャッシュされたデータを使用
 
 この設計により、モジュールのインポートは即座に完了し、
 Bot起動時間が大幅に短縮されます。
 """
 
+import asyncio
+import hashlib
+import json
 import os
 import threading
-
-from gemini_config import create_generative_model
-from knowledge_db import KnowledgeDB
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+from ann_index import IVFIndex
+from batch_encoder import DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT_MS, MicroBatchEncoder
+from embedding_index import EmbeddingIndex
+from embedding_snapshot import is_prefix_of, load_snapshot, read_manifest
+from env_config import env_number
+from gemini_config import create_generative_model, get_model_name
+from knowledge_db import FTS_MAX_TERM_MATCHES, KnowledgeDB
+from response_cache import SemanticResponseCache
+from single_flight import AsyncSingleFlight, SingleFlight
 from toml_loader import tomllib
+from ttl_cache import TTLCache
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "../data/knowledge.db")
 PROMPTS_PATH = os.path.join(os.path.dirname(__file__), "../config/prompts.toml")
+# 埋め込みスナップショット（prepare_dataset.pyが生成、存在する場合はmmapで読み込む）
+SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), "../data/knowledge_snapshot")
+# 近似最近傍インデックス（prepare_dataset.pyが生成、存在する場合のみ使用）
+ANN_INDEX_PATH = os.path.join(os.path.dirname(__file__), "../data/knowledge.ivf.npz")
+# 応答キャッシュの永続化ファイル（RESPONSE_CACHE_PERSIST=1の場合のみ使用）
+RESPONSE_CACHE_PATH = os.path.join(
+    os.path.dirname(__file__), "../data/response_cache.db"
+)
 
 # 遅延ロード用のグローバル変数（キャッシュ）
 _model = None
-_texts = None
-_embeddings = None
+_index = None  # 正規化済み埋め込み行列（EmbeddingIndex）
 _prompts = None
 _cached_additional_role = None  # キャッシュされた追加役割の値
 _gemini_model = None  # Gemini APIモデルのキャッシュ
@@ -36,10 +60,53 @@ _safety_settings = None  # 安全性設定のキャッシュ
 _llm_first_success = False  # LLM初回成功フラグ
 _initialized = False
 _init_lock = threading.Lock()
+_model_lock = threading.Lock()
 _llm_success_lock = threading.Lock()  # LLM成功メッセージ表示用ロック
 # データベースインスタンス（クリーンアップはガベージコレクションを介して自動的に行われる）
 _db = None
 
+# 類似メッセージ検索の同時実行数のデフォルト値（環境変数 MAX_CONCURRENT_RESPONSES で変更可能）
+DEFAULT_MAX_CONCURRENT_RESPONSES = 8
+_response_executor = None  # 応答生成用スレッドプール（初回使用時に作成）
+_response_executor_lock = threading.Lock()
+_search_slots = None  # 検索の同時実行数を制限するセマフォ（初回使用時に作成）
+
+# クエリ埋め込みキャッシュのデフォルト設定
+# （環境変数 QUERY_CACHE_SIZE / QUERY_CACHE_TTL で変更可能、0で無効化・無期限）
+DEFAULT_QUERY_CACHE_SIZE = 1024
+DEFAULT_QUERY_CACHE_TTL = 3600
+_query_cache = None  # 正規化済みクエリ -> 埋め込みベクトル（TTLCache）
+_query_cache_lock = threading.Lock()
+
+# クエリのマイクロバッチ埋め込み（環境変数 QUERY_BATCH_SIZE / QUERY_BATCH_WAIT_MS で
+# 変更可能、QUERY_BATCH_SIZE=1で無効化）
+_batch_encoder = None  # MicroBatchEncoder
+_batch_encoder_lock = threading.Lock()
+
+# 意味的応答キャッシュのデフォルト設定（環境変数 RESPONSE_CACHE_SIZE /
+# RESPONSE_CACHE_THRESHOLD / RESPONSE_CACHE_TTL で変更可能、サイズ0で無効化）
+DEFAULT_RESPONSE_CACHE_SIZE = 256
+DEFAULT_RESPONSE_CACHE_THRESHOLD = 0.95
+DEFAULT_RESPONSE_CACHE_TTL = 86400
+_response_cache = None  # SemanticResponseCache
+_response_cache_lock = threading.Lock()
+_response_cache_version = None  # (プロンプト設定, モデル名, バージョン文字列)
+
+# インデックスの差分更新の間隔（秒）のデフォルト値
+# （環境変数 INDEX_REFRESH_INTERVAL で変更可能、0で無効化）
+DEFAULT_INDEX_REFRESH_INTERVAL = 60
+_index_refresh_lock = threading.Lock()
+_index_refresher = None  # 差分更新のバックグラウンドスレッド
+_index_refresher_stop = threading.Event()
+
+# ハイブリッド検索で融合の対象とする各検索結果の最小件数
+# （環境変数 HYBRID_SEARCH=0 で全文検索との融合を無効化）
+DEFAULT_HYBRID_CANDIDATES = 20
+
+# 同じ質問（正規化後）の同時リクエストを1回の処理にまとめる
+_response_flight = SingleFlight()
+_response_flight_async = AsyncSingleFlight()
+
 
 def is_initialized():
     """
@@ -51,6 +118,43 @@ def is_initialized():
     return _initialized
 
 
+def _load_index(db):
+    """
+    埋め込みインデックスを読み込む
+
+    スナップショットがあればmmapで読み込み（コピーなし）、その後に追加された
+    埋め込みだけをデータベースから読み込みます。スナップショットが無い場合や
+    データベースと一致しない場合（フォーマットが異なる場合を含む）は
+    データベースから全件を読み込みます。
+
+    Args:
+        db: KnowledgeDBインスタンス
+
+    Returns:
+        EmbeddingIndex or SegmentedIndex: 埋め込みインデックス
+            （差分を追加した場合はスナップショットを基本セグメントとするSegmentedIndex）
+    """
+    manifest = read_manifest(SNAPSHOT_DIR)
+    if manifest is not None:
+        if is_prefix_of(manifest, db):
+            index = load_snapshot(SNAPSHOT_DIR, manifest)
+            print(
+                f"   📊 スナップショットから{len(index)}件の埋め込みデータを読み込みました"
+            )
+            loaded = len(index)
+            index = index.extend_from_db(db)
+            if len(index) > loaded:
+                print(
+                    f"   📊 データベースから差分{len(index) - loaded}件を追加しました"
+                )
+            return index
+        print("   ⚠️ スナップショットが古いため、データベースから読み込みます")
+
+    index = EmbeddingIndex.from_db(db)
+    print(f"   📊 データベースから{len(index)}件の埋め込みデータを読み込みました")
+    return index
+
+
 def _load_model_and_embeddings():
     """
     モデルと埋め込みデータをロードする共通処理
@@ -62,13 +166,10 @@ def _load_model_and_embeddings():
         FileNotFoundError: DB_PATHが存在しない場合
         Exception: モデルのロードに失敗した場合
     """
-    global _model, _texts, _embeddings, _db
-
-    # sentence_transformersを遅延インポート（起動時間の最適化）
-    from sentence_transformers import SentenceTransformer
+    global _index, _db
 
-    # モデルのロード
-    _model = SentenceTransformer("all-MiniLM-L6-v2")
+    # モデルのロード（初期化をやり直す場合もロード済みのモデルを使う）
+    load_embedding_model()
 
     # データベースファイルの存在を確認
     if not os.path.exists(DB_PATH):
@@ -78,14 +179,113 @@ def _load_model_and_embeddings():
         )
     # データベースからデータをロード
     _db = KnowledgeDB(DB_PATH)
-    _texts, _embeddings = _db.get_all_embeddings()
+    _index = _load_index(_db)
 
-    if not _texts:
+    if len(_index) == 0:
         raise FileNotFoundError(
             f"埋め込みデータが見つかりません: {DB_PATH}\n"
             "prepare_dataset.pyを実行してデータを生成してください。"
         )
-    print(f"   📊 データベースから{len(_texts)}件の埋め込みデータを読み込みました")
+
+    # 近似最近傍インデックスが存在すれば接続（ANN_INDEX=0で無効化）
+    if os.path.exists(ANN_INDEX_PATH) and os.environ.get("ANN_INDEX", "1") != "0":
+        nprobe_str = os.environ.get("ANN_NPROBE", "").strip()
+        nprobe = int(nprobe_str) if nprobe_str else None
+        ann = IVFIndex.load(ANN_INDEX_PATH, nprobe=nprobe)
+        _index.attach_ann(ann)
+        print(
+            f"   🧭 近似最近傍インデックスを使用します"
+            f"（クラスタ数: {ann.nlist}, nprobe: {ann.nprobe}）"
+        )
+
+    _start_index_refresher()
+
+
+def load_embedding_model():
+    """
+    埋め込みモデルのみをロードする（初回呼び出し時のみ実行）
+
+    知識データ（検索インデックス）は読み込まないため、埋め込みが1件も無い
+    データベースでもテキストの埋め込み（encode_texts）に使用できます。
+
+    Returns:
+        SentenceTransformer: 埋め込みモデル
+
+    Raises:
+        Exception: モデルのロードに失敗した場合
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                # sentence_transformersを遅延インポート（起動時間の最適化）
+                from sentence_transformers import SentenceTransformer
+
+                _model = SentenceTransformer("all-MiniLM-L6-v2")
+    return _model
+
+
+def refresh_index():
+    """
+    前回の読み込み以降に追加された埋め込みをインデックスに反映
+
+    差分だけを読み込んで末尾に追加した新しいインデックスに差し替えます。
+    処理中の検索は差し替え前のインデックスをそのまま使い続けるため、
+    Botを再起動せずに新しい知識データを反映できます。
+    未初期化の場合（知識データが空の状態で起動し、リアルタイム取り込みで
+    最初の埋め込みが保存された場合など）は、ここでモデルとデータを初期化します。
+
+    Returns:
+        int: 追加された件数
+    """
+    global _index
+    _ensure_initialized()
+    with _index_refresh_lock:
+        current = _index
+        _index = current.extend_from_db(_db)
+        return len(_index) - len(current)
+
+
+def _start_index_refresher():
+    """
+    インデックスの差分更新を定期的に行うバックグラウンドスレッドを開始
+
+    INDEX_REFRESH_INTERVAL（秒）ごとに埋め込みの連番の最大値を確認し、
+    増えていれば差分を読み込みます（確認は索引を1回引くだけなので軽量）。
+    """
+    global _index_refresher
+    interval = env_number(
+        "INDEX_REFRESH_INTERVAL", DEFAULT_INDEX_REFRESH_INTERVAL, cast=float
+    )
+    if interval <= 0 or _index_refresher is not None:
+        return
+
+    def run():
+        while not _index_refresher_stop.wait(interval):
+            try:
+                added = refresh_index()
+            except Exception as e:
+                print(f"⚠️ インデックスの差分更新に失敗しました: {e}")
+                continue
+            if added > 0:
+                print(
+                    f"🔄 新しい埋め込み{added}件をインデックスに追加しました"
+                    f"（合計: {len(_index)}件）"
+                )
+
+    _index_refresher_stop.clear()
+    _index_refresher = threading.Thread(target=run, name="index_refresher", daemon=True)
+    _index_refresher.start()
+
+
+def stop_index_refresher():
+    """インデックスの差分更新スレッドを停止"""
+    global _index_refresher
+    if _index_refresher is None:
+        return
+    _index_refresher_stop.set()
+    _index_refresher.join()
+    _index_refresher = None
 
 
 def ensure_initialized_with_callback(callback=None):
@@ -221,48 +421,38 @@ def _load_prompts():
     return _prompts
 
 
-def generate_response_with_llm(query, similar_messages):
+def _get_gemini_model(api_key):
     """
-    LLM APIを使用して、過去メッセージを文脈として応答を生成
+    Gemini APIモデルを取得（初回呼び出し時に作成してキャッシュ）
 
     Args:
-        query: ユーザーからの入力メッセージ
-        similar_messages: 類似度の高いメッセージのリスト
+        api_key: Gemini APIキー
 
     Returns:
-        tuple: (response: str or None, error_message: str or None)
-            - response: LLMが生成した応答文字列、またはNone（エラー時）
-            - error_message: エラーメッセージ、またはNone（成功時）
+        tuple: (genai, model, safety_settings)
     """
     global _gemini_model, _gemini_module, _safety_settings
 
-    # エラーハンドラーを遅延インポート
-    from llm_error_handler import (
-        MAX_RETRIES,
-        log_llm_request,
-        log_llm_response,
-        should_retry_with_backoff,
-        wait_for_retry,
-    )
-
-    # 環境変数からAPIキーを取得
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key or not api_key.strip():
-        # APIキーが設定されていない場合はNoneを返す
-        # (起動時に既に案内済み)
-        return None, None
-
     # モデルのインスタンスをキャッシュして再利用（パフォーマンス向上）
     if _gemini_model is None:
         # Gemini APIモデルを作成
         _gemini_module, _gemini_model, _safety_settings = create_generative_model(
             api_key
         )
+    return _gemini_module, _gemini_model, _safety_settings
+
 
-    # キャッシュから取得
-    genai = _gemini_module
-    safety_settings = _safety_settings
+def _build_prompt(query, similar_messages):
+    """
+    過去メッセージを文脈としたLLM用プロンプトを構築
+
+    Args:
+        query: ユーザーからの入力メッセージ
+        similar_messages: 類似度の高いメッセージのリスト
 
+    Returns:
+        str: プロンプト文字列
+    """
     # 文脈として過去メッセージを整形
     context = "\n".join([f"- {msg}" for msg in similar_messages[:5]])
 
@@ -275,7 +465,7 @@ def generate_response_with_llm(query, similar_messages):
 
 {prompts['llm_response_instruction']}"""
 
-    prompt = f"""{system_instructions}
+    return f"""{system_instructions}
 
 {prompts['llm_context_header']}
 {context}
@@ -285,6 +475,112 @@ def generate_response_with_llm(query, similar_messages):
 
 {prompts['llm_response_header']}"""
 
+
+def _generation_options(genai, safety_settings):
+    """generate_content / generate_content_async に渡す共通オプション"""
+    return {
+        "generation_config": genai.types.GenerationConfig(
+            temperature=0.7,
+            max_output_tokens=1000,
+        ),
+        "safety_settings": safety_settings,
+        # APIリクエストのタイムアウトを明示的に設定
+        "request_options": {"timeout": 30},
+    }
+
+
+def _handle_llm_response(response):
+    """
+    LLM APIの応答を (response, error_message) に変換
+
+    Args:
+        response: generate_contentの戻り値
+
+    Returns:
+        tuple: (response: str or None, error_message: str or None)
+    """
+    from llm_error_handler import log_llm_response
+
+    global _llm_first_success
+
+    if response and response.text:
+        result = response.text.strip()
+        log_llm_response(True, len(result))
+        # 初回のLLM応答成功時にのみ確認メッセージを表示（スレッドセーフ）
+        with _llm_success_lock:
+            if not _llm_first_success:
+                print("✅ LLM API応答成功: Gemini APIを使用して応答を生成しています")
+                _llm_first_success = True
+        return result, None
+
+    error_msg = "LLM APIからの応答が空でした"
+    print(f"⚠️ {error_msg}")
+    log_llm_response(False)
+    return None, error_msg
+
+
+def _llm_failure(exception, attempt):
+    """
+    LLM API呼び出しの例外を評価
+
+    Args:
+        exception: 発生した例外
+        attempt: 現在のリトライ回数
+
+    Returns:
+        tuple: (should_retry: bool, wait_time: float, user_message: str)
+    """
+    from llm_error_handler import log_llm_response, should_retry_with_backoff
+
+    should_retry, wait_time, user_message = should_retry_with_backoff(
+        exception, attempt
+    )
+    if not should_retry:
+        # リトライ不可の場合はエラーを返す
+        error_msg = (
+            f"LLM API呼び出しに失敗: {type(exception).__name__}: {str(exception)}"
+        )
+        print(f"⚠️ {error_msg}")
+        log_llm_response(False)
+    return should_retry, wait_time, user_message
+
+
+def _llm_retries_exhausted(last_error_message):
+    """最大リトライ回数に達した場合の (None, error_message) を返す"""
+    from llm_error_handler import MAX_RETRIES, log_llm_response
+
+    error_msg = f"LLM API: 最大リトライ回数({MAX_RETRIES}回)に達しました"
+    print(f"⚠️ {error_msg}")
+    log_llm_response(False)
+    return None, last_error_message if last_error_message else error_msg
+
+
+def generate_response_with_llm(query, similar_messages):
+    """
+    LLM APIを使用して、過去メッセージを文脈として応答を生成
+
+    Args:
+        query: ユーザーからの入力メッセージ
+        similar_messages: 類似度の高いメッセージのリスト
+
+    Returns:
+        tuple: (response: str or None, error_message: str or None)
+            - response: LLMが生成した応答文字列、またはNone（エラー時）
+            - error_message: エラーメッセージ、またはNone（成功時）
+    """
+    # エラーハンドラーを遅延インポート
+    from llm_error_handler import MAX_RETRIES, log_llm_request, wait_for_retry
+
+    # 環境変数からAPIキーを取得
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key or not api_key.strip():
+        # APIキーが設定されていない場合はNoneを返す
+        # (起動時に既に案内済み)
+        return None, None
+
+    genai, model, safety_settings = _get_gemini_model(api_key)
+    prompt = _build_prompt(query, similar_messages)
+
     # リクエストをログに記録
     log_llm_request(query, len(similar_messages[:5]))
 
@@ -292,76 +588,301 @@ def generate_response_with_llm(query, similar_messages):
     last_error_message = None
     for attempt in range(MAX_RETRIES + 1):
         try:
-            # APIリクエスト（タイムアウトを明示的に設定）
-            response = _gemini_model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.7,
-                    max_output_tokens=1000,
-                ),
-                safety_settings=safety_settings,
-                request_options={"timeout": 30},
+            response = model.generate_content(
+                prompt, **_generation_options(genai, safety_settings)
             )
-
-            if response and response.text:
-                result = response.text.strip()
-                log_llm_response(True, len(result))
-                # 初回のLLM応答成功時にのみ確認メッセージを表示（スレッドセーフ）
-                with _llm_success_lock:
-                    global _llm_first_success
-                    if not _llm_first_success:
-                        print(
-                            "✅ LLM API応答成功: Gemini APIを使用して応答を生成しています"
-                        )
-                        _llm_first_success = True
-                return result, None
-
-            error_msg = "LLM APIからの応答が空でした"
-            print(f"⚠️ {error_msg}")
-            log_llm_response(False)
-            return None, error_msg
+            return _handle_llm_response(response)
 
         except Exception as e:
             # 例外を評価し、リトライすべきか判断
-            retry_info = should_retry_with_backoff(e, attempt)
-            should_retry, wait_time, user_message = retry_info
-            last_error_message = user_message
-
-            if should_retry:
-                wait_for_retry(wait_time)
-                continue
-            else:
-                # リトライ不可の場合はエラーを返す
-                error_msg = f"LLM API呼び出しに失敗: {type(e).__name__}: {str(e)}"
-                print(f"⚠️ {error_msg}")
-                log_llm_response(False)
-                return None, user_message
+            should_retry, wait_time, last_error_message = _llm_failure(e, attempt)
+            if not should_retry:
+                return None, last_error_message
+            wait_for_retry(wait_time)
 
     # 最大リトライ回数に達した場合
-    error_msg = f"LLM API: 最大リトライ回数({MAX_RETRIES}回)に達しました"
-    print(f"⚠️ {error_msg}")
-    log_llm_response(False)
-    return None, last_error_message if last_error_message else error_msg
+    return _llm_retries_exhausted(last_error_message)
+
+
+async def generate_response_with_llm_async(query, similar_messages):
+    """
+    generate_response_with_llmの非同期版
+
+    Gemini APIの非同期呼び出し（generate_content_async）とasyncio.sleepによる
+    バックオフを使用するため、処理中の呼び出しはスレッドを占有しません。
+    呼び出し元のタスクがキャンセルされると、API呼び出しや待機も即座に中断されます。
+
+    Args:
+        query: ユーザーからの入力メッセージ
+        similar_messages: 類似度の高いメッセージのリスト
+
+    Returns:
+        tuple: (response: str or None, error_message: str or None)
+
+    Raises:
+        asyncio.CancelledError: 呼び出し元のタスクがキャンセルされた場合
+    """
+    from llm_error_handler import MAX_RETRIES, log_llm_request, wait_for_retry_async
+
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key or not api_key.strip():
+        return None, None
+
+    genai, model, safety_settings = _get_gemini_model(api_key)
+    prompt = _build_prompt(query, similar_messages)
+
+    log_llm_request(query, len(similar_messages[:5]))
+
+    last_error_message = None
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = await model.generate_content_async(
+                prompt, **_generation_options(genai, safety_settings)
+            )
+            return _handle_llm_response(response)
+
+        except Exception as e:
+            should_retry, wait_time, last_error_message = _llm_failure(e, attempt)
+            if not should_retry:
+                return None, last_error_message
+            await wait_for_retry_async(wait_time)
+
+    return _llm_retries_exhausted(last_error_message)
 
 
 # ユーザーの質問に最も近いメッセージを検索
 
 
-def search_similar_message(query, top_k=3):
+def _normalize_query(query):
+    """
+    キャッシュのキーとして使うためにクエリを正規化
+
+    NFKC正規化（全角英数字・半角カナの統一）、小文字化、
+    前後の空白除去、連続する空白の圧縮を行います。
+
+    Args:
+        query: 検索クエリ
+
+    Returns:
+        str: 正規化されたクエリ
+    """
+    return " ".join(unicodedata.normalize("NFKC", query).lower().split())
+
+
+def _get_query_cache():
+    """
+    クエリ埋め込みキャッシュを取得（初回呼び出し時に作成）
+
+    Returns:
+        TTLCache: クエリ埋め込みキャッシュ
+    """
+    global _query_cache
+    if _query_cache is None:
+        with _query_cache_lock:
+            if _query_cache is None:
+                _query_cache = TTLCache(
+                    maxsize=env_number("QUERY_CACHE_SIZE", DEFAULT_QUERY_CACHE_SIZE),
+                    ttl=env_number(
+                        "QUERY_CACHE_TTL", DEFAULT_QUERY_CACHE_TTL, cast=float
+                    ),
+                )
+    return _query_cache
+
+
+def get_query_cache_stats():
+    """
+    クエリ埋め込みキャッシュの統計情報を取得
+
+    Returns:
+        CacheStats: ヒット数・ミス数・現在の件数・最大件数（hit_rateでヒット率）
+    """
+    return _get_query_cache().stats()
+
+
+def _encode_batch(texts):
+    """現在のモデルでテキストのリストをまとめて埋め込む"""
+    return _model.encode(texts, show_progress_bar=False)
+
+
+def encode_texts(texts):
+    """
+    知識データとして追加するテキストをまとめて埋め込む
+
+    クエリ用のキャッシュやマイクロバッチは使わず、1回のencodeで処理します。
+    モデルのみをロードし、検索インデックスは初期化しないため、
+    知識データが空の状態からでも使用できます。
+
+    Args:
+        texts: テキストのリスト
+
+    Returns:
+        np.ndarray: 埋め込み行列（float32）
+    """
+    load_embedding_model()
+    return np.asarray(_encode_batch(list(texts)), dtype=np.float32)
+
+
+def _get_query_batch_size():
+    """
+    環境変数 QUERY_BATCH_SIZE からクエリのマイクロバッチの最大件数を取得
+
+    Returns:
+        int: 最大件数（1以下の場合はマイクロバッチを使用しない）
+    """
+    return env_number("QUERY_BATCH_SIZE", DEFAULT_MAX_BATCH_SIZE)
+
+
+def _get_batch_encoder():
+    """
+    クエリのマイクロバッチエンコーダーを取得（初回呼び出し時に作成）
+
+    同時に届いたクエリを数ミリ秒だけ待って集め、1回のencodeでまとめて埋め込みます。
+
+    Returns:
+        MicroBatchEncoder or None: エンコーダー（QUERY_BATCH_SIZE=1の場合はNone）
+    """
+    global _batch_encoder
+    if _batch_encoder is None:
+        max_batch_size = _get_query_batch_size()
+        if max_batch_size <= 1:
+            return None
+        with _batch_encoder_lock:
+            if _batch_encoder is None:
+                _batch_encoder = MicroBatchEncoder(
+                    _encode_batch,
+                    max_batch_size=max_batch_size,
+                    max_wait_ms=env_number(
+                        "QUERY_BATCH_WAIT_MS", DEFAULT_MAX_WAIT_MS, cast=float
+                    ),
+                )
+    return _batch_encoder
+
+
+def encode_query(query):
+    """
+    クエリの埋め込みベクトルを取得（正規化したクエリでキャッシュ）
+
+    同じ質問（表記揺れを含む）が繰り返された場合はモデルの推論を行いません。
+    キャッシュに無い場合は、同時に届いた他のクエリとまとめて埋め込みます。
+    返されるベクトルはキャッシュと共有されるため読み取り専用です。
+
+    Args:
+        query: 検索クエリ
+
+    Returns:
+        np.ndarray: クエリの埋め込みベクトル（読み取り専用）
+    """
     _ensure_initialized()
-    # utilを遅延インポート
-    from sentence_transformers import util
 
-    query_emb = _model.encode(query)
-    scores = util.cos_sim(query_emb, _embeddings)[0]
-    top_results = scores.argsort(descending=True)[:top_k]
-    return [_texts[i] for i in top_results]
+    key = _normalize_query(query)
+    cache = _get_query_cache()
+    embedding = cache.get(key)
+    if embedding is None:
+        encoder = _get_batch_encoder()
+        if encoder is not None:
+            embedding = np.array(encoder.encode(key), dtype=np.float32)
+        else:
+            embedding = np.array(_model.encode(key), dtype=np.float32)
+        embedding.setflags(write=False)
+        cache.set(key, embedding)
+    return embedding
+
+
+def search_similar_messages_with_scores(query, top_k=3, filters=None):
+    """
+    クエリに類似したメッセージを、メッセージIDと類似度付きで検索
+
+    ベクトル検索と全文検索（FTS5）の結果を順位で融合するため、
+    固有名詞やコマンド名を含む短い質問でも一致するメッセージが上位に入ります。
+    絞り込み条件はメモリ上のメタデータ列に対するマスクとして適用するため、
+    チャンネル別・期間指定の検索でもデータベースからの再読み込みは発生しません。
+
+    Args:
+        query: 検索クエリ
+        top_k: 取得する件数
+        filters: 絞り込み条件（embedding_index.SearchFilter、省略時は全件）
+
+    Returns:
+        List[SearchResult]: (message_id, score, text)の類似度の高い順のリスト
+
+    Raises:
+        ValueError: メタデータを持たないインデックスで絞り込み条件を指定した場合
+    """
+    _ensure_initialized()
+
+    query_emb = encode_query(query)
+    return _search_index(query, query_emb, top_k, filters)
+
+
+def _search_index(query, query_emb, top_k, filters=None):
+    """
+    ベクトル検索と全文検索をReciprocal Rank Fusionで融合して上位k件を返す
+
+    Args:
+        query: 検索クエリ（全文検索に使用）
+        query_emb: クエリの埋め込みベクトル
+        top_k: 取得する件数
+        filters: 絞り込み条件
+
+    Returns:
+        List[SearchResult]: 融合後の順位の高い順の検索結果
+    """
+    if os.environ.get("HYBRID_SEARCH") == "0" or _db is None:
+        # 正規化済み行列との内積1回でコサイン類似度を計算
+        return _index.search(query_emb, top_k, filters=filters)
+
+    candidates = max(top_k * 4, DEFAULT_HYBRID_CANDIDATES)
+    lexical = _db.search_fulltext(
+        query,
+        candidates,
+        max_term_matches=env_number("FULLTEXT_MAX_TERM_MATCHES", FTS_MAX_TERM_MATCHES),
+    )
+    return _index.search_hybrid(
+        query_emb,
+        [message_id for message_id, _ in lexical],
+        top_k,
+        candidates=candidates,
+        filters=filters,
+    )
+
+
+def search_similar_messages_batch(queries, top_k=3, filters=None):
+    """
+    複数のクエリに類似したメッセージを一括で検索
+
+    全てのクエリを1回のencodeでまとめて埋め込み、コーパスとの行列・行列積で
+    スコアを計算します（ブロック単位で計算するためメモリ使用量は一定）。
+    オフライン評価など大量のクエリを処理する用途向けで、常に全件を走査します。
+
+    Args:
+        queries: 検索クエリのシーケンス
+        top_k: クエリごとに取得する件数
+        filters: 絞り込み条件（全てのクエリに共通、省略時は全件）
+
+    Returns:
+        List[List[SearchResult]]: クエリごとの(message_id, score, text)のリスト
+    """
+    _ensure_initialized()
+
+    texts = [_normalize_query(query) for query in queries]
+    if not texts:
+        return []
+    embeddings = np.asarray(_encode_batch(texts), dtype=np.float32)
+    return _index.search_batch(embeddings, top_k, filters=filters)
+
+
+def search_similar_message(query, top_k=3, filters=None):
+    results = search_similar_messages_with_scores(query, top_k, filters)
+    return [result.text for result in results]
 
 
 def generate_response(query, top_k=5):
     """
     クエリに対して、LLM APIを使用して過去の知識を基に返信を生成
 
+    同じ質問（正規化後）が同時に処理中の場合は、埋め込み計算・検索・LLM API呼び出しを
+    新たに行わず、処理中のリクエストの結果を共有します。
+
     Args:
         query: ユーザーからの入力メッセージ
         top_k: 参考にする類似メッセージの数
@@ -372,9 +893,183 @@ def generate_response(query, top_k=5):
     Raises:
         ValueError: GEMINI_API_KEYが設定されていない場合
     """
+    # 同じ質問が処理中であれば、その結果を共有する
+    key = (_normalize_query(query), top_k)
+    return _response_flight.do(key, _generate_response, query, top_k)
+
+
+def _generate_response(query, top_k):
+    """generate_responseの本体（リクエスト合流なし）"""
+    _ensure_initialized()
+    _require_api_key()
+
+    # 類似メッセージを検索し、類似した質問への応答がキャッシュにあれば再利用
+    context = _retrieve_and_lookup(query, top_k)
+    if context.cached is not None:
+        return context.cached
+
+    # LLM APIを使用して応答を生成
+    start = time.perf_counter()
+    llm_response, error_message = generate_response_with_llm(
+        query, context.similar_messages
+    )
+    response = _llm_response_or_raise(llm_response, error_message)
+    _store_response(context, response, time.perf_counter() - start)
+    return response
+
+
+class _RetrievedContext(NamedTuple):
+    """類似メッセージの検索結果と応答キャッシュの照会結果"""
+
+    query_emb: np.ndarray
+    similar_messages: List[str]
+    context_ids: List[int]
+    version: str
+    cached: Optional[str]  # キャッシュにあった応答（無い場合はNone）
+
+
+def _retrieve_and_lookup(query, top_k):
+    """
+    類似メッセージを検索し、応答キャッシュを照会する
+
+    埋め込み計算・検索・応答キャッシュ（永続化時はSQLite）の読み込みを行うため、
+    非同期版ではイベントループ外のスレッドでまとめて実行します。
+
+    Args:
+        query: ユーザーからの入力メッセージ
+        top_k: 参考にする類似メッセージの数
+
+    Returns:
+        _RetrievedContext: 検索結果と応答キャッシュの照会結果
+
+    Raises:
+        ValueError: 類似メッセージが見つからない場合
+    """
+    query_emb, results = _retrieve_context(query, top_k)
+    similar_messages = [result.text for result in results]
+    _require_similar_messages(similar_messages)
+
+    context_ids = [result.message_id for result in results]
+    version = _get_response_cache_version()
+    cached = _get_response_cache().lookup(query_emb, context_ids, version)
+    return _RetrievedContext(query_emb, similar_messages, context_ids, version, cached)
+
+
+def _store_response(context, response, latency):
+    """
+    生成した応答を応答キャッシュに保存（永続化時はSQLiteへの書き込みを伴う）
+
+    Args:
+        context: _retrieve_and_lookupの結果
+        response: 生成した応答
+        latency: LLM呼び出しにかかった時間（秒）
+    """
+    _get_response_cache().store(
+        context.query_emb, context.context_ids, context.version, response, latency
+    )
+
+
+def _retrieve_context(query, top_k):
+    """
+    クエリの埋め込みと類似メッセージの検索結果を取得
+
+    Args:
+        query: ユーザーからの入力メッセージ
+        top_k: 取得する件数
+
+    Returns:
+        tuple: (クエリの埋め込みベクトル, List[SearchResult])
+    """
     _ensure_initialized()
+    query_emb = encode_query(query)
+    # 埋め込みの完了待ちは制限せず、検索のみMAX_CONCURRENT_RESPONSES件に制限
+    with _get_search_slots():
+        return query_emb, _search_index(query, query_emb, top_k)
+
+
+def _get_response_cache():
+    """
+    意味的応答キャッシュを取得（初回呼び出し時に作成）
+
+    RESPONSE_CACHE_PERSIST=1の場合はdata/response_cache.dbに永続化し、
+    再起動後も現在のバージョンと一致する応答を引き継ぎます。
+
+    Returns:
+        SemanticResponseCache: 応答キャッシュ
+    """
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                persist = os.environ.get("RESPONSE_CACHE_PERSIST") == "1"
+                _response_cache = SemanticResponseCache(
+                    maxsize=env_number(
+                        "RESPONSE_CACHE_SIZE", DEFAULT_RESPONSE_CACHE_SIZE
+                    ),
+                    threshold=env_number(
+                        "RESPONSE_CACHE_THRESHOLD",
+                        DEFAULT_RESPONSE_CACHE_THRESHOLD,
+                        cast=float,
+                    ),
+                    ttl=env_number(
+                        "RESPONSE_CACHE_TTL", DEFAULT_RESPONSE_CACHE_TTL, cast=float
+                    ),
+                    path=RESPONSE_CACHE_PATH if persist else None,
+                    version=_get_response_cache_version() if persist else None,
+                )
+    return _response_cache
+
+
+def _get_response_cache_version():
+    """
+    応答キャッシュのバージョンを取得
+
+    プロンプト設定（config/prompts.toml と ADDITIONAL_CHATBOT_ROLE）と
+    LLMのモデル名から算出するため、いずれかが変わると以前の応答は使用されません。
+    知識データの追加（差分更新・リアルタイム取り込み）ではバージョンは変わりません。
+    応答は文脈のメッセージIDが完全に一致する場合のみ再利用されるため、
+    新しいメッセージが検索結果に入った質問は自然にキャッシュの対象外になります
+    （それ以外の応答はRESPONSE_CACHE_TTLで期限切れになります）。
+
+    Returns:
+        str: バージョン文字列
+    """
+    global _response_cache_version
+
+    prompts = _load_prompts()
+    model = get_model_name()
+    cached = _response_cache_version
+    if cached is not None and cached[0] is prompts and cached[1] == model:
+        return cached[2]
+
+    source = json.dumps(
+        {"prompts": prompts, "model": model},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    version = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+    _response_cache_version = (prompts, model, version)
+    return version
+
+
+def get_response_cache_stats():
+    """
+    意味的応答キャッシュの統計情報を取得
+
+    Returns:
+        ResponseCacheStats: ヒット数・ミス数・件数・節約できたLLM呼び出し時間
+            （hit_rateでヒット率）
+    """
+    return _get_response_cache().stats()
 
-    # APIキーの確認
+
+def _require_api_key():
+    """
+    GEMINI_API_KEYが設定されていることを確認
+
+    Raises:
+        ValueError: GEMINI_API_KEYが設定されていない場合
+    """
     api_key = os.environ.get("GEMINI_API_KEY")
     if not api_key or not api_key.strip():
         raise ValueError(
@@ -382,18 +1077,28 @@ def generate_response(query, top_k=5):
             "GEMINI_API_KEY環境変数を設定してください。"
         )
 
-    # 類似メッセージを検索
-    similar_messages = search_similar_message(query, top_k)
 
-    # 類似メッセージが見つからない場合
+def _require_similar_messages(similar_messages):
+    """
+    類似メッセージが見つかったことを確認
+
+    Raises:
+        ValueError: 類似メッセージが見つからない場合
+    """
     if not similar_messages:
         raise ValueError(
             "関連する過去メッセージが見つかりませんでした。\n"
             "知識データが正しく生成されているか確認してください。"
         )
 
-    # LLM APIを使用して応答を生成
-    llm_response, error_message = generate_response_with_llm(query, similar_messages)
+
+def _llm_response_or_raise(llm_response, error_message):
+    """
+    LLM APIの結果から応答を返す（失敗時は例外）
+
+    Raises:
+        RuntimeError: LLM APIからの応答取得に失敗した場合
+    """
     if llm_response:
         return llm_response
 
@@ -407,6 +1112,139 @@ def generate_response(query, top_k=5):
         )
 
 
+def get_max_concurrent_responses():
+    """
+    環境変数 MAX_CONCURRENT_RESPONSES から応答生成の同時実行数を取得
+
+    Returns:
+        int: 同時実行数（未設定・不正な値の場合はDEFAULT_MAX_CONCURRENT_RESPONSES）
+    """
+    return env_number(
+        "MAX_CONCURRENT_RESPONSES", DEFAULT_MAX_CONCURRENT_RESPONSES, minimum=1
+    )
+
+
+def _get_response_executor():
+    """
+    応答生成用のスレッドプールを取得（初回呼び出し時に作成）
+
+    プールのスレッド数は同時に検索するリクエスト数の上限
+    （MAX_CONCURRENT_RESPONSES）に、クエリのマイクロバッチの最大件数
+    （QUERY_BATCH_SIZE）を加えた数です。埋め込みの完了を待つスレッドは
+    バッチがまとまるまでプールのスレッドを占有するため、スレッド数が
+    バッチの最大件数より少ないとバッチがスレッド数で頭打ちになります。
+    検索自体の同時実行数は_get_search_slotsのセマフォで
+    MAX_CONCURRENT_RESPONSES件に制限されます。
+    スレッドの空きを超えたリクエストは空きが出るまで待機します。
+
+    Returns:
+        ThreadPoolExecutor: 応答生成用スレッドプール
+    """
+    global _response_executor
+    if _response_executor is None:
+        with _response_executor_lock:
+            if _response_executor is None:
+                max_workers = get_max_concurrent_responses()
+                batch_size = _get_query_batch_size()
+                if batch_size > 1:
+                    max_workers += batch_size
+                _response_executor = ThreadPoolExecutor(
+                    max_workers=max_workers,
+                    thread_name_prefix="ai_chatbot_response",
+                )
+    return _response_executor
+
+
+def _get_search_slots():
+    """
+    検索の同時実行数を制限するセマフォを取得（初回呼び出し時に作成）
+
+    スレッドプールにはマイクロバッチを待つ分のスレッドも含まれるため、
+    ベクトル検索・全文検索を同時に実行するスレッド数はこのセマフォで
+    MAX_CONCURRENT_RESPONSES件に制限します。
+
+    Returns:
+        threading.BoundedSemaphore: 検索の同時実行数を制限するセマフォ
+    """
+    global _search_slots
+    if _search_slots is None:
+        with _response_executor_lock:
+            if _search_slots is None:
+                _search_slots = threading.BoundedSemaphore(
+                    get_max_concurrent_responses()
+                )
+    return _search_slots
+
+
+async def ensure_initialized_async(callback=None):
+    """
+    ensure_initialized_with_callbackをイベントループ外のスレッドで実行
+
+    モデルとデータのロード中もイベントループ（Discordのハートビートなど）を止めません。
+
+    Args:
+        callback: 初回初期化時に呼び出される関数（引数なし、ワーカースレッドで実行）
+
+    Returns:
+        bool: 既に初期化済みだった場合True、今回初めて初期化した場合False
+    """
+    if _initialized:
+        return True
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_response_executor(), ensure_initialized_with_callback, callback
+    )
+
+
+async def generate_response_async(query, top_k=5):
+    """
+    generate_responseの非同期版
+
+    埋め込み計算を伴う類似メッセージ検索はスレッドプールで実行し、
+    LLM API呼び出しとリトライ待機はコルーチンとしてイベントループ上で待機します。
+    呼び出し元がタスクをキャンセル（asyncio.wait_forのタイムアウトなど）すると、
+    処理中のAPI呼び出しも中断されます（同じ質問を待つ他の呼び出しがある場合は続行）。
+
+    Args:
+        query: ユーザーからの入力メッセージ
+        top_k: 参考にする類似メッセージの数
+
+    Returns:
+        生成された返信文字列
+
+    Raises:
+        ValueError: GEMINI_API_KEYが設定されていない場合
+        RuntimeError: LLM APIからの応答取得に失敗した場合
+    """
+    # 同じ質問が処理中であれば、その結果を共有する
+    key = (_normalize_query(query), top_k)
+    return await _response_flight_async.do(
+        key, lambda: _generate_response_async(query, top_k)
+    )
+
+
+async def _generate_response_async(query, top_k):
+    """generate_response_asyncの本体（リクエスト合流なし）"""
+    _require_api_key()
+
+    # 検索と応答キャッシュの読み書きはイベントループ外のスレッドで実行
+    loop = asyncio.get_running_loop()
+    executor = _get_response_executor()
+    context = await loop.run_in_executor(executor, _retrieve_and_lookup, query, top_k)
+    if context.cached is not None:
+        return context.cached
+
+    start = time.perf_counter()
+    llm_response, error_message = await generate_response_with_llm_async(
+        query, context.similar_messages
+    )
+    response = _llm_response_or_raise(llm_response, error_message)
+    await loop.run_in_executor(
+        executor, _store_response, context, response, time.perf_counter() - start
+    )
+    return response
+
+
 # テスト用
 if __name__ == "__main__":
     q = input("質問を入力してください: ")
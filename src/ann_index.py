@@ -0,0 +1,391 @@
+"""
+近似最近傍（ANN）インデックスモジュール
+
+転置ファイル（IVF）方式の近似最近傍インデックスをNumPyのみで実装します。
+- 球面k-meansでクラスタ中心（セントロイド）を学習
+- 各ベクトルを最も近いクラスタに割り当て
+- 検索時はクエリに近いnprobe個のクラスタのみを走査
+
+ファイルに保存するのはセントロイドとメッセージIDごとのクラスタ割り当てのみで、
+ベクトル本体はEmbeddingIndexの行列を参照します。
+新しいメッセージは既存のセントロイドに割り当てるだけで増分追加できます。
+"""
+
+import math
+import os
+from typing import Callable, Iterable, Optional, Tuple
+
+import numpy as np
+
+# 保存ファイルのフォーマットバージョン
+FORMAT_VERSION = 1
+
+# デフォルト設定
+DEFAULT_NPROBE = 10
+DEFAULT_TRAIN_ITERATIONS = 10
+DEFAULT_TRAIN_SAMPLE_SIZE = 100_000
+
+# 割り当て計算時に一度に処理する行数（メモリ使用量の上限）
+_ASSIGN_CHUNK_SIZE = 65_536
+
+# 増分追加時に確保する配列の余裕（追加のたびに全体をコピーしないため）
+_ADD_GROWTH = 1.5
+_ADD_MIN_CAPACITY = 1024
+
+
+def default_nlist(num_vectors: int) -> int:
+    """
+    件数に応じたクラスタ数の目安を返す（おおよそ√n）
+
+    Args:
+        num_vectors: ベクトルの件数
+
+    Returns:
+        int: クラスタ数（1以上）
+    """
+    return max(1, int(math.sqrt(num_vectors)))
+
+
+class IVFIndex:
+    """転置ファイル（IVF）方式の近似最近傍インデックス"""
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        message_ids: Optional[np.ndarray] = None,
+        assignments: Optional[np.ndarray] = None,
+        nprobe: int = DEFAULT_NPROBE,
+    ):
+        """
+        インデックスを初期化
+
+        Args:
+            centroids: L2正規化済みのセントロイド行列（クラスタ数×次元数）
+            message_ids: 登録済みのメッセージID配列
+            assignments: 各メッセージIDのクラスタ番号の配列
+            nprobe: 検索時に走査するクラスタ数
+        """
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        if message_ids is None:
+            message_ids = np.empty(0, dtype=np.int64)
+        if assignments is None:
+            assignments = np.empty(0, dtype=np.int32)
+        message_ids = np.asarray(message_ids, dtype=np.int64)
+        assignments = np.asarray(assignments, dtype=np.int32)
+        if len(message_ids) != len(assignments):
+            raise ValueError("メッセージIDとクラスタ割り当ての件数が一致しません")
+        # 増分追加用に余裕を持って確保する配列と使用済みの件数
+        self._message_ids = message_ids
+        self._assignments = assignments
+        self._size = len(message_ids)
+        # 登録済みのメッセージIDの集合（addの初回呼び出し時に作成）
+        self._id_set = None
+        self.nprobe = nprobe
+
+    @property
+    def message_ids(self) -> np.ndarray:
+        """登録済みのメッセージID配列"""
+        return self._message_ids[: self._size]
+
+    @property
+    def assignments(self) -> np.ndarray:
+        """各メッセージIDのクラスタ番号の配列"""
+        return self._assignments[: self._size]
+
+    @property
+    def nlist(self) -> int:
+        """クラスタ数"""
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @classmethod
+    def train(
+        cls,
+        vectors: np.ndarray,
+        message_ids: np.ndarray,
+        nlist: Optional[int] = None,
+        nprobe: int = DEFAULT_NPROBE,
+        iterations: int = DEFAULT_TRAIN_ITERATIONS,
+        sample_size: int = DEFAULT_TRAIN_SAMPLE_SIZE,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """
+        球面k-meansでセントロイドを学習し、全ベクトルを割り当てる
+
+        Args:
+            vectors: L2正規化済みのベクトル行列
+            message_ids: 各行のメッセージID
+            nlist: クラスタ数（省略時は件数から自動決定）
+            nprobe: 検索時に走査するクラスタ数
+            iterations: k-meansの反復回数
+            sample_size: 学習に使用する最大サンプル数
+            seed: 乱数シード
+
+        Returns:
+            IVFIndex: 学習済みのインデックス
+
+        Raises:
+            ValueError: ベクトルが空の場合
+        """
+        num_vectors = len(vectors)
+        if num_vectors == 0:
+            raise ValueError("学習に使用するベクトルがありません")
+        if nlist is None:
+            nlist = default_nlist(num_vectors)
+        nlist = min(nlist, num_vectors)
+
+        rng = np.random.default_rng(seed)
+        if num_vectors > sample_size:
+            sample = vectors[rng.choice(num_vectors, sample_size, replace=False)]
+        else:
+            sample = vectors
+        sample = np.asarray(sample, dtype=np.float32)
+
+        centroids = _train_centroids(sample, nlist, iterations, rng)
+        index = cls(centroids, nprobe=nprobe)
+        index.add(vectors, message_ids)
+        return index
+
+    @classmethod
+    def train_from_pages(
+        cls,
+        pages: Callable[[], Iterable[Tuple[np.ndarray, np.ndarray]]],
+        nlist: Optional[int] = None,
+        nprobe: int = DEFAULT_NPROBE,
+        iterations: int = DEFAULT_TRAIN_ITERATIONS,
+        sample_size: int = DEFAULT_TRAIN_SAMPLE_SIZE,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """
+        ページ単位で読み込むベクトルから学習する（全件をメモリに載せない）
+
+        1回目の走査で最大sample_size件の無作為サンプルを集めてセントロイドを学習し、
+        2回目の走査でページごとにクラスタへ割り当てます。
+        メモリ使用量はサンプルと1ページ分に収まります。
+
+        Args:
+            pages: 呼び出すたびに(L2正規化済みのベクトル行列, メッセージID配列)の
+                ページを先頭から返す関数
+            nlist: クラスタ数（省略時は件数から自動決定）
+            nprobe: 検索時に走査するクラスタ数
+            iterations: k-meansの反復回数
+            sample_size: 学習に使用する最大サンプル数
+            seed: 乱数シード
+
+        Returns:
+            IVFIndex: 学習済みのインデックス
+
+        Raises:
+            ValueError: ベクトルが空の場合
+        """
+        rng = np.random.default_rng(seed)
+
+        # 各行に乱数のキーを割り当て、キーの小さい順にsample_size件を残す
+        # （全件の中からの一様な無作為抽出になる）
+        sample = None
+        keys = np.empty(0)
+        num_vectors = 0
+        for vectors, _ in pages():
+            num_vectors += len(vectors)
+            page_keys = rng.random(len(vectors))
+            if len(keys) >= sample_size:
+                selected = np.flatnonzero(page_keys < keys.max())
+            else:
+                selected = np.arange(len(vectors))
+            if len(selected) == 0:
+                continue
+            rows = np.asarray(vectors[selected], dtype=np.float32)
+            sample = rows if sample is None else np.concatenate([sample, rows])
+            keys = np.concatenate([keys, page_keys[selected]])
+            if len(keys) > sample_size:
+                keep = np.argpartition(keys, sample_size - 1)[:sample_size]
+                sample, keys = sample[keep], keys[keep]
+
+        if num_vectors == 0:
+            raise ValueError("学習に使用するベクトルがありません")
+        if nlist is None:
+            nlist = default_nlist(num_vectors)
+        nlist = min(nlist, len(sample))
+
+        index = cls(_train_centroids(sample, nlist, iterations, rng), nprobe=nprobe)
+        del sample
+        for vectors, message_ids in pages():
+            index.add(vectors, message_ids)
+        return index
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        ベクトルを最も近いクラスタに割り当てる
+
+        Args:
+            vectors: L2正規化済みのベクトル行列
+
+        Returns:
+            np.ndarray: 各行のクラスタ番号
+        """
+        return _nearest_centroids(vectors, self.centroids)
+
+    def add(self, vectors: np.ndarray, message_ids) -> int:
+        """
+        ベクトルを増分追加する（登録済みのメッセージIDはスキップ）
+
+        登録済みかどうかはメッセージIDの集合で判定し、配列は余裕を持って確保するため、
+        1回の処理量は追加する件数だけで決まります（登録済みの件数によりません）。
+
+        Args:
+            vectors: L2正規化済みのベクトル行列
+            message_ids: 各行のメッセージID
+
+        Returns:
+            int: 新規に追加された件数
+        """
+        message_ids = np.asarray(message_ids, dtype=np.int64)
+        if len(message_ids) == 0:
+            return 0
+
+        if self._id_set is None:
+            self._id_set = set(self.message_ids.tolist())
+        known = self._id_set
+        is_new = np.fromiter(
+            (message_id not in known for message_id in message_ids.tolist()),
+            dtype=bool,
+            count=len(message_ids),
+        )
+        if not is_new.any():
+            return 0
+
+        new_ids = message_ids[is_new]
+        new_assignments = self.assign(np.asarray(vectors)[is_new])
+        known.update(new_ids.tolist())
+
+        count = self._size
+        total = count + len(new_ids)
+        if len(self._message_ids) < total:
+            capacity = max(int(total * _ADD_GROWTH), _ADD_MIN_CAPACITY)
+            self._message_ids = _grow(self._message_ids, count, capacity)
+            self._assignments = _grow(self._assignments, count, capacity)
+        self._message_ids[count:total] = new_ids
+        self._assignments[count:total] = new_assignments
+        self._size = total
+        return len(new_ids)
+
+    def probe(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """
+        クエリに近いクラスタ番号を返す
+
+        Args:
+            query: L2正規化済みのクエリベクトル
+            nprobe: 走査するクラスタ数（省略時はインスタンスの設定値）
+
+        Returns:
+            np.ndarray: 近い順のクラスタ番号
+        """
+        if nprobe is None:
+            nprobe = self.nprobe
+        nprobe = max(1, min(nprobe, self.nlist))
+        scores = self.centroids @ query
+        if nprobe >= self.nlist:
+            return np.argsort(-scores)
+        candidates = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        return candidates[np.argsort(-scores[candidates])]
+
+    def save(self, path: str):
+        """
+        インデックスをファイルに保存（一時ファイル経由で置き換え）
+
+        Args:
+            path: 保存先のパス（.npz）
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(
+                f,
+                format_version=np.int32(FORMAT_VERSION),
+                centroids=self.centroids,
+                message_ids=self.message_ids,
+                assignments=self.assignments,
+                nprobe=np.int32(self.nprobe),
+            )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str, nprobe: Optional[int] = None) -> "IVFIndex":
+        """
+        ファイルからインデックスを読み込む
+
+        Args:
+            path: 保存されたファイルのパス
+            nprobe: 検索時に走査するクラスタ数（省略時は保存時の値）
+
+        Returns:
+            IVFIndex: 読み込まれたインデックス
+
+        Raises:
+            ValueError: フォーマットバージョンが一致しない場合
+        """
+        with np.load(path) as data:
+            version = int(data["format_version"])
+            if version != FORMAT_VERSION:
+                raise ValueError(
+                    f"ANNインデックスのフォーマットが異なります: {version} "
+                    f"(期待値: {FORMAT_VERSION})"
+                )
+            return cls(
+                data["centroids"],
+                data["message_ids"],
+                data["assignments"],
+                nprobe=int(data["nprobe"]) if nprobe is None else nprobe,
+            )
+
+
+def _grow(array: np.ndarray, count: int, capacity: int) -> np.ndarray:
+    """
+    先頭count件をコピーした容量capacityの配列を返す
+
+    Args:
+        array: 元の配列
+        count: コピーする件数
+        capacity: 新しい配列の件数
+
+    Returns:
+        np.ndarray: 新しい配列（count件目以降は未初期化）
+    """
+    grown = np.empty(capacity, dtype=array.dtype)
+    grown[:count] = array[:count]
+    return grown
+
+
+def _train_centroids(
+    sample: np.ndarray, nlist: int, iterations: int, rng: np.random.Generator
+) -> np.ndarray:
+    """サンプルから球面k-meansでnlist個のセントロイドを学習"""
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _nearest_centroids(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=nlist)
+
+        # 空クラスタはランダムなサンプルで再初期化
+        empty = np.flatnonzero(counts == 0)
+        if len(empty) > 0:
+            sums[empty] = sample[rng.choice(len(sample), len(empty))]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms
+    return centroids
+
+
+def _nearest_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """各ベクトルに最も近いセントロイドの番号を返す（チャンク単位で計算）"""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _ASSIGN_CHUNK_SIZE):
+        chunk = vectors[start : start + _ASSIGN_CHUNK_SIZE]
+        labels[start : start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return labels
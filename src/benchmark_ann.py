@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+近似最近傍インデックス（IVF）のrecall@kベンチマークスクリプト
+
+合成データ（クラスタ構造を持つランダムベクトル）で、全件走査による厳密検索と
+IVFによる近似検索を比較し、nprobeごとのrecall@kとレイテンシを表示します。
+実データで計測する場合は --db でデータベースを指定してください。
+
+使用例:
+    python src/benchmark_ann.py --size 200000
+    python src/benchmark_ann.py --db data/knowledge.db --nprobe 1 5 10 20 50
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from ann_index import IVFIndex
+from embedding_index import EmbeddingIndex, normalize_rows
+
+
+def _synthetic_vectors(topics, size, noise_scale, rng):
+    """トピック中心の周りに分布する合成ベクトルを生成"""
+    labels = rng.integers(0, len(topics), size)
+    noise = rng.standard_normal((size, topics.shape[1]), dtype=np.float32)
+    noise *= noise_scale
+    return normalize_rows(topics[labels] + noise)
+
+
+def _recall_at_k(exact_results, approx_results):
+    """厳密検索の上位k件のうち近似検索で見つかった割合"""
+    exact_ids = {r.message_id for r in exact_results}
+    if not exact_ids:
+        return 1.0
+    approx_ids = {r.message_id for r in approx_results}
+    return len(exact_ids & approx_ids) / len(exact_ids)
+
+
+def run_benchmark(index, queries, top_k, nprobes, nlist):
+    """
+    nprobeごとのrecall@kとレイテンシを計測して表示
+
+    Args:
+        index: 検索対象のEmbeddingIndex
+        queries: クエリ行列
+        top_k: 取得件数
+        nprobes: 計測するnprobeのリスト
+        nlist: クラスタ数（Noneの場合は自動決定）
+    """
+    start = time.perf_counter()
+    ann = IVFIndex.train(index.vectors, index.message_ids, nlist=nlist)
+    print(f"学習時間: {time.perf_counter() - start:.1f}秒（クラスタ数: {ann.nlist}）")
+    index.attach_ann(ann)
+
+    exact_results = []
+    start = time.perf_counter()
+    for query in queries:
+        exact_results.append(index.search(query, top_k, exact=True))
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    print()
+    print(f"{'nprobe':>8} | {f'recall@{top_k}':>10} | {'平均(ms)':>10} | {'高速化':>8}")
+    print("-" * 46)
+    print(f"{'厳密':>8} | {1.0:>10.3f} | {exact_ms:>10.2f} | {'1.0x':>8}")
+
+    for nprobe in nprobes:
+        ann.nprobe = nprobe
+        recalls = []
+        start = time.perf_counter()
+        approx_results = [index.search(query, top_k) for query in queries]
+        approx_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        for exact, approx in zip(exact_results, approx_results):
+            recalls.append(_recall_at_k(exact, approx))
+        print(
+            f"{nprobe:>8} | {np.mean(recalls):>10.3f} | {approx_ms:>10.2f} | "
+            f"{exact_ms / approx_ms:>7.1f}x"
+        )
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(
+        description="IVFインデックスのrecall@kベンチマーク"
+    )
+    parser.add_argument("--db", help="実データのデータベースパス（省略時は合成データ）")
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--topics", type=int, default=2000)
+    parser.add_argument(
+        "--noise", type=float, default=0.06, help="合成データのトピック内のばらつき"
+    )
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 5, 10, 20, 50])
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("近似最近傍インデックス recall@k ベンチマーク")
+    print("=" * 60)
+
+    rng = np.random.default_rng(0)
+    if args.db:
+        from knowledge_db import KnowledgeDB
+
+        index = EmbeddingIndex.from_db(KnowledgeDB(args.db))
+        # クエリにはコーパス内のベクトルに少しノイズを加えたものを使用
+        picks = rng.choice(len(index), min(args.queries, len(index)), replace=False)
+        noise = rng.standard_normal((len(picks), index.dim), dtype=np.float32) * 0.05
+        queries = normalize_rows(index.vectors[picks] + noise)
+    else:
+        topics = normalize_rows(
+            rng.standard_normal((args.topics, args.dim), dtype=np.float32)
+        )
+        corpus = _synthetic_vectors(topics, args.size, args.noise, rng)
+        index = EmbeddingIndex(
+            np.arange(args.size), [""] * args.size, corpus, normalized=True
+        )
+        queries = _synthetic_vectors(topics, args.queries, args.noise, rng)
+
+    print(f"件数: {len(index)}, 次元数: {index.dim}, クエリ数: {len(queries)}")
+    run_benchmark(index, queries, args.top_k, args.nprobe, args.nlist)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+マイクロバッチ埋め込みのスループット／レイテンシベンチマークスクリプト
+
+複数のクライアントスレッドから同時にクエリを投げ、バッチサイズと待機時間の
+組み合わせごとにスループット（queries/sec）とp50/p99レイテンシを表示します。
+バッチサイズ1はバッチ化なし（各スレッドが直接encodeを呼ぶ）を表します。
+
+使用例:
+    python src/benchmark_batch_encoder.py
+    python src/benchmark_batch_encoder.py --clients 64 --batch-sizes 1 32 --wait-ms 1 5
+    python src/benchmark_batch_encoder.py --simulate  # モデル無しで動作を確認
+"""
+
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from batch_encoder import MicroBatchEncoder
+
+
+class _SimulatedModel:
+    """呼び出しごとの固定コストと1件あたりのコストを持つ埋め込みモデルの代替"""
+
+    def __init__(self, overhead_ms=5.0, per_item_ms=0.3, dim=384):
+        self.overhead = overhead_ms / 1000
+        self.per_item = per_item_ms / 1000
+        self.dim = dim
+        self._lock = threading.Lock()
+
+    def encode(self, texts, show_progress_bar=False):
+        single = isinstance(texts, str)
+        batch = [texts] if single else texts
+        # CPUを1つのモデルで共有している状況を再現するため直列化
+        with self._lock:
+            time.sleep(self.overhead + self.per_item * len(batch))
+        embeddings = np.zeros((len(batch), self.dim), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+
+def _run_clients(encode, clients, queries_per_client):
+    """クライアントスレッドからクエリを投げ、(経過秒, レイテンシ配列)を返す"""
+    latencies = [[] for _ in range(clients)]
+    barrier = threading.Barrier(clients + 1)
+
+    def client(index):
+        barrier.wait()
+        for i in range(queries_per_client):
+            start = time.perf_counter()
+            encode(f"クライアント{index}の質問{i}: ボイスチャンネルに入るには？")
+            latencies[index].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return elapsed, np.concatenate([np.array(x) for x in latencies])
+
+
+def run_benchmark(model, clients, queries_per_client, batch_sizes, wait_ms_list):
+    """
+    バッチサイズと待機時間の組み合わせごとに計測して表示
+
+    Args:
+        model: encodeメソッドを持つ埋め込みモデル
+        clients: 同時に問い合わせるクライアント数
+        queries_per_client: クライアントあたりのクエリ数
+        batch_sizes: 計測する最大バッチサイズのリスト
+        wait_ms_list: 計測する最大待機時間（ミリ秒）のリスト
+    """
+    print(
+        f"{'バッチ':>6} | {'待機(ms)':>8} | {'queries/s':>10} | "
+        f"{'p50(ms)':>8} | {'p99(ms)':>8} | {'平均バッチ':>10}"
+    )
+    print("-" * 68)
+
+    for batch_size in batch_sizes:
+        for wait_ms in wait_ms_list if batch_size > 1 else [0.0]:
+            encoder = None
+            if batch_size > 1:
+                encoder = MicroBatchEncoder(
+                    lambda texts: model.encode(texts, show_progress_bar=False),
+                    max_batch_size=batch_size,
+                    max_wait_ms=wait_ms,
+                )
+                encode = encoder.encode
+            else:
+                encode = model.encode
+
+            elapsed, latencies = _run_clients(encode, clients, queries_per_client)
+            average_batch = encoder.average_batch_size if encoder else 1.0
+            if encoder:
+                encoder.close()
+
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+            throughput = len(latencies) / elapsed
+            print(
+                f"{batch_size:>6} | {wait_ms:>8.1f} | {throughput:>10,.0f} | "
+                f"{p50:>8.1f} | {p99:>8.1f} | {average_batch:>10.1f}"
+            )
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="マイクロバッチ埋め込みベンチマーク")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--queries", type=int, default=20, help="クライアントあたり")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--wait-ms", type=float, nargs="+", default=[1.0, 2.0, 5.0])
+    parser.add_argument(
+        "--simulate",
+        action="store_true",
+        help="埋め込みモデルの代わりにコストを模擬したスタブを使用",
+    )
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("マイクロバッチ埋め込みベンチマーク")
+    print("=" * 60)
+
+    if args.simulate:
+        model = _SimulatedModel()
+        print("モデル: シミュレーション")
+    else:
+        from sentence_transformers import SentenceTransformer
+
+        model = SentenceTransformer("all-MiniLM-L6-v2")
+        model.encode(["ウォームアップ"], show_progress_bar=False)
+        print("モデル: all-MiniLM-L6-v2")
+    print(
+        f"クライアント数: {args.clients}, クライアントあたりのクエリ数: {args.queries}"
+    )
+    print()
+
+    run_benchmark(model, args.clients, args.queries, args.batch_sizes, args.wait_ms)
+
+
+if __name__ == "__main__":
+    main()
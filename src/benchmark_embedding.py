@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+埋め込み生成スループットのベンチマークスクリプト
+
+合成メッセージをワーカー数ごとにEmbeddingWorkerPoolで埋め込み、
+messages/secと最初のワーカー数に対する高速化率を表示します。
+モデルのロード時間を除くため、計測前に各ワーカーでウォームアップを行います。
+
+使用例:
+    python src/benchmark_embedding.py
+    python src/benchmark_embedding.py --size 20000 --workers 1 2 4 8 16 32
+"""
+
+import argparse
+import os
+import time
+
+from embedding_workers import EmbeddingWorkerPool
+
+DEFAULT_SIZE = 10_000
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def _synthetic_chunks(size, chunk_size):
+    """合成メッセージのチャンクを生成"""
+    for start in range(0, size, chunk_size):
+        count = min(chunk_size, size - start)
+        texts = [
+            f"メッセージ {i}: ボイスチャンネルに参加するにはどうすればいいですか？"
+            for i in range(start, start + count)
+        ]
+        yield count, texts
+
+
+def run_benchmark(size, chunk_size, worker_counts):
+    """
+    ワーカー数ごとにスループットを計測して表示
+
+    Args:
+        size: 埋め込むメッセージ数
+        chunk_size: 1チャンクあたりのメッセージ数
+        worker_counts: 計測するワーカー数のリスト
+    """
+    print(f"{'ワーカー数':>10} | {'messages/sec':>14} | {'高速化':>8}")
+    print("-" * 40)
+
+    baseline = None
+    for workers in worker_counts:
+        with EmbeddingWorkerPool(workers) as pool:
+            # 全ワーカーでモデルのロードを済ませる
+            list(pool.imap(_synthetic_chunks(workers * 2 * 8, 8)))
+
+            processed = 0
+            start = time.perf_counter()
+            for count, _ in pool.imap(_synthetic_chunks(size, chunk_size)):
+                processed += count
+            elapsed = time.perf_counter() - start
+
+        throughput = processed / elapsed
+        if baseline is None:
+            baseline = throughput
+        print(f"{workers:>10} | {throughput:>14,.0f} | {throughput / baseline:>7.1f}x")
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="埋め込み生成スループットベンチマーク")
+    parser.add_argument("--size", type=int, default=DEFAULT_SIZE)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8],
+        help="計測するワーカー数",
+    )
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("埋め込み生成スループットベンチマーク")
+    print("=" * 60)
+    print(f"件数: {args.size}, チャンクサイズ: {args.chunk_size}")
+    print(f"CPUコア数: {os.cpu_count()}")
+    print()
+
+    run_benchmark(args.size, args.chunk_size, args.workers)
+
+
+if __name__ == "__main__":
+    main()
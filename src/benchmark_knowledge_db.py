@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+知識データベースの書き込みスループットベンチマークスクリプト
+
+合成メッセージを一時データベースに一括挿入し、rows/secを計測します。
+2回目の挿入（全件が既存でスキップされる増分更新）と、
+全文検索（search_fulltext）1回あたりのレイテンシの中央値も併せて計測します。
+
+使用例:
+    python src/benchmark_knowledge_db.py
+    python src/benchmark_knowledge_db.py --sizes 100000 --batch-size 5000
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from knowledge_db import KnowledgeDB
+
+DEFAULT_SIZES = [100_000, 1_000_000]
+DEFAULT_BATCH_SIZE = 10_000
+
+# 合成メッセージの話題（全文検索の一致件数がコーパスの一部になるように）
+_TOPICS = [
+    "ボイスチャンネルへの参加方法について",
+    "/setup コマンドで初期設定",
+    "Minecraftサーバーのアドレス",
+    "イベントの開催日程",
+    "ロールの付け方",
+    "画像の投稿ルール",
+    "Botの不具合報告",
+    "自己紹介チャンネルの使い方",
+]
+
+# 全文検索のレイテンシ計測に使うクエリ
+# （一致件数の多い語のみのクエリと、識別力の高い語を含むクエリ）
+_FULLTEXT_QUERIES = [
+    "ボイスチャンネルに入るには",
+    "setupのやり方",
+    "REQ123Xの状況は？",
+    "Minecraftサーバー REQ042X",
+]
+
+
+def _synthetic_messages(start, count):
+    """合成メッセージを生成"""
+    return [
+        {
+            "id": i,
+            "channel_id": 1000 + i % 50,
+            "channel_name": f"channel-{i % 50}",
+            "author_id": 2000 + i % 300,
+            "author_name": f"user-{i % 300}",
+            "content": (
+                f"合成メッセージ {i}: {_TOPICS[i % len(_TOPICS)]}"
+                f"（チケットREQ{i % 997:03d}X）"
+            ),
+            "created_at": "2024-01-01T00:00:00",
+            "timestamp": 1704067200.0 + i,
+        }
+        for i in range(start, start + count)
+    ]
+
+
+def _insert_all(db, size, batch_size):
+    """全件をバッチ単位で挿入し、(挿入数, スキップ数, 経過秒)を返す"""
+    inserted_total = 0
+    skipped_total = 0
+    elapsed = 0.0
+    for start in range(0, size, batch_size):
+        messages = _synthetic_messages(start, min(batch_size, size - start))
+        begin = time.perf_counter()
+        inserted, skipped = db.insert_messages_batch(messages)
+        elapsed += time.perf_counter() - begin
+        inserted_total += inserted
+        skipped_total += skipped
+    return inserted_total, skipped_total, elapsed
+
+
+def run_benchmark(sizes, batch_size):
+    """
+    サイズごとにベンチマークを実行して結果を表示
+
+    Args:
+        sizes: 挿入するメッセージ数のリスト
+        batch_size: 1回のinsert_messages_batchに渡す件数
+    """
+    print(
+        f"{'件数':>10} | {'新規挿入(rows/s)':>16} | {'既存スキップ(rows/s)':>20} | "
+        f"{'全文検索(ms)':>12}"
+    )
+    print("-" * 70)
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db = KnowledgeDB(os.path.join(temp_dir, "benchmark.db"))
+
+            inserted, _, insert_sec = _insert_all(db, size, batch_size)
+            _, skipped, skip_sec = _insert_all(db, size, batch_size)
+            search_ms = _measure_fulltext(db)
+            db.close()
+
+        if inserted != size or skipped != size:
+            print(f"⚠️ 件数が一致しません: 挿入{inserted}件, スキップ{skipped}件")
+        print(
+            f"{size:>10} | {size / insert_sec:>16,.0f} | {size / skip_sec:>20,.0f} | "
+            f"{search_ms:>12.2f}"
+        )
+
+
+def _measure_fulltext(db, repeat=5):
+    """全文検索1回あたりの実行時間（ミリ秒）の中央値を返す"""
+    timings = []
+    for _ in range(repeat):
+        for query in _FULLTEXT_QUERIES:
+            start = time.perf_counter()
+            db.search_fulltext(query, limit=20)
+            timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="知識データベース書き込みベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("知識データベース書き込みベンチマーク")
+    print("=" * 60)
+    print(f"バッチサイズ: {args.batch_size}")
+    print()
+
+    run_benchmark(args.sizes, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
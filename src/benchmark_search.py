@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+類似検索ベンチマークスクリプト
+
+ランダムな埋め込みデータを使用して、1クエリあたりの検索レイテンシを計測します。
+
+- 従来方式: Pythonのリストを毎回テンソル化・正規化してコサイン類似度を計算
+- 現行方式: 正規化済みの常駐行列（EmbeddingIndex）との行列・ベクトル積
+- 上位k件の抽出: 全件ソート（argsort）と部分選択（argpartition）の比較
+- 複数クエリ: 1件ずつの検索と一括検索（行列・行列積）の合計時間の比較
+
+使用例:
+    python src/benchmark_search.py
+    python src/benchmark_search.py --sizes 10000 100000 --queries 50
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from embedding_index import EmbeddingIndex, top_k_indices
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_DIM = 384
+DEFAULT_TOP_K = 5
+
+
+def _legacy_search(query_emb, embeddings_list, top_k):
+    """従来方式の検索（リストをクエリごとに変換・正規化）"""
+    try:
+        from sentence_transformers import util
+
+        scores = util.cos_sim(query_emb, embeddings_list)[0]
+        return scores.argsort(descending=True)[:top_k]
+    except ImportError:
+        # sentence_transformersが無い環境では同等の処理をNumPyで再現
+        corpus = np.asarray(embeddings_list, dtype=np.float32)
+        corpus = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+        query = query_emb / np.linalg.norm(query_emb)
+        scores = corpus @ query
+        return np.argsort(-scores)[:top_k]
+
+
+def _measure(func, queries):
+    """各クエリの実行時間（ミリ秒）の中央値を返す"""
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def run_benchmark(sizes, dim, num_queries, top_k, legacy_max_rows):
+    """
+    サイズごとにベンチマークを実行して結果を表示
+
+    Args:
+        sizes: コーパスの件数のリスト
+        dim: 埋め込みの次元数
+        num_queries: 計測するクエリ数
+        top_k: 取得件数
+        legacy_max_rows: 従来方式を計測する最大件数（メモリ消費が大きいため）
+    """
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((num_queries, dim), dtype=np.float32)
+
+    print(f"{'件数':>10} | {'従来方式(ms)':>14} | {'現行方式(ms)':>14} | {'高速化':>8}")
+    print("-" * 58)
+
+    for size in sizes:
+        corpus = rng.standard_normal((size, dim), dtype=np.float32)
+        index = EmbeddingIndex(np.arange(size), [""] * size, corpus)
+        current_ms = _measure(lambda q: index.search(q, top_k), queries)
+
+        if size <= legacy_max_rows:
+            corpus_list = corpus.tolist()
+            legacy_ms = _measure(
+                lambda q: _legacy_search(q, corpus_list, top_k), queries
+            )
+            del corpus_list
+            speedup = f"{legacy_ms / current_ms:.1f}x"
+            legacy_text = f"{legacy_ms:.2f}"
+        else:
+            legacy_text = "スキップ"
+            speedup = "-"
+
+        print(f"{size:>10} | {legacy_text:>14} | {current_ms:>14.2f} | {speedup:>8}")
+
+    print()
+    print(f"{'件数':>10} | {'全件ソート(ms)':>14} | {'部分選択(ms)':>14}")
+    print("-" * 46)
+    for size in sizes:
+        scores = [rng.standard_normal(size, dtype=np.float32) for _ in range(3)]
+        sort_ms = _measure(lambda s: np.argsort(-s)[:top_k], scores)
+        partial_ms = _measure(lambda s: top_k_indices(s, top_k), scores)
+        print(f"{size:>10} | {sort_ms:>14.2f} | {partial_ms:>14.2f}")
+
+    print()
+    print(f"{'件数':>10} | {'1件ずつ(ms)':>14} | {'一括検索(ms)':>14} | {'高速化':>8}")
+    print("-" * 58)
+    for size in sizes:
+        corpus = rng.standard_normal((size, dim), dtype=np.float32)
+        index = EmbeddingIndex(np.arange(size), [""] * size, corpus)
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query, top_k)
+        single_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        index.search_batch(queries, top_k)
+        batch_ms = (time.perf_counter() - start) * 1000
+        print(
+            f"{size:>10} | {single_ms:>14.2f} | {batch_ms:>14.2f} | "
+            f"{single_ms / batch_ms:>7.1f}x"
+        )
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="類似検索ベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K)
+    parser.add_argument(
+        "--legacy-max-rows",
+        type=int,
+        default=100_000,
+        help="従来方式を計測する最大件数（リスト形式はメモリ消費が大きいため）",
+    )
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("類似検索ベンチマーク")
+    print("=" * 60)
+    print(f"次元数: {args.dim}, クエリ数: {args.queries}, top_k: {args.top_k}")
+    print()
+
+    run_benchmark(args.sizes, args.dim, args.queries, args.top_k, args.legacy_max_rows)
+
+
+if __name__ == "__main__":
+    main()
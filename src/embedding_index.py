@@ -0,0 +1,1214 @@
+"""
+埋め込みベクトル検索インデックスモジュール
+
+知識データの埋め込みをL2正規化済みの連続したfloat32行列としてメモリ上に保持します。
+正規化はロード時に一度だけ行うため、クエリごとのコサイン類似度は
+行列・ベクトル積1回で計算できます。
+上位k件の抽出は部分選択（argpartition）で行い、全件のソートは行いません。
+近似最近傍インデックス（IVFIndex）を接続すると、候補クラスタのみを走査します。
+複数クエリの一括検索は行列・行列積で行い、クエリとコーパスをブロックに分けて
+一時的なスコア行列の大きさを抑えます。
+行と対応するメタデータ列（チャンネル・カテゴリ・重要度・日時・投稿者）を保持し、
+フィルタはベクトル化したマスクとして上位k件の抽出前に適用します。
+全文検索の結果とは、順位の逆数の和（Reciprocal Rank Fusion）で融合できます。
+新しい埋め込みは差分だけを読み込み、変更しない基本セグメント（スナップショットなど）と
+追加分の差分セグメントからなるSegmentedIndexとして追加できます。差分セグメントの列は
+余裕を持って確保したバッファに書き足すため、追加の処理量は追加件数だけで決まり、
+既存のインデックスは変更されないため、検索中でも差し替え可能です。
+差分セグメントが一定の件数に達すると変更しないセグメントとして確定し、
+確定したセグメント同士は件数が倍になるごとにまとめて、セグメント数を抑えます。
+"""
+
+from bisect import bisect_right
+from itertools import accumulate, chain
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 一括検索で一度に計算するスコア行列のブロックサイズ
+# （float32で 256 × 32768 × 4バイト = 32MB）
+SEARCH_BATCH_QUERY_CHUNK = 256
+SEARCH_BATCH_CORPUS_CHUNK = 32768
+
+# Reciprocal Rank Fusionの定数（上位の順位差の影響を緩和する）
+RRF_K = 60
+
+# 差分セグメントを確定して新しい差分セグメントを開始する件数
+DELTA_SEGMENT_MAX_ROWS = 16_384
+
+# 差分セグメントへの追加時に確保する列の余裕（追加のたびに全体をコピーしないため）
+_EXTEND_GROWTH = 1.5
+_EXTEND_MIN_CAPACITY = 1024
+
+# 差分セグメントのバッファに保持するメタデータ列と型
+_METADATA_COLUMNS = (
+    ("channel_ids", np.int64),
+    ("author_ids", np.int64),
+    ("importance", np.int32),
+    ("timestamps", np.float64),
+    ("category_codes", np.int32),
+)
+
+
+class SearchResult(NamedTuple):
+    """類似検索の結果1件"""
+
+    message_id: int
+    score: float
+    text: str
+
+
+class IndexMetadata(NamedTuple):
+    """埋め込み行列の各行に対応するメッセージのメタデータ列"""
+
+    channel_ids: np.ndarray  # int64
+    author_ids: np.ndarray  # int64
+    importance: np.ndarray  # int32
+    timestamps: np.ndarray  # float64（UNIXタイムスタンプ）
+    category_codes: np.ndarray  # int32（category_namesの番号、カテゴリ無しは-1）
+    category_names: Tuple[str, ...]
+
+    @classmethod
+    def concat(cls, first: "IndexMetadata", second: "IndexMetadata") -> "IndexMetadata":
+        """
+        2つのメタデータを行方向に連結（カテゴリ番号は統合後の番号に振り直す）
+
+        Args:
+            first: 先頭側のメタデータ
+            second: 末尾側のメタデータ
+
+        Returns:
+            IndexMetadata: 連結したメタデータ
+        """
+        names = tuple(sorted(set(first.category_names) | set(second.category_names)))
+        lookup = {name: i for i, name in enumerate(names)}
+
+        def remap(metadata):
+            # 末尾の-1（カテゴリ無し）を参照できるよう、変換表の最後に-1を置く
+            table = np.array(
+                [lookup[name] for name in metadata.category_names] + [-1], np.int32
+            )
+            return table[metadata.category_codes]
+
+        return cls(
+            np.concatenate([first.channel_ids, second.channel_ids]),
+            np.concatenate([first.author_ids, second.author_ids]),
+            np.concatenate([first.importance, second.importance]),
+            np.concatenate([first.timestamps, second.timestamps]),
+            np.concatenate([remap(first), remap(second)]),
+            names,
+        )
+
+    @classmethod
+    def from_columns(
+        cls, channel_ids, author_ids, importance, timestamps, categories
+    ) -> "IndexMetadata":
+        """
+        メタデータ列からインスタンスを作成（カテゴリは番号に変換）
+
+        Args:
+            channel_ids: チャンネルIDの配列
+            author_ids: 投稿者IDの配列
+            importance: 重要度の配列
+            timestamps: UNIXタイムスタンプの配列
+            categories: カテゴリ名のシーケンス（未設定はNone）
+
+        Returns:
+            IndexMetadata: メタデータ
+        """
+        names = tuple(sorted({c for c in categories if c is not None}))
+        lookup = {name: i for i, name in enumerate(names)}
+        codes = np.fromiter(
+            (lookup.get(c, -1) for c in categories), np.int32, len(categories)
+        )
+        return cls(
+            np.asarray(channel_ids, dtype=np.int64),
+            np.asarray(author_ids, dtype=np.int64),
+            np.asarray(importance, dtype=np.int32),
+            np.asarray(timestamps, dtype=np.float64),
+            codes,
+            names,
+        )
+
+
+class SearchFilter(NamedTuple):
+    """類似検索の絞り込み条件（指定した条件は全て満たす必要がある）"""
+
+    channel_ids: Optional[Sequence[int]] = None
+    category: Optional[str] = None
+    min_importance: Optional[int] = None
+    since: Optional[float] = None  # この時刻以降（UNIXタイムスタンプ）
+    until: Optional[float] = None  # この時刻より前（UNIXタイムスタンプ）
+    author_ids: Optional[Sequence[int]] = None
+
+    def is_empty(self) -> bool:
+        """条件が1つも指定されていない場合True"""
+        return all(value is None for value in self)
+
+
+def _metadata_from_columns(columns) -> IndexMetadata:
+    """KnowledgeDBのメタデータ列の辞書からIndexMetadataを作成"""
+    return IndexMetadata.from_columns(
+        columns["channel_id"],
+        columns["author_id"],
+        columns["importance"],
+        columns["timestamp"],
+        columns["category"],
+    )
+
+
+class _ChainedTexts:
+    """複数のテキストのシーケンスを順につないだシーケンス（コピーしない）"""
+
+    def __init__(self, *parts: Sequence[str]):
+        self.parts = parts
+        self._offsets = list(accumulate((len(part) for part in parts), initial=0))
+
+    def __len__(self) -> int:
+        return self._offsets[-1]
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        part = bisect_right(self._offsets, i) - 1
+        return self.parts[part][i - self._offsets[part]]
+
+
+class _TextsPrefix:
+    """共有するテキストのリストの先頭length件だけを参照するシーケンス（コピーしない）"""
+
+    def __init__(self, texts: List[str], length: int):
+        self.texts = texts
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError(i)
+        return self.texts[i]
+
+
+class _DeltaBuffer:
+    """
+    差分セグメントの列を余裕を持って確保したバッファ（後継のインデックスと共有）
+
+    先頭count行が使用済みで、追加は末尾に書き込むだけで済みます。
+    使用済みの行は書き換えないため、以前のインデックスはそのまま参照し続けられます。
+    カテゴリ番号は追加順に振るため、既存の行の番号は変わりません。
+    """
+
+    def __init__(self, index: "EmbeddingIndex", dim: int, capacity: int):
+        """
+        インデックスの行をコピーしてバッファを作成
+
+        Args:
+            index: コピー元のインデックス
+            dim: 埋め込みの次元数
+            capacity: 確保する行数
+        """
+        count = len(index)
+        self.count = count
+        self.vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.vectors[:count] = index.vectors
+        self.message_ids = np.empty(capacity, dtype=np.int64)
+        self.message_ids[:count] = index.message_ids
+        self.texts = [index.texts[i] for i in range(count)]
+
+        # 空のインデックスは最初の追加分にメタデータがあれば保持する
+        self.columns = None
+        self.category_names = []
+        self._category_lookup = {}
+        if count == 0 or index.metadata is not None:
+            self.columns = {}
+            for name, dtype in _METADATA_COLUMNS:
+                self.columns[name] = np.empty(capacity, dtype=dtype)
+                if count > 0:
+                    self.columns[name][:count] = getattr(index.metadata, name)
+            if count > 0:
+                self.category_names = list(index.metadata.category_names)
+                self._category_lookup = {
+                    name: i for i, name in enumerate(self.category_names)
+                }
+
+        self.ann = index.ann
+        self.assignments = None
+        if self.ann is not None:
+            self.assignments = np.empty(capacity, dtype=np.int32)
+            self.assignments[:count] = index._ann_assignments
+
+    def extends(self, index: "EmbeddingIndex") -> bool:
+        """indexの末尾にそのまま書き足せる（indexがこのバッファの最新の状態）場合True"""
+        return (
+            self.count == len(index)
+            and (self.columns is not None) == (index.metadata is not None)
+            and self.ann is index.ann
+        )
+
+    def append(
+        self,
+        vectors: np.ndarray,
+        message_ids,
+        texts: Sequence[str],
+        metadata: Optional[IndexMetadata],
+    ) -> int:
+        """
+        行を末尾に書き込み、追加後の件数を返す
+
+        容量が不足する場合は余裕を持って確保し直します（以前の配列は参照中の
+        インデックスのためにそのまま残ります）。
+        """
+        count = self.count
+        total = count + len(vectors)
+        if len(self.vectors) < total:
+            capacity = max(int(total * _EXTEND_GROWTH), _EXTEND_MIN_CAPACITY)
+            self.vectors = _grow(self.vectors, count, capacity)
+            self.message_ids = _grow(self.message_ids, count, capacity)
+            if self.columns is not None:
+                self.columns = {
+                    name: _grow(column, count, capacity)
+                    for name, column in self.columns.items()
+                }
+            if self.assignments is not None:
+                self.assignments = _grow(self.assignments, count, capacity)
+
+        self.vectors[count:total] = vectors
+        self.message_ids[count:total] = message_ids
+        self.texts.extend(texts)
+        if self.columns is not None and metadata is None:
+            # メタデータの無い行が加わった以降はメタデータ無し
+            self.columns = None
+        if self.columns is not None:
+            for name, _ in _METADATA_COLUMNS[:-1]:
+                self.columns[name][count:total] = getattr(metadata, name)
+            self.columns["category_codes"][count:total] = self._category_table(
+                metadata.category_names
+            )[metadata.category_codes]
+        if self.assignments is not None:
+            self.assignments[count:total] = self.ann.assign(vectors)
+        self.count = total
+        return total
+
+    def _category_table(self, names: Sequence[str]) -> np.ndarray:
+        """追加分のカテゴリ番号をバッファの番号に変換する表（末尾は-1のまま）"""
+        for name in names:
+            if name not in self._category_lookup:
+                self._category_lookup[name] = len(self.category_names)
+                self.category_names.append(name)
+        return np.array(
+            [self._category_lookup[name] for name in names] + [-1], dtype=np.int32
+        )
+
+    def metadata(self, count: int) -> Optional[IndexMetadata]:
+        """先頭count行のメタデータ（バッファを参照し、コピーしない）"""
+        if self.columns is None:
+            return None
+        return IndexMetadata(
+            *(self.columns[name][:count] for name, _ in _METADATA_COLUMNS),
+            tuple(self.category_names),
+        )
+
+
+def _grow(array: np.ndarray, count: int, capacity: int) -> np.ndarray:
+    """先頭count行をコピーした容量capacity行の配列を返す（残りは未初期化）"""
+    grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:count] = array[:count]
+    return grown
+
+
+def normalize_rows(matrix) -> np.ndarray:
+    """
+    行ごとにL2正規化したfloat32の連続配列を返す
+
+    ノルムが0の行（ゼロベクトル）はそのまま0のまま残します。
+
+    Args:
+        matrix: 1次元ベクトルまたは2次元行列
+
+    Returns:
+        np.ndarray: 正規化済みのfloat32配列（入力と同じ形状）
+    """
+    array = np.asarray(matrix, dtype=np.float32)
+    if array.ndim == 1:
+        norm = float(np.linalg.norm(array))
+        return array / norm if norm > 0 else array.copy()
+
+    norms = np.linalg.norm(array, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(array / norms, dtype=np.float32)
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    スコアの高い順に上位k件の位置を返す
+
+    argpartitionによるO(n)の部分選択の後、選ばれたk件だけをソートします。
+
+    Args:
+        scores: スコアの1次元配列
+        top_k: 取得する件数
+
+    Returns:
+        np.ndarray: スコアの高い順の位置
+    """
+    n = len(scores)
+    if top_k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < n:
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(n)
+    order = np.argsort(-scores[candidates], kind="stable")
+    return candidates[order]
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[int]], k: int = RRF_K
+) -> List[int]:
+    """
+    複数の順位リストをReciprocal Rank Fusionで1つに統合
+
+    各リストでの順位rに対して 1 / (k + r) を加算し、合計の高い順に並べます。
+    スコアの尺度が異なる検索（BM25とコサイン類似度など）をそのまま融合できます。
+
+    Args:
+        rankings: 関連の高い順に並んだキーのリストのシーケンス
+        k: 順位に加算する定数
+
+    Returns:
+        List[int]: 統合後のスコアの高い順のキー（同点は先に現れた順）
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(fused, key=fused.__getitem__, reverse=True)
+
+
+def _cluster_lists(positions: np.ndarray, assignments: np.ndarray, nlist: int):
+    """クラスタ番号ごとに行番号をまとめたリストを作成"""
+    order = np.argsort(assignments, kind="stable")
+    bounds = np.searchsorted(assignments[order], np.arange(nlist + 1))
+    return [positions[order[bounds[i] : bounds[i + 1]]] for i in range(nlist)]
+
+
+def _merge_results(result_lists, top_k: int) -> List[SearchResult]:
+    """セグメントごとの検索結果を類似度の高い順に統合して上位k件を返す"""
+    merged = sorted(chain.from_iterable(result_lists), key=lambda r: -r.score)
+    return merged[:top_k]
+
+
+class _SearchableIndex:
+    """EmbeddingIndexとSegmentedIndexに共通の差分読み込み・ハイブリッド検索"""
+
+    def extend_from_db(self, db):
+        """
+        前回の読み込み以降に追加された埋め込みだけを読み込み、追加したインデックスを返す
+
+        全件を対象に構築したインデックス（from_db・スナップショット）向けです。
+
+        Args:
+            db: KnowledgeDBインスタンス
+
+        Returns:
+            追加後のインデックス（新しい埋め込みが無い場合はself）
+        """
+        if db.get_max_embedding_seq() <= self.max_seq:
+            return self
+        message_ids, texts, matrix, columns = db.get_embedding_matrix_with_metadata(
+            after_seq=self.max_seq
+        )
+        if len(message_ids) == 0:
+            return self
+        return self.extend(
+            message_ids,
+            texts,
+            matrix,
+            metadata=_metadata_from_columns(columns),
+            max_seq=int(columns["seq"].max()),
+        )
+
+    def search_hybrid(
+        self,
+        query_embedding,
+        lexical_ids,
+        top_k: int = 3,
+        candidates: int = 20,
+        filters: Optional[SearchFilter] = None,
+    ) -> List[SearchResult]:
+        """
+        ベクトル検索と全文検索の結果をReciprocal Rank Fusionで融合して上位k件を返す
+
+        ベクトル検索の上位candidates件と全文検索の結果を順位で融合します。
+        全文検索のみで見つかったメッセージも、スコアにはコサイン類似度を返します。
+
+        Args:
+            query_embedding: クエリの埋め込みベクトル
+            lexical_ids: 全文検索でスコアの高い順に並んだメッセージID
+            top_k: 取得する件数
+            candidates: ベクトル検索で融合の対象とする件数
+            filters: 絞り込み条件（全文検索の結果にも適用）
+
+        Returns:
+            List[SearchResult]: 融合後の順位の高い順の検索結果
+        """
+        if len(self) == 0 or top_k <= 0:
+            return []
+
+        vector_results = self.search(
+            query_embedding, max(top_k, candidates), filters=filters
+        )
+        lexical_ids = np.asarray(lexical_ids, dtype=np.int64)
+        lexical_ids = lexical_ids[self._lexical_mask(lexical_ids, filters)]
+        if len(lexical_ids) == 0:
+            return vector_results[:top_k]
+
+        fused_ids = reciprocal_rank_fusion(
+            [
+                [result.message_id for result in vector_results],
+                lexical_ids.tolist(),
+            ]
+        )[:top_k]
+        return self._results_for_ids(fused_ids, query_embedding)
+
+
+class EmbeddingIndex(_SearchableIndex):
+    """正規化済み埋め込み行列による類似検索インデックス"""
+
+    def __init__(
+        self,
+        message_ids,
+        texts: Sequence[str],
+        embeddings,
+        normalized: bool = False,
+        metadata: Optional[IndexMetadata] = None,
+        max_seq: int = 0,
+    ):
+        """
+        インデックスを構築
+
+        Args:
+            message_ids: メッセージIDの配列
+            texts: メッセージ本文のシーケンス（行列の行と同じ順序）
+            embeddings: 埋め込み行列（件数×次元数）
+            normalized: 埋め込みがL2正規化済みの場合True（コピーを省略）
+            metadata: 行と対応するメタデータ列（省略時はフィルタ検索不可）
+            max_seq: 読み込み済みの埋め込みの連番の最大値（差分の読み込みに使用）
+
+        Raises:
+            ValueError: 件数が一致しない場合
+        """
+        self.message_ids = np.asarray(message_ids, dtype=np.int64)
+        self.texts = texts
+        if normalized:
+            self.vectors = np.asarray(embeddings, dtype=np.float32)
+        else:
+            self.vectors = normalize_rows(embeddings)
+
+        if not (len(self.message_ids) == len(self.texts) == len(self.vectors)):
+            raise ValueError(
+                "メッセージID・テキスト・埋め込みの件数が一致しません: "
+                f"{len(self.message_ids)}, {len(self.texts)}, {len(self.vectors)}"
+            )
+        if metadata is not None:
+            lengths = {len(column) for column in metadata[:-1]}
+            if lengths != {len(self.vectors)}:
+                raise ValueError(
+                    "メタデータの件数が埋め込みと一致しません: "
+                    f"{sorted(lengths)}, {len(self.vectors)}"
+                )
+        self.metadata = metadata
+        self.max_seq = max_seq
+        # 差分追加用のバッファ（_appendで作成し、後継と共有）
+        self._buffer = None
+        # message_idsを昇順に並べる行番号（positions_ofの初回呼び出し時に作成）
+        self._sorter = None
+
+        self.ann = None
+        self._ann_lists = None  # クラスタ番号ごとの行番号の配列
+        self._ann_assignments = None  # 行ごとのクラスタ番号（差分セグメントのみ）
+
+    @classmethod
+    def from_db(
+        cls,
+        db,
+        category: Optional[str] = None,
+        min_importance: Optional[int] = None,
+    ) -> "EmbeddingIndex":
+        """
+        KnowledgeDBから埋め込みを読み込んでインデックスを構築
+
+        Args:
+            db: KnowledgeDBインスタンス
+            category: カテゴリでフィルタ（省略時は全て）
+            min_importance: 最小重要度でフィルタ（省略時は全て）
+
+        Returns:
+            EmbeddingIndex: 構築されたインデックス
+        """
+        message_ids, texts, matrix, columns = db.get_embedding_matrix_with_metadata(
+            category, min_importance
+        )
+        return cls(
+            message_ids,
+            texts,
+            matrix,
+            metadata=_metadata_from_columns(columns),
+            max_seq=int(columns["seq"].max()) if len(message_ids) else 0,
+        )
+
+    def extend(
+        self,
+        message_ids,
+        texts: Sequence[str],
+        embeddings,
+        metadata: Optional[IndexMetadata] = None,
+        max_seq: Optional[int] = None,
+    ) -> "SegmentedIndex":
+        """
+        このインデックスを基本セグメントとし、行を差分セグメントに追加したインデックスを返す
+
+        このインデックスの行列・メッセージID・テキストはコピーせずにそのまま共有します
+        （このインデックスは変更しないため、検索中のスレッドがあっても安全に差し替えられます）。
+        ANNインデックスが接続されている場合は、追加分だけを既存のクラスタに割り当てます。
+
+        Args:
+            message_ids: 追加するメッセージIDの配列
+            texts: 追加するメッセージ本文のシーケンス
+            embeddings: 追加する埋め込み行列（正規化不要）
+            metadata: 追加する行のメタデータ
+            max_seq: 追加後の連番の最大値（省略時は変更なし）
+
+        Returns:
+            SegmentedIndex: 追加後のインデックス（追加する行が無い場合はself）
+
+        Raises:
+            ValueError: 次元数や件数が一致しない場合
+        """
+        if len(message_ids) == 0:
+            return self
+        dim = np.shape(np.atleast_2d(embeddings))[1]
+        if len(self) > 0 and dim != self.dim:
+            raise ValueError(f"埋め込みの次元数が一致しません: {dim}, {self.dim}")
+
+        # 空の差分セグメントに追加する（以降の追加でバッファを共有するため）
+        delta = _empty_segment(dim, self.max_seq, self.ann)
+        delta = delta._append(message_ids, texts, embeddings, metadata, max_seq)
+        return SegmentedIndex(self, delta)
+
+    def _append(
+        self,
+        message_ids,
+        texts: Sequence[str],
+        embeddings,
+        metadata: Optional[IndexMetadata] = None,
+        max_seq: Optional[int] = None,
+    ) -> "EmbeddingIndex":
+        """
+        行を末尾に追加した新しいインデックスを返す（差分セグメント用）
+
+        行列・メッセージID・テキスト・メタデータ・クラスタ番号は余裕を持って確保した
+        バッファ（_DeltaBuffer）を後継のインデックスと共有し、追加分だけを書き込みます。
+        このインデックスの行は書き換えません。バッファを共有できない場合
+        （初回・同じインデックスから2回目の追加）のみ、このインデックスの行をコピーします。
+        ANNインデックスが接続されている場合は、追加分だけを既存のクラスタに割り当てます。
+
+        Args:
+            message_ids: 追加するメッセージIDの配列
+            texts: 追加するメッセージ本文のシーケンス
+            embeddings: 追加する埋め込み行列（正規化不要）
+            metadata: 追加する行のメタデータ（空でないインデックスといずれかが無い場合、
+                結果もメタデータ無し）
+            max_seq: 追加後の連番の最大値（省略時は変更なし）
+
+        Returns:
+            EmbeddingIndex: 追加後のインデックス
+
+        Raises:
+            ValueError: 次元数が一致しない場合
+        """
+        vectors = normalize_rows(np.atleast_2d(embeddings))
+        added = len(message_ids)
+        if added == 0:
+            return self
+        if len(self) > 0 and vectors.shape[1] != self.dim:
+            raise ValueError(
+                f"埋め込みの次元数が一致しません: {vectors.shape[1]}, {self.dim}"
+            )
+
+        buffer = self._buffer
+        if buffer is None or not buffer.extends(self):
+            # 共有できるバッファが無い・既に別の後継が追加済みの場合は作成し直す
+            total = len(self) + added
+            capacity = max(int(total * _EXTEND_GROWTH), _EXTEND_MIN_CAPACITY)
+            buffer = _DeltaBuffer(self, vectors.shape[1], capacity)
+        total = buffer.append(vectors, message_ids, texts, metadata)
+
+        index = EmbeddingIndex(
+            buffer.message_ids[:total],
+            _TextsPrefix(buffer.texts, total),
+            buffer.vectors[:total],
+            normalized=True,
+            metadata=buffer.metadata(total),
+            max_seq=self.max_seq if max_seq is None else max_seq,
+        )
+        index._buffer = buffer
+        if buffer.ann is not None:
+            index._attach_ann_assignments(buffer.ann, buffer.assignments[:total])
+        return index
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @property
+    def dim(self) -> int:
+        """埋め込みの次元数"""
+        return self.vectors.shape[1] if self.vectors.ndim == 2 else 0
+
+    def score(self, query_embedding) -> np.ndarray:
+        """
+        クエリと全メッセージのコサイン類似度を計算
+
+        Args:
+            query_embedding: クエリの埋め込みベクトル（正規化不要）
+
+        Returns:
+            np.ndarray: 各メッセージとの類似度（件数分）
+        """
+        return self.vectors @ normalize_rows(query_embedding)
+
+    def positions_of(self, message_ids) -> np.ndarray:
+        """
+        メッセージIDを行番号に変換
+
+        Args:
+            message_ids: メッセージIDの配列
+
+        Returns:
+            np.ndarray: 行番号の配列（このインデックスに無いIDは-1）
+        """
+        message_ids = np.asarray(message_ids, dtype=np.int64)
+        if len(self) == 0:
+            return np.full(len(message_ids), -1, dtype=np.int64)
+        sorter = self._sorter
+        if sorter is None:
+            # 行は変更されない（追加は新しいインスタンスになる）ため、初回のみソート
+            sorter = self._sorter = np.argsort(self.message_ids, kind="stable")
+        found = np.searchsorted(self.message_ids, message_ids, sorter=sorter)
+        positions = sorter[np.minimum(found, len(sorter) - 1)]
+        return np.where(self.message_ids[positions] == message_ids, positions, -1)
+
+    def filter_mask(self, filters: Optional[SearchFilter]) -> Optional[np.ndarray]:
+        """
+        絞り込み条件に一致する行を示す真偽値マスクを作成
+
+        Args:
+            filters: 絞り込み条件
+
+        Returns:
+            Optional[np.ndarray]: 行ごとの真偽値（条件が無い場合はNone）
+
+        Raises:
+            ValueError: メタデータを持たないインデックスで条件を指定した場合
+        """
+        if filters is None or filters.is_empty():
+            return None
+        if self.metadata is None:
+            raise ValueError(
+                "メタデータが読み込まれていないため絞り込み検索はできません"
+            )
+
+        metadata = self.metadata
+        mask = np.ones(len(self), dtype=bool)
+        if filters.channel_ids is not None:
+            channel_ids = np.atleast_1d(np.asarray(filters.channel_ids, np.int64))
+            mask &= np.isin(metadata.channel_ids, channel_ids)
+        if filters.author_ids is not None:
+            author_ids = np.atleast_1d(np.asarray(filters.author_ids, np.int64))
+            mask &= np.isin(metadata.author_ids, author_ids)
+        if filters.category is not None:
+            if filters.category in metadata.category_names:
+                code = metadata.category_names.index(filters.category)
+                mask &= metadata.category_codes == code
+            else:
+                mask[:] = False
+        if filters.min_importance is not None:
+            mask &= metadata.importance >= filters.min_importance
+        if filters.since is not None:
+            mask &= metadata.timestamps >= filters.since
+        if filters.until is not None:
+            mask &= metadata.timestamps < filters.until
+        return mask
+
+    def attach_ann(self, ann) -> int:
+        """
+        近似最近傍インデックスを接続する
+
+        ANNインデックスに未登録の行は、その場で既存のクラスタに割り当てて追加します。
+
+        Args:
+            ann: IVFIndexインスタンス
+
+        Returns:
+            int: ANNインデックスに新規追加された件数
+        """
+        added = ann.add(self.vectors, self.message_ids)
+
+        # ANNインデックスのメッセージIDを行番号に変換
+        # （フィルタ付きで構築した場合など、このインデックスに無いIDは除外）
+        positions = self.positions_of(ann.message_ids)
+        valid = positions >= 0
+        positions = positions[valid]
+        assignments = ann.assignments[valid]
+
+        self._ann_lists = _cluster_lists(positions, assignments, ann.nlist)
+        self.ann = ann
+        return added
+
+    def _attach_ann_assignments(self, ann, assignments: np.ndarray):
+        """
+        行ごとのクラスタ番号を指定して近似最近傍インデックスを接続する
+
+        ANNインデックス自体には登録しないため、ANNインデックスの件数に関係なく
+        このインデックスの件数分の処理で済みます（差分セグメント用）。
+
+        Args:
+            ann: IVFIndexインスタンス
+            assignments: 各行のクラスタ番号（ann.assignの結果）
+        """
+        self._ann_assignments = assignments
+        self._ann_lists = _cluster_lists(
+            np.arange(len(self), dtype=np.int64), assignments, ann.nlist
+        )
+        self.ann = ann
+
+    def search(
+        self,
+        query_embedding,
+        top_k: int = 3,
+        exact: bool = False,
+        filters: Optional[SearchFilter] = None,
+    ) -> List[SearchResult]:
+        """
+        類似度の高い順に上位k件を返す
+
+        ANNインデックスが接続されている場合は近似検索を行います。
+        絞り込み条件を指定した場合は、条件に一致する行だけを全件走査します。
+
+        Args:
+            query_embedding: クエリの埋め込みベクトル
+            top_k: 取得する件数
+            exact: Trueの場合はANNインデックスを使用せず全件を走査
+            filters: 絞り込み条件
+
+        Returns:
+            List[SearchResult]: 類似度の高い順の検索結果
+        """
+        if len(self) == 0 or top_k <= 0:
+            return []
+
+        query = normalize_rows(query_embedding)
+        mask = self.filter_mask(filters)
+        if mask is not None:
+            # クラスタ単位の候補では条件に一致する行が不足しうるため、ANNは使用しない
+            candidates = np.flatnonzero(mask)
+            scores = self.vectors[candidates] @ query
+            best = top_k_indices(scores, top_k)
+            return self._to_results(candidates[best], scores[best])
+
+        if self.ann is not None and not exact:
+            candidates = np.concatenate(
+                [self._ann_lists[i] for i in self.ann.probe(query)]
+            )
+            scores = self.vectors[candidates] @ query
+            best = top_k_indices(scores, top_k)
+            return self._to_results(candidates[best], scores[best])
+
+        scores = self.vectors @ query
+        best = top_k_indices(scores, top_k)
+        return self._to_results(best, scores[best])
+
+    def _lexical_mask(
+        self, message_ids: np.ndarray, filters: Optional[SearchFilter]
+    ) -> np.ndarray:
+        """メッセージIDごとに、このインデックスにあり絞り込み条件を満たすかを返す"""
+        positions = self.positions_of(message_ids)
+        found = positions >= 0
+        if not found.any():
+            return found
+        mask = self.filter_mask(filters)
+        if mask is not None:
+            found[found] = mask[positions[found]]
+        return found
+
+    def _results_for_ids(self, message_ids, query_embedding) -> List[SearchResult]:
+        """指定したメッセージIDの順に、クエリとの類似度付きの検索結果を返す"""
+        positions = self.positions_of(message_ids)
+        positions = positions[positions >= 0]
+        scores = self.vectors[positions] @ normalize_rows(query_embedding)
+        return self._to_results(positions, scores)
+
+    def search_batch(
+        self,
+        query_embeddings,
+        top_k: int = 3,
+        query_chunk_size: int = SEARCH_BATCH_QUERY_CHUNK,
+        corpus_chunk_size: int = SEARCH_BATCH_CORPUS_CHUNK,
+        filters: Optional[SearchFilter] = None,
+    ) -> List[List[SearchResult]]:
+        """
+        複数のクエリについて類似度の高い順に上位k件を返す（全件走査）
+
+        クエリのブロックとコーパスのブロックの行列・行列積でスコアを計算し、
+        ブロックごとの上位k件を統合します。一時的なスコア行列は
+        query_chunk_size × corpus_chunk_size 要素に収まります。
+
+        Args:
+            query_embeddings: クエリの埋め込み行列（クエリ数×次元数）
+            top_k: クエリごとに取得する件数
+            query_chunk_size: 一度に計算するクエリ数
+            corpus_chunk_size: 一度に計算するメッセージ数
+            filters: 絞り込み条件（全てのクエリに共通）
+
+        Returns:
+            List[List[SearchResult]]: クエリごとの類似度の高い順の検索結果
+        """
+        queries = normalize_rows(np.atleast_2d(query_embeddings))
+        num_queries = len(queries) if queries.size else 0
+        mask = self.filter_mask(filters) if len(self) > 0 else None
+        candidates = np.flatnonzero(mask) if mask is not None else None
+        total = len(candidates) if candidates is not None else len(self)
+        if total == 0 or top_k <= 0:
+            return [[] for _ in range(num_queries)]
+
+        top_k = min(top_k, total)
+        query_chunk_size = max(1, query_chunk_size)
+        corpus_chunk_size = max(top_k, corpus_chunk_size)
+        results = []
+        for q_start in range(0, num_queries, query_chunk_size):
+            block = queries[q_start : q_start + query_chunk_size]
+            positions, scores = self._search_block(
+                block, top_k, corpus_chunk_size, candidates
+            )
+            results.extend(self._to_results(p, s) for p, s in zip(positions, scores))
+        return results
+
+    def _search_block(
+        self, queries, top_k: int, corpus_chunk_size: int, candidates=None
+    ):
+        """
+        クエリのブロックについて上位k件の(行番号, スコア)を返す
+
+        candidatesを指定した場合は、その行番号だけを走査します。
+        """
+        rows = np.arange(len(queries))[:, None]
+        best_positions = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        total = len(candidates) if candidates is not None else len(self)
+        for c_start in range(0, total, corpus_chunk_size):
+            c_end = min(c_start + corpus_chunk_size, total)
+            if candidates is not None:
+                chunk_positions = candidates[c_start:c_end]
+                chunk = self.vectors[chunk_positions]
+            else:
+                chunk_positions = np.arange(c_start, c_end)
+                chunk = self.vectors[c_start:c_end]
+            scores = np.concatenate([best_scores, queries @ chunk.T], axis=1)
+            positions = np.concatenate(
+                [
+                    best_positions,
+                    np.broadcast_to(chunk_positions, (len(queries), len(chunk))),
+                ],
+                axis=1,
+            )
+            if scores.shape[1] > top_k:
+                keep = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+                scores = scores[rows, keep]
+                positions = positions[rows, keep]
+            best_scores, best_positions = scores, positions
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        return best_positions[rows, order], best_scores[rows, order]
+
+    def _to_results(self, positions, scores) -> List[SearchResult]:
+        """行番号と対応するスコアから検索結果のリストを作成"""
+        return [
+            SearchResult(int(self.message_ids[i]), float(score), self.texts[i])
+            for i, score in zip(positions, scores)
+        ]
+
+
+def _empty_segment(dim: int, max_seq: int, ann=None) -> EmbeddingIndex:
+    """行の無い差分セグメントを作成（ANNインデックスがあればクラスタ番号の列も持つ）"""
+    segment = EmbeddingIndex(
+        np.empty(0, dtype=np.int64),
+        [],
+        np.empty((0, dim), dtype=np.float32),
+        normalized=True,
+        max_seq=max_seq,
+    )
+    if ann is not None:
+        segment._attach_ann_assignments(ann, np.empty(0, dtype=np.int32))
+    return segment
+
+
+def _concat_segments(segments: Sequence[EmbeddingIndex]) -> EmbeddingIndex:
+    """
+    セグメントの行を連結した、バッファを持たない新しいセグメントを作成（行はコピー）
+
+    Args:
+        segments: 連結する差分セグメント（ANNインデックスは共通）
+
+    Returns:
+        EmbeddingIndex: 連結したセグメント
+    """
+    metadata = None
+    if all(segment.metadata is not None for segment in segments):
+        metadata = segments[0].metadata
+        for segment in segments[1:]:
+            metadata = IndexMetadata.concat(metadata, segment.metadata)
+        # 1件の場合もバッファの余裕分を手放すためコピーする
+        metadata = IndexMetadata(
+            *(np.array(column) for column in metadata[:-1]), metadata.category_names
+        )
+
+    combined = EmbeddingIndex(
+        np.concatenate([segment.message_ids for segment in segments]),
+        [text for segment in segments for text in _iter_texts(segment.texts)],
+        np.concatenate([segment.vectors for segment in segments]),
+        normalized=True,
+        metadata=metadata,
+        max_seq=segments[-1].max_seq,
+    )
+    ann = segments[-1].ann
+    if ann is not None:
+        combined._attach_ann_assignments(
+            ann, np.concatenate([segment._ann_assignments for segment in segments])
+        )
+    return combined
+
+
+def _iter_texts(texts: Sequence[str]):
+    """__iter__を持たないシーケンスも含めてテキストを順に返す"""
+    return (texts[i] for i in range(len(texts)))
+
+
+def _seal_segment(
+    sealed: Tuple[EmbeddingIndex, ...], delta: EmbeddingIndex
+) -> Tuple[EmbeddingIndex, ...]:
+    """
+    差分セグメントを確定したセグメントに加える
+
+    直前のセグメントが追加したセグメントの2倍未満の件数であればまとめるため、
+    確定したセグメントの件数は末尾ほど小さく、セグメント数は件数の対数に収まります
+    （各行がコピーされる回数も対数回）。
+    """
+    segments = list(sealed) + [_concat_segments([delta])]
+    while len(segments) >= 2 and len(segments[-2]) < 2 * len(segments[-1]):
+        last = segments.pop()
+        segments[-1] = _concat_segments([segments[-1], last])
+    return tuple(segments)
+
+
+class SegmentedIndex(_SearchableIndex):
+    """
+    変更しない基本セグメントと追加分の差分セグメントからなる類似検索インデックス
+
+    基本セグメント（スナップショットのmmapなど）はコピーせずに共有し、
+    追加は差分セグメントに対してのみ行います。差分セグメントが
+    DELTA_SEGMENT_MAX_ROWS件に達すると確定したセグメントに移し、
+    新しい差分セグメントを開始します。検索は全てのセグメントで行い、
+    類似度の高い順に統合します。
+    """
+
+    def __init__(
+        self,
+        base: EmbeddingIndex,
+        delta: EmbeddingIndex,
+        sealed: Tuple[EmbeddingIndex, ...] = (),
+    ):
+        """
+        Args:
+            base: 基本セグメント
+            delta: 差分セグメント（他のセグメントに無いメッセージのみ）
+            sealed: 基本セグメントと差分セグメントの間の確定したセグメント
+        """
+        self.base = base
+        self.delta = delta
+        self.sealed = tuple(sealed)
+
+    @property
+    def segments(self) -> Tuple[EmbeddingIndex, ...]:
+        """(基本セグメント, 確定したセグメント..., 差分セグメント)"""
+        return (self.base, *self.sealed, self.delta)
+
+    @property
+    def max_seq(self) -> int:
+        """読み込み済みの埋め込みの連番の最大値"""
+        return self.delta.max_seq
+
+    @property
+    def ann(self):
+        """接続されている近似最近傍インデックス（未接続の場合はNone）"""
+        return self.base.ann
+
+    @property
+    def texts(self) -> _ChainedTexts:
+        """セグメントの順に連結したテキストのシーケンス"""
+        return _ChainedTexts(*(segment.texts for segment in self.segments))
+
+    def __len__(self) -> int:
+        return sum(len(segment) for segment in self.segments)
+
+    @property
+    def dim(self) -> int:
+        """埋め込みの次元数"""
+        for segment in self.segments:
+            if len(segment) > 0:
+                return segment.dim
+        return self.delta.dim
+
+    def extend(
+        self,
+        message_ids,
+        texts: Sequence[str],
+        embeddings,
+        metadata: Optional[IndexMetadata] = None,
+        max_seq: Optional[int] = None,
+    ) -> "SegmentedIndex":
+        """
+        行を差分セグメントに追加した新しいインデックスを返す（このインデックスは変更しない）
+
+        処理量は追加件数だけで決まり、基本セグメントには触れません
+        （差分セグメントを確定する回のみ、確定するセグメントの行をコピーします）。
+
+        Args:
+            message_ids: 追加するメッセージIDの配列
+            texts: 追加するメッセージ本文のシーケンス
+            embeddings: 追加する埋め込み行列（正規化不要）
+            metadata: 追加する行のメタデータ
+            max_seq: 追加後の連番の最大値（省略時は変更なし）
+
+        Returns:
+            SegmentedIndex: 追加後のインデックス（追加する行が無い場合はself）
+
+        Raises:
+            ValueError: 次元数が一致しない場合
+        """
+        if len(message_ids) == 0:
+            return self
+        if len(self) > 0 and np.shape(embeddings)[-1] != self.dim:
+            raise ValueError(
+                f"埋め込みの次元数が一致しません: "
+                f"{np.shape(embeddings)[-1]}, {self.dim}"
+            )
+        delta = self.delta._append(message_ids, texts, embeddings, metadata, max_seq)
+        sealed = self.sealed
+        if len(delta) >= DELTA_SEGMENT_MAX_ROWS:
+            sealed = _seal_segment(sealed, delta)
+            delta = _empty_segment(delta.dim, delta.max_seq, delta.ann)
+        return SegmentedIndex(self.base, delta, sealed)
+
+    def attach_ann(self, ann) -> int:
+        """
+        近似最近傍インデックスを接続する
+
+        基本セグメントはEmbeddingIndex.attach_annと同じく未登録の行をANNインデックスに
+        追加し、確定したセグメントと差分セグメントはANNインデックスに登録せずに
+        クラスタ番号だけを割り当てます。
+
+        Args:
+            ann: IVFIndexインスタンス
+
+        Returns:
+            int: ANNインデックスに新規追加された件数
+        """
+        added = self.base.attach_ann(ann)
+        for segment in (*self.sealed, self.delta):
+            segment._attach_ann_assignments(ann, ann.assign(segment.vectors))
+        return added
+
+    def search(
+        self,
+        query_embedding,
+        top_k: int = 3,
+        exact: bool = False,
+        filters: Optional[SearchFilter] = None,
+    ) -> List[SearchResult]:
+        """
+        類似度の高い順に上位k件を返す（EmbeddingIndex.searchと同じ）
+
+        Args:
+            query_embedding: クエリの埋め込みベクトル
+            top_k: 取得する件数
+            exact: Trueの場合はANNインデックスを使用せず全件を走査
+            filters: 絞り込み条件
+
+        Returns:
+            List[SearchResult]: 類似度の高い順の検索結果
+        """
+        if len(self) == 0 or top_k <= 0:
+            return []
+        return _merge_results(
+            [
+                segment.search(query_embedding, top_k, exact=exact, filters=filters)
+                for segment in self.segments
+            ],
+            top_k,
+        )
+
+    def search_batch(
+        self,
+        query_embeddings,
+        top_k: int = 3,
+        query_chunk_size: int = SEARCH_BATCH_QUERY_CHUNK,
+        corpus_chunk_size: int = SEARCH_BATCH_CORPUS_CHUNK,
+        filters: Optional[SearchFilter] = None,
+    ) -> List[List[SearchResult]]:
+        """
+        複数のクエリについて類似度の高い順に上位k件を返す（EmbeddingIndex.search_batchと同じ）
+
+        Args:
+            query_embeddings: クエリの埋め込み行列（クエリ数×次元数）
+            top_k: クエリごとに取得する件数
+            query_chunk_size: 一度に計算するクエリ数
+            corpus_chunk_size: 一度に計算するメッセージ数
+            filters: 絞り込み条件（全てのクエリに共通）
+
+        Returns:
+            List[List[SearchResult]]: クエリごとの類似度の高い順の検索結果
+        """
+        per_segment = [
+            segment.search_batch(
+                query_embeddings,
+                top_k,
+                query_chunk_size=query_chunk_size,
+                corpus_chunk_size=corpus_chunk_size,
+                filters=filters,
+            )
+            for segment in self.segments
+        ]
+        return [_merge_results(results, top_k) for results in zip(*per_segment)]
+
+    def _lexical_mask(
+        self, message_ids: np.ndarray, filters: Optional[SearchFilter]
+    ) -> np.ndarray:
+        """メッセージIDごとに、いずれかのセグメントにあり絞り込み条件を満たすかを返す"""
+        mask = np.zeros(len(message_ids), dtype=bool)
+        for segment in self.segments:
+            mask |= segment._lexical_mask(message_ids, filters)
+        return mask
+
+    def _results_for_ids(self, message_ids, query_embedding) -> List[SearchResult]:
+        """指定したメッセージIDの順に、クエリとの類似度付きの検索結果を返す"""
+        found = {
+            result.message_id: result
+            for segment in self.segments
+            for result in segment._results_for_ids(message_ids, query_embedding)
+        }
+        return [found[i] for i in message_ids if i in found]
@@ -0,0 +1,330 @@
+"""
+埋め込みスナップショットモジュール
+
+知識データベースの埋め込みを、メモリマップで直接読み込めるファイル群として書き出します。
+Bot起動時はファイルをmmapするだけなので、コーパスのサイズに関係なく即座に起動でき、
+同じホスト上の複数のBotプロセスがページキャッシュを共有できます。
+
+ディレクトリ構成:
+    data/knowledge_snapshot/
+        CURRENT                 # 現在のバージョン名（アトミックに置き換え）
+        v<タイムスタンプ>/
+            manifest.json       # フォーマットバージョン・件数・次元数・元DBの埋め込み数・
+                                # 埋め込みの連番の最大値（差分の読み込みに使用）
+            vectors.npy         # L2正規化済みfloat32行列（件数×次元数）
+            message_ids.npy     # メッセージID（int64）
+            text_offsets.npy    # texts.bin内の各テキストの開始位置（件数+1、int64）
+            texts.bin           # UTF-8テキストの連結
+            channel_ids.npy     # メタデータ列（行と同じ順序、絞り込み検索に使用）
+            author_ids.npy
+            importance.npy
+            timestamps.npy
+            category_codes.npy  # manifest.jsonのcategoriesの番号（カテゴリ無しは-1）
+"""
+
+import json
+import mmap
+import os
+import shutil
+import time
+from typing import Optional
+
+import numpy as np
+
+from embedding_index import EmbeddingIndex, IndexMetadata, normalize_rows
+
+# スナップショットのフォーマットバージョン
+# （2: メタデータ列を追加、3: 埋め込みの連番の最大値をmanifestに記録）
+FORMAT_VERSION = 3
+
+# メタデータ列のファイル名（IndexMetadataのフィールド名と同じ）
+_METADATA_COLUMNS = (
+    "channel_ids",
+    "author_ids",
+    "importance",
+    "timestamps",
+    "category_codes",
+)
+_METADATA_DTYPES = (np.int64, np.int64, np.int32, np.float64, np.int32)
+
+# 書き出し時に一度に読み込む・正規化する行数
+_WRITE_CHUNK_SIZE = 10_000
+
+# 保持する過去バージョン数（起動中の他プロセスが参照している可能性があるため）
+_KEEP_VERSIONS = 2
+
+
+class SnapshotTexts:
+    """texts.binをmmapし、必要な行だけをデコードするシーケンス"""
+
+    def __init__(self, path: str, offsets: np.ndarray):
+        """
+        Args:
+            path: texts.binのパス
+            offsets: 各テキストの開始位置（件数+1）
+        """
+        self._offsets = offsets
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._buffer = b""
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("スナップショットのテキスト番号が範囲外です")
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return self._buffer[start:end].decode("utf-8")
+
+
+def write_snapshot(db, snapshot_dir: str) -> str:
+    """
+    データベースの埋め込みをスナップショットとして書き出す
+
+    埋め込みをメッセージID順にページ単位で読み込み、各ページを正規化して
+    メモリマップしたファイルに直接書き込むため、メモリ使用量は1ページ分に収まります。
+    書き出し中に追加された埋め込みは含めません（次回の起動時に差分として読み込まれます）。
+    新しいバージョンのディレクトリに書き出した後、CURRENTを置き換えて公開します。
+
+    Args:
+        db: KnowledgeDBインスタンス
+        snapshot_dir: スナップショットのルートディレクトリ
+
+    Returns:
+        str: 書き出したバージョンのディレクトリパス
+    """
+    max_seq = db.get_max_embedding_seq()
+    embedding_count = db.get_embedding_count(max_seq=max_seq)
+    count = db.count_embedded_messages(max_seq=max_seq)
+
+    version = f"v{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+    version_dir = os.path.join(snapshot_dir, version)
+    os.makedirs(version_dir, exist_ok=True)
+
+    def open_column(name, dtype, shape):
+        return np.lib.format.open_memmap(
+            os.path.join(version_dir, f"{name}.npy"),
+            mode="w+",
+            dtype=dtype,
+            shape=shape,
+        )
+
+    message_ids = open_column("message_ids", np.int64, (count,))
+    offsets = open_column("text_offsets", np.int64, (count + 1,))
+    offsets[0] = 0
+    columns = {
+        name: open_column(name, dtype, (count,))
+        for name, dtype in zip(_METADATA_COLUMNS, _METADATA_DTYPES)
+    }
+    vectors = None
+    categories = {}  # カテゴリ名 → 出現順の番号（最後に名前順の番号に振り直す）
+
+    position = 0
+    text_position = 0
+    with open(os.path.join(version_dir, "texts.bin"), "wb") as f:
+        for page_ids, texts, matrix, page_columns in db.iter_embedding_pages(
+            _WRITE_CHUNK_SIZE, max_seq=max_seq
+        ):
+            end = position + len(page_ids)
+            if vectors is None:
+                vectors = open_column("vectors", np.float32, (count, matrix.shape[1]))
+            vectors[position:end] = normalize_rows(matrix)
+            message_ids[position:end] = page_ids
+
+            metadata = IndexMetadata.from_columns(
+                page_columns["channel_id"],
+                page_columns["author_id"],
+                page_columns["importance"],
+                page_columns["timestamp"],
+                page_columns["category"],
+            )
+            for name in _METADATA_COLUMNS[:-1]:
+                columns[name][position:end] = getattr(metadata, name)
+            table = [
+                categories.setdefault(name, len(categories))
+                for name in metadata.category_names
+            ]
+            # 末尾の-1（カテゴリ無し）を参照できるよう、変換表の最後に-1を置く
+            table = np.array(table + [-1], dtype=np.int32)
+            columns["category_codes"][position:end] = table[metadata.category_codes]
+
+            encoded = [text.encode("utf-8") for text in texts]
+            f.write(b"".join(encoded))
+            lengths = np.fromiter(map(len, encoded), np.int64, len(encoded))
+            offsets[position + 1 : end + 1] = text_position + np.cumsum(lengths)
+            text_position = int(offsets[end])
+            position = end
+
+    if position != count:
+        raise RuntimeError(
+            f"書き出した件数がデータベースと一致しません: {position} (期待値: {count})"
+        )
+    if vectors is None:
+        vectors = open_column("vectors", np.float32, (0, 0))
+
+    # カテゴリ番号を名前順の番号に振り直す（IndexMetadata.from_columnsと同じ順序）
+    category_names = tuple(sorted(categories))
+    table = np.empty(len(categories) + 1, dtype=np.int32)
+    for name, code in categories.items():
+        table[code] = category_names.index(name)
+    table[-1] = -1
+    codes = columns["category_codes"]
+    for start in range(0, count, _WRITE_CHUNK_SIZE):
+        codes[start : start + _WRITE_CHUNK_SIZE] = table[
+            codes[start : start + _WRITE_CHUNK_SIZE]
+        ]
+
+    for array in (vectors, message_ids, offsets, *columns.values()):
+        array.flush()
+    dim = vectors.shape[1]
+    del vectors, message_ids, offsets, columns, codes
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "count": count,
+        "dim": dim,
+        "embedding_count": embedding_count,
+        "max_seq": max_seq,
+        "categories": list(category_names),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(version_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    # CURRENTをアトミックに置き換えて公開
+    current_path = os.path.join(snapshot_dir, "CURRENT")
+    with open(f"{current_path}.tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(f"{current_path}.tmp", current_path)
+
+    _remove_old_versions(snapshot_dir, version)
+    return version_dir
+
+
+def _remove_old_versions(snapshot_dir: str, current_version: str):
+    """保持数を超えた古いバージョンを削除"""
+    versions = sorted(
+        name
+        for name in os.listdir(snapshot_dir)
+        if name.startswith("v") and os.path.isdir(os.path.join(snapshot_dir, name))
+    )
+    old_versions = [v for v in versions if v != current_version]
+    for name in old_versions[: max(0, len(old_versions) - (_KEEP_VERSIONS - 1))]:
+        shutil.rmtree(os.path.join(snapshot_dir, name), ignore_errors=True)
+
+
+def read_manifest(snapshot_dir: str) -> Optional[dict]:
+    """
+    現在のスナップショットのマニフェストを読み込む
+
+    Args:
+        snapshot_dir: スナップショットのルートディレクトリ
+
+    Returns:
+        Optional[dict]: マニフェスト（スナップショットが無い場合はNone）
+    """
+    current_path = os.path.join(snapshot_dir, "CURRENT")
+    if not os.path.exists(current_path):
+        return None
+    with open(current_path, encoding="utf-8") as f:
+        version = f.read().strip()
+    manifest_path = os.path.join(snapshot_dir, version, "manifest.json")
+    if not version or not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["path"] = os.path.join(snapshot_dir, version)
+    return manifest
+
+
+def is_up_to_date(manifest: Optional[dict], embedding_count: int) -> bool:
+    """
+    スナップショットが現在のフォーマットかつデータベースと同じ件数か判定
+
+    Args:
+        manifest: read_manifestの結果（スナップショットが無い場合はNone）
+        embedding_count: データベースの埋め込み件数
+
+    Returns:
+        bool: そのまま読み込める場合True
+    """
+    return (
+        manifest is not None
+        and manifest.get("format_version") == FORMAT_VERSION
+        and manifest.get("embedding_count") == embedding_count
+    )
+
+
+def is_prefix_of(manifest: Optional[dict], db) -> bool:
+    """
+    スナップショットがデータベースの先頭部分か（差分の追加で最新にできるか）判定
+
+    スナップショット作成時点の連番以下の埋め込み数が一致すれば、
+    その後に追加された埋め込みだけを読み込めば最新の状態になります。
+
+    Args:
+        manifest: read_manifestの結果（スナップショットが無い場合はNone）
+        db: KnowledgeDBインスタンス
+
+    Returns:
+        bool: スナップショットを読み込んで差分を追加できる場合True
+    """
+    if manifest is None or manifest.get("format_version") != FORMAT_VERSION:
+        return False
+    count = db.get_embedding_count(max_seq=manifest.get("max_seq", 0))
+    return count == manifest.get("embedding_count")
+
+
+def load_snapshot(
+    snapshot_dir: str, manifest: Optional[dict] = None
+) -> Optional[EmbeddingIndex]:
+    """
+    スナップショットをmmapしてEmbeddingIndexを構築（データはコピーしない）
+
+    is_prefix_ofなどで検証済みのマニフェストを渡すと、CURRENTを読み直さずに
+    そのバージョンを読み込みます（検証後に新しいスナップショットが公開されても、
+    検証していないバージョンを読み込むことはありません）。
+
+    Args:
+        snapshot_dir: スナップショットのルートディレクトリ
+        manifest: read_manifestの結果（省略時はCURRENTが指すバージョンを読み込む）
+
+    Returns:
+        Optional[EmbeddingIndex]: インデックス（スナップショットが無い場合はNone）
+
+    Raises:
+        ValueError: フォーマットバージョンが一致しない場合
+    """
+    if manifest is None:
+        manifest = read_manifest(snapshot_dir)
+    if manifest is None:
+        return None
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(
+            f"スナップショットのフォーマットが異なります: "
+            f"{manifest.get('format_version')} (期待値: {FORMAT_VERSION})"
+        )
+
+    path = manifest["path"]
+    vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+    message_ids = np.load(os.path.join(path, "message_ids.npy"), mmap_mode="r")
+    offsets = np.load(os.path.join(path, "text_offsets.npy"), mmap_mode="r")
+    texts = SnapshotTexts(os.path.join(path, "texts.bin"), offsets)
+    columns = [
+        np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        for name in _METADATA_COLUMNS
+    ]
+    metadata = IndexMetadata(*columns, tuple(manifest.get("categories", [])))
+    return EmbeddingIndex(
+        message_ids,
+        texts,
+        vectors,
+        normalized=True,
+        metadata=metadata,
+        max_seq=manifest.get("max_seq", 0),
+    )
@@ -0,0 +1,149 @@
+"""
+埋め込み生成ワーカープールモジュール
+
+複数のプロセスにそれぞれ埋め込みモデルを読み込み、メッセージのチャンクを
+並列に埋め込みます。データベースへの書き込みは呼び出し側（単一のライター）が
+行うため、ワーカーはテキストを受け取ってベクトルを返すだけです。
+
+- 各ワーカーは起動時に一度だけモデルをロード
+- PyTorchのスレッド数は「CPUコア数 / ワーカー数」に制限（過剰なスレッド競合を防止）
+- 同時に処理中のチャンク数を制限し、メモリ使用量を一定に保つ
+- 結果は投入した順に返す
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from env_config import env_number
+
+# 使用する埋め込みモデル
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+# ワーカーあたりの同時処理チャンク数（先読み分を含む）
+_IN_FLIGHT_PER_WORKER = 2
+
+# ワーカープロセス内で保持するモデル
+_worker_model = None
+
+
+def load_sentence_transformer(model_name: str, num_threads: Optional[int] = None):
+    """
+    SentenceTransformerモデルをロード
+
+    Args:
+        model_name: モデル名
+        num_threads: PyTorchが使用するスレッド数（省略時は変更しない）
+
+    Returns:
+        SentenceTransformer: ロードされたモデル
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    return SentenceTransformer(model_name)
+
+
+def get_worker_count() -> int:
+    """
+    環境変数 EMBEDDING_WORKERS からワーカー数を取得
+
+    "auto" を指定するとCPUコア数を使用します。
+
+    Returns:
+        int: ワーカー数（未設定・不正な値の場合は1）
+    """
+    if os.environ.get("EMBEDDING_WORKERS", "").strip().lower() == "auto":
+        return os.cpu_count() or 1
+    return env_number("EMBEDDING_WORKERS", 1, minimum=1)
+
+
+def _init_worker(
+    load_model: Callable, model_name: str, num_threads: Optional[int]
+) -> None:
+    """ワーカープロセスの初期化（モデルを一度だけロード）"""
+    global _worker_model
+    _worker_model = load_model(model_name, num_threads)
+
+
+def _encode_texts(texts: List[str]) -> np.ndarray:
+    """ワーカープロセスでテキストを埋め込む"""
+    embeddings = _worker_model.encode(texts, show_progress_bar=False)
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+class EmbeddingWorkerPool:
+    """埋め込みモデルを保持するワーカープロセスのプール"""
+
+    def __init__(
+        self,
+        workers: int,
+        model_name: str = MODEL_NAME,
+        load_model: Callable = load_sentence_transformer,
+    ):
+        """
+        ワーカープールを初期化
+
+        Args:
+            workers: ワーカープロセス数
+            model_name: 各ワーカーでロードするモデル名
+            load_model: (model_name, num_threads)を受け取りモデルを返す関数
+                （ワーカープロセスから参照できるモジュールレベルの関数）
+        """
+        self.workers = max(1, workers)
+        num_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        # 親プロセスでロード済みのPyTorchの状態を引き継がないようspawnで起動
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(load_model, model_name, num_threads),
+        )
+
+    def __enter__(self) -> "EmbeddingWorkerPool":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(cancel=exc_type is not None)
+
+    def close(self, cancel: bool = False):
+        """
+        ワーカープロセスを終了
+
+        Args:
+            cancel: 未着手のチャンクを破棄する場合はTrue
+        """
+        self._executor.shutdown(wait=True, cancel_futures=cancel)
+
+    def imap(
+        self, chunks: Iterable[Tuple[Any, List[str]]]
+    ) -> Iterator[Tuple[Any, np.ndarray]]:
+        """
+        チャンクを並列に埋め込み、投入した順に結果を返す
+
+        入力は必要な分だけ先読みするため、チャンクのイテレータが
+        データベースからのページ読み込みであってもメモリ使用量は一定です。
+
+        Args:
+            chunks: (キー, テキストのリスト)のイテラブル。
+                キーはワーカーに送らず、結果にそのまま添えて返す（メッセージIDなど）
+
+        Yields:
+            tuple: (キー, 埋め込み行列)
+        """
+        max_in_flight = self.workers * _IN_FLIGHT_PER_WORKER
+        pending = deque()
+        for key, texts in chunks:
+            pending.append((key, self._executor.submit(_encode_texts, texts)))
+            if len(pending) >= max_in_flight:
+                key, future = pending.popleft()
+                yield key, future.result()
+        while pending:
+            key, future = pending.popleft()
+            yield key, future.result()
@@ -0,0 +1,42 @@
+"""
+環境変数の読み取りモジュール
+
+数値の設定値を環境変数から取得します。未設定の場合はデフォルト値を使用し、
+不正な値の場合は警告を表示してデフォルト値を使用します。
+"""
+
+import os
+from typing import Callable, Optional, TypeVar
+
+Number = TypeVar("Number", int, float)
+
+
+def env_number(
+    name: str,
+    default: Number,
+    cast: Callable[[str], Number] = int,
+    minimum: Optional[Number] = None,
+) -> Number:
+    """
+    環境変数から数値を取得
+
+    Args:
+        name: 環境変数名
+        default: 未設定・不正な値の場合のデフォルト値
+        cast: 変換関数（intまたはfloat）
+        minimum: 最小値（指定した場合、これより小さい値は最小値に切り上げる）
+
+    Returns:
+        数値
+    """
+    value = os.environ.get(name, "").strip()
+    if not value:
+        return default
+    try:
+        number = cast(value)
+    except ValueError:
+        print(f"⚠️ {name}が不正です: {value}")
+        return default
+    if minimum is not None:
+        number = max(minimum, number)
+    return number
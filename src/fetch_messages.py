@@ -2,17 +2,24 @@
 """
 Discord メッセージ取得スクリプト
 
-指定されたDiscordサーバーから過去のメッセージを取得し、
-SQLiteデータベースに保存します。
+指定されたDiscordサーバーのチャンネル・スレッド・フォーラムの投稿から
+過去のメッセージを取得し、SQLiteデータベースに保存します。
 既存のメッセージはスキップされ、新規メッセージのみが追加されます（増分更新）。
+チャンネルごとに取得済みの最新メッセージIDを記録し、次回以降はそれより新しい
+メッセージのみを取得します（FORCE_FULL_FETCH=1で全履歴を再取得）。
+取得したメッセージは一定件数ごとに取得済み位置と一緒に保存するため、
+途中で中断しても次回は続きから取得します。
 """
 
+import asyncio
 import os
 import sys
 import traceback
+from typing import NamedTuple
 
 import discord
 
+from env_config import env_number
 from knowledge_db import KnowledgeDB
 
 # 環境変数から設定を読み取る
@@ -21,6 +28,8 @@ GUILD_ID_STR = os.environ.get("TARGET_GUILD_ID")
 EXCLUDED_CHANNELS_STR = os.environ.get(
     "EXCLUDED_CHANNELS", ""
 )  # カンマ区切りのチャンネル名
+# 1の場合は取得済み位置を無視して全履歴を取得
+FORCE_FULL_FETCH = os.environ.get("FORCE_FULL_FETCH", "0") == "1"
 
 # データ保存先
 DATA_DIR = os.path.join(os.path.dirname(__file__), "../data")
@@ -28,6 +37,13 @@ DB_PATH = os.path.join(DATA_DIR, "knowledge.db")
 
 # デフォルト設定 - DB使用時は上限なし
 DEFAULT_MESSAGE_LIMIT = None  # Noneの場合は全メッセージを取得
+# 同時に取得するチャンネル・スレッド数（レート制限はチャンネルごとのため並列化で短縮できる）
+DEFAULT_FETCH_CONCURRENCY = 4
+# 1回のトランザクションで保存する最大メッセージ数
+DEFAULT_FETCH_BATCH_SIZE = 500
+
+# 書き込みタスクに終了を通知するための番兵
+_STOP = object()
 
 
 def validate_environment():
@@ -56,23 +72,261 @@ def ensure_data_directory():
         print(f"📁 dataディレクトリを作成しました: {DATA_DIR}")
 
 
+def message_to_record(message):
+    """
+    DiscordメッセージをKnowledgeDBに保存する辞書に変換
+
+    Args:
+        message: discord.Message
+
+    Returns:
+        dict: メッセージデータ
+    """
+    return {
+        "id": message.id,
+        "channel_id": message.channel.id,
+        "channel_name": message.channel.name,
+        "author_id": message.author.id,
+        "author_name": str(message.author),
+        "content": message.content,
+        "created_at": message.created_at.isoformat(),
+        "timestamp": message.created_at.timestamp(),
+    }
+
+
+class FetchResult(NamedTuple):
+    """ギルドからのメッセージ取得結果"""
+
+    channels: int  # 取得対象のチャンネル数
+    threads: int  # 取得対象のスレッド数（フォーラムの投稿・アーカイブ済みを含む）
+    fetched: int  # 取得したメッセージ数（Botの投稿などを除く）
+    inserted: int  # 新規に保存したメッセージ数
+    skipped: int  # 既存のためスキップしたメッセージ数
+
+
+class _FetchProgress:
+    """チャンネル・スレッドごとの取得の進捗と保存件数"""
+
+    def __init__(self):
+        self.channels = 0
+        self.threads = 0
+        self.unchanged = 0  # 取得済み位置以降に投稿が無く取得を省略した数
+        self.done = 0
+        self.fetched = 0
+        self.inserted = 0
+        self.skipped = 0
+
+    def finish(self):
+        """1件分の完了を記録し、表示用の「完了数/判明している総数」を返す"""
+        self.done += 1
+        return f"[{self.done}/{self.channels + self.threads}]"
+
+
+async def _fetch_channel(
+    channel, message_limit, last_message_id, progress, queue, batch_size
+):
+    """
+    1チャンネル（またはスレッド）の履歴を古い順に取得し、batch_size件ごとに書き込みキューへ渡す
+
+    各バッチには、そのバッチまでに取得した最新のメッセージIDを取得済み位置として
+    添えます。古い順に取得するため、途中で中断しても記録済みの位置から再開できます。
+
+    Args:
+        channel: テキストチャンネルまたはスレッド
+        message_limit: 取得する最大メッセージ数
+        last_message_id: 取得済みの最新メッセージID（Noneの場合は全履歴を取得）
+        progress: 進捗（_FetchProgress）
+        queue: 書き込みキュー（(メッセージのリスト, 取得済み位置の辞書)を渡す）
+        batch_size: 1回に書き込む最大メッセージ数
+    """
+    latest_id = getattr(channel, "last_message_id", None)
+    if last_message_id is not None and latest_id is not None:
+        if latest_id <= last_message_id:
+            # 取得済み位置以降の投稿が無い（アーカイブ済みのスレッドで多い）
+            progress.unchanged += 1
+            progress.done += 1
+            return
+
+    after = None if last_message_id is None else discord.Object(id=last_message_id)
+    history = channel.history(limit=message_limit, after=after, oldest_first=True)
+
+    records = []
+    newest_id = None
+    count = 0
+    error = None
+    try:
+        async for message in history:
+            # 取得済み位置はBotの投稿などの保存しないメッセージも含めて進める
+            newest_id = message.id
+            if not message.author.bot and message.content.strip():
+                records.append(message_to_record(message))
+                if len(records) >= batch_size:
+                    count += len(records)
+                    # キューが満杯の場合は書き込みが追いつくまで取得を待つ
+                    await queue.put((records, {channel.id: newest_id}))
+                    records = []
+    except discord.Forbidden:
+        error = "アクセス権限がありません"
+    except Exception as e:
+        error = f"エラー: {e}"
+
+    # 中断した場合も、それまでに取得した分は保存して位置を進める
+    if newest_id is not None:
+        count += len(records)
+        await queue.put((records, {channel.id: newest_id}))
+
+    progress.fetched += count
+    kind = "スレッド" if isinstance(channel, discord.Thread) else "チャンネル"
+    if error is not None:
+        print(
+            f"⚠️  {progress.finish()} {kind} (ID: {channel.id}) を中断:"
+            f" {error}（{count}件は保存します）"
+        )
+        return
+    mode = "全履歴" if last_message_id is None else "前回の続き"
+    print(
+        f"📝 {progress.finish()} {kind} (ID: {channel.id}) から"
+        f"{count}件のメッセージを取得（{mode}）"
+    )
+
+
+async def _fetch_worker(
+    targets, checkpoints, message_limit, progress, queue, batch_size
+):
+    """取得対象キューのチャンネル・スレッドを順に取得するワーカー"""
+    while True:
+        channel = await targets.get()
+        if channel is _STOP:
+            return
+        await _fetch_channel(
+            channel,
+            message_limit,
+            checkpoints.get(channel.id),
+            progress,
+            queue,
+            batch_size,
+        )
+
+
+async def _enumerate_targets(guild, excluded_channels, targets, progress):
+    """
+    取得対象のチャンネルとスレッドを列挙して取得対象キューに追加
+
+    テキストチャンネルを追加した後、アクティブなスレッドと、テキストチャンネル・
+    フォーラムごとのアーカイブ済みの公開スレッドを列挙します。列挙中も
+    ワーカーは追加済みの対象を取得し、キューが満杯の場合は列挙を待たせます。
+    除外チャンネルのスレッドは対象外です。
+
+    Args:
+        guild: ギルド
+        excluded_channels: 除外するチャンネル名のセット
+        targets: 取得対象キュー
+        progress: 進捗（_FetchProgress）
+    """
+    parents = []
+    for channel in guild.text_channels:
+        # 除外チャンネルリストに含まれている場合はスキップ
+        if channel.name in excluded_channels:
+            print(
+                f"⏩ チャンネル (ID: {channel.id}) をスキップ（除外リストに含まれています）"
+            )
+            continue
+        parents.append(channel)
+        progress.channels += 1
+        await targets.put(channel)
+
+    # フォーラムは投稿（スレッド）のみを持つ
+    parents.extend(f for f in guild.forums if f.name not in excluded_channels)
+    parent_ids = {parent.id for parent in parents}
+
+    seen = set()
+
+    async def add_thread(thread):
+        if thread.id in seen or thread.parent_id not in parent_ids:
+            return
+        seen.add(thread.id)
+        progress.threads += 1
+        await targets.put(thread)
+
+    try:
+        for thread in await guild.active_threads():
+            await add_thread(thread)
+    except discord.Forbidden:
+        print("⚠️  アクティブなスレッドの一覧を取得する権限がありません")
+    except Exception as e:
+        print(f"⚠️  アクティブなスレッドの一覧の取得でエラー: {e}")
+
+    for parent in parents:
+        try:
+            async for thread in parent.archived_threads(limit=None):
+                await add_thread(thread)
+        except discord.Forbidden:
+            print(
+                f"⚠️  チャンネル (ID: {parent.id}) のアーカイブ済みスレッドをスキップ:"
+                " アクセス権限がありません"
+            )
+        except Exception as e:
+            print(
+                f"⚠️  チャンネル (ID: {parent.id}) のアーカイブ済みスレッドでエラー: {e}"
+            )
+
+
+async def _write_batches(db, queue, progress):
+    """
+    書き込みキューのバッチを順にデータベースへ保存する書き込みタスク
+
+    メッセージと取得済み位置を同じトランザクションで保存します。
+    SQLiteへの書き込みはスレッドで行い、イベントループ（取得処理）を止めません。
+    """
+    while True:
+        item = await queue.get()
+        if item is _STOP:
+            return
+        records, checkpoints = item
+        inserted, skipped = await asyncio.to_thread(
+            db.insert_messages_batch, records, checkpoints
+        )
+        progress.inserted += inserted
+        progress.skipped += skipped
+
+
 async def fetch_messages_from_guild(
-    client, guild_id, message_limit=DEFAULT_MESSAGE_LIMIT, excluded_channels=None
+    client,
+    guild_id,
+    db,
+    message_limit=DEFAULT_MESSAGE_LIMIT,
+    excluded_channels=None,
+    checkpoints=None,
+    concurrency=None,
+    batch_size=None,
 ):
     """
-    指定されたギルドからメッセージを取得
+    指定されたギルドからメッセージを取得し、データベースに保存
+
+    テキストチャンネルに加えて、スレッドとフォーラムの投稿（アーカイブ済みを含む）も
+    取得します。concurrency個のワーカーが列挙済みの対象を同時に古い順に取得し、
+    batch_size件ごとに書き込みタスクへ渡して保存します
+    （メモリ使用量はギルドの履歴の量によらない）。
+    各バッチはチャンネル・スレッドの取得済み位置と同じトランザクションで保存されるため、
+    中断した場合も次回は保存済みの位置から再開します。
 
     Args:
         client: Discord Client
         guild_id: ギルドID
-        message_limit: 各チャンネルから取得する最大メッセージ数
+        db: 保存先のKnowledgeDB
+        message_limit: 各チャンネルから取得する最大メッセージ数（古い順に数える）
         excluded_channels: 除外するチャンネル名のセット（オプション）
+        checkpoints: チャンネル・スレッドID → 取得済みの最新メッセージID（オプション）
+        concurrency: 同時に取得する数（省略時は環境変数FETCH_CONCURRENCY）
+        batch_size: 1回に保存する最大メッセージ数（省略時は環境変数FETCH_BATCH_SIZE）
 
     Returns:
-        メッセージのリスト
+        FetchResult: 取得結果（ギルドにアクセスできない場合はNone）
     """
     if excluded_channels is None:
         excluded_channels = set()
+    if checkpoints is None:
+        checkpoints = {}
     guild = client.get_guild(guild_id)
 
     if guild is None:
@@ -89,51 +343,66 @@ async def fetch_messages_from_guild(
 
     print(f"✅ ギルド (ID: {guild.id}) に接続しました")
     print(f"📊 チャンネル数: {len(guild.text_channels)}")
+    print(f"📊 フォーラム数: {len(guild.forums)}")
+
+    if concurrency is None:
+        concurrency = env_number(
+            "FETCH_CONCURRENCY", DEFAULT_FETCH_CONCURRENCY, minimum=1
+        )
+    if batch_size is None:
+        batch_size = env_number("FETCH_BATCH_SIZE", DEFAULT_FETCH_BATCH_SIZE, minimum=1)
+    print(f"⚡ 同時に取得するチャンネル・スレッド数: {concurrency}")
     print()
 
-    all_messages = []
-
-    for channel in guild.text_channels:
-        # 除外チャンネルリストに含まれている場合はスキップ
-        if channel.name in excluded_channels:
-            print(
-                f"⏩ チャンネル (ID: {channel.id}) をスキップ（除外リストに含まれています）"
+    # 複数のチャンネル・スレッドを同時に取得（レート制限はdiscord.pyがルートごとに待機）
+    # 列挙済みの対象と書き込み待ちのバッチの数を制限し、メモリ使用量を一定に保つ
+    targets = asyncio.Queue(maxsize=concurrency * 4)
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    progress = _FetchProgress()
+    writer = asyncio.create_task(_write_batches(db, queue, progress))
+
+    async def enumerate_and_stop():
+        await _enumerate_targets(guild, excluded_channels, targets, progress)
+        for _ in range(concurrency):
+            await targets.put(_STOP)
+
+    fetchers = asyncio.gather(
+        enumerate_and_stop(),
+        *(
+            _fetch_worker(
+                targets, checkpoints, message_limit, progress, queue, batch_size
             )
-            continue
-
-        print(f"📝 チャンネル (ID: {channel.id}) からメッセージを取得中...")
-
-        try:
-            messages = []
-            # チャンネルごとにメッセージをバッチで取得して一度に追加（パフォーマンス最適化）
-            channel_messages = [
-                {
-                    "id": message.id,
-                    "channel_id": channel.id,
-                    "channel_name": channel.name,
-                    "author_id": message.author.id,
-                    "author_name": str(message.author),
-                    "content": message.content,
-                    "created_at": message.created_at.isoformat(),
-                    "timestamp": message.created_at.timestamp(),
-                }
-                async for message in channel.history(limit=message_limit)
-                if not message.author.bot and message.content.strip()
-            ]
-            messages.extend(channel_messages)
-
-            all_messages.extend(messages)
-            print(f"   → {len(messages)}件のメッセージを取得")
-
-        except discord.Forbidden:
-            print("   ⚠️  スキップ: アクセス権限がありません")
-        except Exception as e:
-            print(f"   ⚠️  エラー: {e}")
+            for _ in range(concurrency)
+        ),
+    )
+
+    # 書き込みに失敗した場合は取得を中止して例外を伝える
+    await asyncio.wait({writer, fetchers}, return_when=asyncio.FIRST_COMPLETED)
+    if writer.done():
+        fetchers.cancel()
+        await asyncio.gather(fetchers, return_exceptions=True)
+        writer.result()
+    await fetchers
+    await queue.put(_STOP)
+    await writer
 
     print()
-    print(f"✅ 合計 {len(all_messages)}件のメッセージを取得しました")
-
-    return all_messages
+    if progress.unchanged:
+        print(
+            f"⏩ 新しい投稿の無い{progress.unchanged}件のチャンネル・スレッドを省略しました"
+        )
+    print(
+        f"✅ 合計 {progress.fetched}件のメッセージを取得しました"
+        f"（チャンネル: {progress.channels}, スレッド: {progress.threads}）"
+    )
+
+    return FetchResult(
+        channels=progress.channels,
+        threads=progress.threads,
+        fetched=progress.fetched,
+        inserted=progress.inserted,
+        skipped=progress.skipped,
+    )
 
 
 async def main():
@@ -181,16 +450,34 @@ async def main():
                 ch.strip() for ch in EXCLUDED_CHANNELS_STR.split(",") if ch.strip()
             ]
 
-            # メッセージの取得
-            messages = await fetch_messages_from_guild(
-                client, guild_id, excluded_channels=excluded_channels
+            # 取得済み位置の読み込み（FORCE_FULL_FETCH=1の場合は全履歴を取得）
+            checkpoints = {} if FORCE_FULL_FETCH else db.get_channel_checkpoints()
+            if checkpoints:
+                print(f"📍 {len(checkpoints)}チャンネルは前回の続きから取得します")
+            elif FORCE_FULL_FETCH:
+                print("📍 FORCE_FULL_FETCH=1: 全チャンネルの全履歴を取得します")
+            print()
+
+            # メッセージの取得とデータベースへの保存（増分更新）
+            result = await fetch_messages_from_guild(
+                client,
+                guild_id,
+                db,
+                excluded_channels=excluded_channels,
+                checkpoints=checkpoints,
             )
 
-            if messages is None:
+            if result is None:
                 await client.close()
                 return
 
-            if len(messages) == 0:
+            if result.fetched == 0 and checkpoints:
+                # 増分取得で新しいメッセージが無いのは正常
+                print("✅ 新しいメッセージはありませんでした")
+                success = True
+                return
+
+            if result.fetched == 0:
                 print("⚠️  警告: メッセージが1件も取得できませんでした")
                 print("   以下の点を確認してください:")
                 print("   - Botがサーバーに参加しているか")
@@ -199,11 +486,9 @@ async def main():
                 await client.close()
                 return
 
-            # データベースに保存（増分更新）
-            print("💾 データベースに保存中...")
-            inserted, skipped = db.insert_messages_batch(messages)
-            print(f"   新規追加: {inserted}件")
-            print(f"   既存スキップ: {skipped}件")
+            print("💾 データベースへの保存結果:")
+            print(f"   新規追加: {result.inserted}件")
+            print(f"   既存スキップ: {result.skipped}件")
             total_count = db.get_message_count()
             print(f"   累積総数: {total_count}件")
             print()
@@ -238,12 +523,13 @@ async def main():
     except Exception as e:
         print(f"❌ エラー: 接続中に問題が発生しました: {e}")
         sys.exit(1)
+    finally:
+        # WALの内容をデータベースファイルに書き戻して閉じる
+        db.close()
 
     if not success:
         sys.exit(1)
 
 
 if __name__ == "__main__":
-    import asyncio
-
     asyncio.run(main())
@@ -5,12 +5,200 @@ SQLiteを使用して知識データを管理します。
 - メッセージの永続的な蓄積（上限なし）
 - 増分更新対応（既存メッセージはスキップ）
 - メタデータ管理（カテゴリ、重要度など）
+- 埋め込みベクトルのバイナリ保存（リトルエンディアンfloat32のBLOB）
+- スレッドごとの永続接続とWALモード（読み書きの同時実行）
 """
 
 import json
 import os
+import re
 import sqlite3
-from typing import Dict, List, Optional, Tuple
+import threading
+import unicodedata
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# スキーマバージョン（PRAGMA user_versionで管理）
+# 1: 埋め込みをfloat32のBLOBで保存
+# 2: 全文検索インデックス（messages_fts）を追加
+# 3: 埋め込みの追加順を表す連番（embeddings.seq）を追加
+# 4: チャンネルごとの取得済み位置（channel_checkpoints）を追加
+SCHEMA_VERSION = 4
+
+# 埋め込みベクトルの保存形式
+EMBEDDING_DTYPE = "float32"
+_EMBEDDING_NP_DTYPE = np.dtype("<f4")
+
+# JSON形式からの移行時に一度に変換する行数
+_MIGRATION_CHUNK_SIZE = 1000
+
+# 埋め込みをページ単位で読み込む際の1ページあたりの件数
+EMBEDDING_PAGE_SIZE = 10_000
+
+# 接続ごとに設定するPRAGMA
+# WALモードにより、書き込み中も他の接続から読み込みが可能になる
+_CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",  # WALではコミットごとのfsyncを省略しても破損しない
+    "PRAGMA cache_size = -65536",  # 64MiB
+    "PRAGMA mmap_size = 268435456",  # 256MiB
+    "PRAGMA temp_store = MEMORY",
+)
+
+# ロック待ちのタイムアウト（秒）
+_BUSY_TIMEOUT_SECONDS = 30.0
+
+# 接続ごとにキャッシュするプリペアドステートメント数
+_STATEMENT_CACHE_SIZE = 256
+
+# 全文検索クエリに含める語の最大数
+_FTS_MAX_TERMS = 8
+
+# 全文検索で使用する語の最大一致件数のデフォルト値
+# これより多くのメッセージに現れる語はBM25への寄与が小さく、
+# 全ての一致を順位付けすると検索が遅くなるため除外する
+FTS_MAX_TERM_MATCHES = 500
+
+# 全ての語が最大一致件数を超えた場合に、最も一致の少ない語を使用する上限（倍率）
+# （よく使われる語だけの質問でも全文検索の結果が空にならないようにする）
+_FTS_FALLBACK_MATCH_FACTOR = 10
+
+# 全文検索クエリから取り出す語（カタカナ・漢字・英数字の連続）
+_FTS_TERM_PATTERN = re.compile(r"[\u30a0-\u30ff]+|[\u3005\u4e00-\u9fff]+|[0-9a-z]+")
+
+
+def _encode_vector(embedding: Union[Sequence[float], np.ndarray]) -> Tuple[bytes, int]:
+    """
+    埋め込みベクトルをBLOB用のバイト列に変換
+
+    Args:
+        embedding: 埋め込みベクトル（リストまたは1次元配列）
+
+    Returns:
+        Tuple[bytes, int]: (リトルエンディアンfloat32のバイト列, 次元数)
+
+    Raises:
+        ValueError: 1次元のベクトルでない場合
+    """
+    vector = np.asarray(embedding, dtype=_EMBEDDING_NP_DTYPE)
+    if vector.ndim != 1:
+        raise ValueError(f"埋め込みベクトルは1次元である必要があります: {vector.shape}")
+    return vector.tobytes(), int(vector.shape[0])
+
+
+def _fulltext_terms(text: str) -> List[str]:
+    """
+    検索テキストから全文検索に使う語を取り出す
+
+    分かち書きの無い日本語に対応するため、文字種（カタカナ・漢字・英数字）の
+    連続を語として取り出します。ひらがなの連続（助詞・送り仮名）は除外します。
+    固有名詞・専門用語・コマンド名の多くはカタカナ・漢字・英数字で書かれます。
+
+    trigramトークナイザーは3文字未満の語を索引から検索できないため、
+    2文字の語（「設定」「参加」などの漢字2文字の熟語や「VC」などの略語）は
+    対象外です。これらはベクトル検索のみで照合されます。
+
+    Args:
+        text: 検索テキスト
+
+    Returns:
+        List[str]: 3文字以上の語（重複なし、最大_FTS_MAX_TERMS件）
+    """
+    normalized = unicodedata.normalize("NFKC", text).lower()
+    terms = {}
+    for term in _FTS_TERM_PATTERN.findall(normalized):
+        # trigramトークナイザーは3文字未満の語を検索できない
+        if len(term) >= 3:
+            terms.setdefault(term, None)
+    return list(terms)[:_FTS_MAX_TERMS]
+
+
+# 埋め込み行列とメタデータ列を取得するクエリ（_embedding_rows_to_matrixの入力）
+_EMBEDDING_ROWS_QUERY = """
+    SELECT m.id, m.content, e.embedding_vector, e.dim,
+           m.channel_id, m.author_id, m.importance, m.timestamp,
+           m.category, e.seq
+    FROM messages m
+    INNER JOIN embeddings e ON m.id = e.message_id
+"""
+
+# 指定した連番より後の埋め込みを取得するクエリ（差分の読み込み用）
+# CROSS JOINで結合順序を固定し、messagesの全件走査ではなく
+# idx_embeddings_seqで差分の行だけを探索させる
+_EMBEDDING_DELTA_ROWS_QUERY = """
+    SELECT m.id, m.content, e.embedding_vector, e.dim,
+           m.channel_id, m.author_id, m.importance, m.timestamp,
+           m.category, e.seq
+    FROM embeddings e
+    CROSS JOIN messages m ON m.id = e.message_id
+    WHERE e.seq > ?
+"""
+
+
+def _embedding_rows_to_matrix(
+    rows: List[Tuple],
+) -> Tuple[np.ndarray, List[str], np.ndarray, Dict]:
+    """
+    埋め込みの行をメッセージID配列・テキスト・行列・メタデータ列に変換
+
+    BLOBを連結して直接行列化するため、行ごとのデコード処理は発生しません。
+
+    Args:
+        rows: _EMBEDDING_ROWS_QUERYの結果の行のリスト
+
+    Returns:
+        Tuple[np.ndarray, List[str], np.ndarray, Dict]:
+            (メッセージID配列, テキストリスト, 埋め込み行列, メタデータ列の辞書)
+
+    Raises:
+        ValueError: 次元数の異なる埋め込みが混在している場合
+    """
+    count = len(rows)
+    metadata = {
+        "channel_id": np.fromiter((r[4] for r in rows), np.int64, count),
+        "author_id": np.fromiter((r[5] for r in rows), np.int64, count),
+        "importance": np.fromiter((r[6] or 0 for r in rows), np.int32, count),
+        "timestamp": np.fromiter((r[7] for r in rows), np.float64, count),
+        "category": [row[8] for row in rows],
+        "seq": np.fromiter((r[9] for r in rows), np.int64, count),
+    }
+
+    if not rows:
+        return (
+            np.empty(0, dtype=np.int64),
+            [],
+            np.empty((0, 0), dtype=np.float32),
+            metadata,
+        )
+
+    dims = {row[3] for row in rows}
+    if len(dims) != 1:
+        raise ValueError(f"次元数の異なる埋め込みが混在しています: {sorted(dims)}")
+    dim = dims.pop()
+
+    message_ids = np.fromiter((row[0] for row in rows), dtype=np.int64)
+    texts = [row[1] for row in rows]
+    buffer = b"".join(row[2] for row in rows)
+    matrix = np.frombuffer(buffer, dtype=_EMBEDDING_NP_DTYPE).reshape(count, dim)
+
+    return message_ids, texts, matrix.astype(np.float32, copy=False), metadata
+
+
+def _message_row(message: Dict) -> Tuple:
+    """メッセージの辞書をmessagesテーブルの列順のタプルに変換"""
+    return (
+        message["id"],
+        message["channel_id"],
+        message["channel_name"],
+        message["author_id"],
+        message["author_name"],
+        message["content"],
+        message["created_at"],
+        message["timestamp"],
+        message.get("category"),
+        message.get("importance", 0),
+    )
 
 
 class KnowledgeDB:
@@ -26,6 +214,9 @@ class KnowledgeDB:
         if db_path is None:
             db_path = os.path.join(os.path.dirname(__file__), "../data/knowledge.db")
         self.db_path = db_path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
         self._ensure_data_directory()
         self._init_database()
 
@@ -35,10 +226,41 @@ class KnowledgeDB:
         if not os.path.exists(db_dir):
             os.makedirs(db_dir, exist_ok=True)
 
+    def _get_connection(self) -> sqlite3.Connection:
+        """
+        呼び出し元スレッド専用の永続接続を取得
+
+        接続はスレッドごとに1つだけ作成され、以降は再利用されます。
+        コンテキストマネージャとして使用すると、ブロック終了時にコミット
+        （例外時はロールバック）されます。
+
+        Returns:
+            sqlite3.Connection: データベース接続
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=_BUSY_TIMEOUT_SECONDS,
+            check_same_thread=False,
+            cached_statements=_STATEMENT_CACHE_SIZE,
+        )
+        for pragma in _CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+
+        self._local.conn = conn
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
     def _init_database(self):
         """データベーステーブルを初期化"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._get_connection() as conn:
             cursor = conn.cursor()
+            cursor.execute("PRAGMA user_version")
+            schema_version = cursor.fetchone()[0]
 
             # メッセージテーブル
             cursor.execute("""
@@ -61,11 +283,26 @@ class KnowledgeDB:
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS embeddings (
                     message_id INTEGER PRIMARY KEY,
-                    embedding_vector TEXT NOT NULL,
+                    embedding_vector BLOB NOT NULL,
+                    dim INTEGER NOT NULL,
+                    dtype TEXT NOT NULL DEFAULT 'float32',
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    seq INTEGER,
                     FOREIGN KEY (message_id) REFERENCES messages(id)
                 )
             """)
+            self._add_embedding_seq(cursor)
+
+            # チャンネルごとの取得済み位置（増分取得用）
+            # 既存のmessagesからは作成しない（Botのリアルタイム取り込みで保存された
+            # メッセージを基準にすると、それより前の未取得分が飛ばされるため）
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS channel_checkpoints (
+                    channel_id INTEGER PRIMARY KEY,
+                    last_message_id INTEGER NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
 
             # インデックス作成（検索性能向上）
             cursor.execute("""
@@ -84,100 +321,309 @@ class KnowledgeDB:
                 CREATE INDEX IF NOT EXISTS idx_messages_importance
                 ON messages(importance)
             """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_embeddings_seq
+                ON embeddings(seq)
+            """)
+
+            # 旧形式（JSON配列）の埋め込みをBLOB形式に移行
+            if schema_version < 1:
+                self._migrate_embeddings_to_blob(cursor)
+
+            self.fulltext_available = self._init_fulltext(cursor, schema_version)
 
+            # 全文検索を利用できない環境では、利用可能になった時に再構築できるよう
+            # バージョンを1に留める（embeddings.seqは列の有無で移行を判定する）
+            version = SCHEMA_VERSION if self.fulltext_available else 1
+            cursor.execute(f"PRAGMA user_version = {version}")
             conn.commit()
 
-    def insert_message(self, message: Dict) -> bool:
+    def _add_embedding_seq(self, cursor: sqlite3.Cursor):
         """
-        メッセージを挿入（既存の場合はスキップ）
+        埋め込みの追加順を表す連番の列を追加（旧バージョンのデータベースのみ）
+
+        既存の埋め込みにはメッセージIDを連番として割り当てます。
+        以降に追加される埋め込みは常にそれより大きい連番になるため、
+        読み込み済みの最大連番より大きい行だけを差分として取得できます。
 
         Args:
-            message: メッセージデータの辞書
+            cursor: データベースカーソル
+        """
+        cursor.execute("PRAGMA table_info(embeddings)")
+        columns = {row[1] for row in cursor.fetchall()}
+        if "seq" in columns:
+            return
+        cursor.execute("ALTER TABLE embeddings ADD COLUMN seq INTEGER")
+        cursor.execute("UPDATE embeddings SET seq = message_id")
+
+    def _init_fulltext(self, cursor: sqlite3.Cursor, schema_version: int) -> bool:
+        """
+        全文検索インデックス（FTS5、trigramトークナイザー）と同期用トリガーを作成
+
+        messagesテーブルを外部コンテンツとするため本文は重複して保存されません。
+        挿入はinsert_messages_batchが一括で登録し、削除・本文の更新はトリガーで
+        自動的に反映されます。
+
+        Args:
+            cursor: データベースカーソル
+            schema_version: 初期化前のスキーマバージョン
 
         Returns:
-            bool: 新規挿入された場合True、既存でスキップされた場合False
+            bool: 全文検索を利用できる場合True（SQLiteが未対応の場合False）
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                    content,
+                    content='messages',
+                    content_rowid='id',
+                    tokenize='trigram'
+                )
+            """)
+        except sqlite3.OperationalError as e:
+            print(f"⚠️ 全文検索インデックスを作成できません（{e}）。全文検索は無効です")
+            return False
+
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete
+            AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts(messages_fts, rowid, content)
+                VALUES ('delete', old.id, old.content);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS messages_fts_update
+            AFTER UPDATE OF content ON messages BEGIN
+                INSERT INTO messages_fts(messages_fts, rowid, content)
+                VALUES ('delete', old.id, old.content);
+                INSERT INTO messages_fts(rowid, content)
+                VALUES (new.id, new.content);
+            END
+        """)
+
+        # 既存のメッセージを索引に登録（初回のみ）
+        if schema_version < 2:
+            cursor.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+        return True
+
+    def _migrate_embeddings_to_blob(self, cursor: sqlite3.Cursor):
+        """
+        JSON配列で保存された埋め込みをfloat32のBLOBに変換（初回のみ実行）
 
-            # 既存チェック
-            cursor.execute("SELECT id FROM messages WHERE id = ?", (message["id"],))
-            if cursor.fetchone() is not None:
-                return False
+        Args:
+            cursor: マイグレーションに使用するカーソル
+        """
+        cursor.execute("PRAGMA table_info(embeddings)")
+        columns = {row[1] for row in cursor.fetchall()}
+        if "dim" not in columns:
+            cursor.execute("ALTER TABLE embeddings ADD COLUMN dim INTEGER")
+        if "dtype" not in columns:
+            cursor.execute(
+                "ALTER TABLE embeddings ADD COLUMN dtype TEXT DEFAULT 'float32'"
+            )
 
-            # 新規挿入
+        migrated = 0
+        while True:
             cursor.execute(
                 """
-                INSERT INTO messages
-                (id, channel_id, channel_name, author_id, author_name,
-                 content, created_at, timestamp, category, importance)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                SELECT message_id, embedding_vector FROM embeddings
+                WHERE typeof(embedding_vector) = 'text'
+                LIMIT ?
                 """,
-                (
-                    message["id"],
-                    message["channel_id"],
-                    message["channel_name"],
-                    message["author_id"],
-                    message["author_name"],
-                    message["content"],
-                    message["created_at"],
-                    message["timestamp"],
-                    message.get("category"),
-                    message.get("importance", 0),
-                ),
+                (_MIGRATION_CHUNK_SIZE,),
             )
-            conn.commit()
-            return True
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            params = []
+            for message_id, vector_json in rows:
+                blob, dim = _encode_vector(json.loads(vector_json))
+                params.append((blob, dim, EMBEDDING_DTYPE, message_id))
+            cursor.executemany(
+                """
+                UPDATE embeddings
+                SET embedding_vector = ?, dim = ?, dtype = ?
+                WHERE message_id = ?
+                """,
+                params,
+            )
+            migrated += len(rows)
 
-    def insert_messages_batch(self, messages: List[Dict]) -> Tuple[int, int]:
+        if migrated > 0:
+            print(f"🔄 埋め込み{migrated}件をバイナリ形式（float32）に移行しました")
+
+    def insert_message(self, message: Dict) -> bool:
+        """
+        メッセージを挿入（既存の場合はスキップ）
+
+        Args:
+            message: メッセージデータの辞書
+
+        Returns:
+            bool: 新規挿入された場合True、既存でスキップされた場合False
+        """
+        inserted, _ = self.insert_messages_batch([message])
+        return inserted == 1
+
+    def insert_messages_batch(
+        self, messages: List[Dict], checkpoints: Optional[Dict[int, int]] = None
+    ) -> Tuple[int, int]:
         """
         複数のメッセージを一括挿入
 
+        INSERT OR IGNOREをexecutemanyで1トランザクションにまとめて実行します。
+        既存のメッセージ（バッチ内の重複を含む）はスキップされます。
+        新規に挿入したメッセージは同じトランザクションで全文検索インデックスにも登録します。
+        トランザクションは最初に書き込みロックを取得するため、複数のプロセス・スレッドが
+        同時に書き込んでも同じメッセージが二重に登録されることはありません。
+
         Args:
             messages: メッセージデータの辞書のリスト
+            checkpoints: 同じトランザクションで更新するチャンネルごとの取得済み位置
+                （チャンネルID → メッセージID、省略時は更新しない）
 
         Returns:
             Tuple[int, int]: (新規挿入数, スキップ数)
         """
-        inserted = 0
-        skipped = 0
+        if not messages:
+            if checkpoints:
+                self.set_channel_checkpoints(checkpoints)
+            return 0, 0
 
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        inserted, _ = self._insert_messages(messages, checkpoints, collect_ids=False)
+        return inserted, len(messages) - inserted
+
+    def insert_new_messages(self, messages: List[Dict]) -> List[int]:
+        """
+        複数のメッセージを一括挿入し、新規に挿入したメッセージのIDを返す
+
+        insert_messages_batchと同じく1トランザクションで挿入し、既存のメッセージ
+        （バッチ内の重複を含む）はスキップします。既存かどうかは書き込みロックの下で
+        確認するため、返すIDは実際に挿入したメッセージと一致します。
+
+        Args:
+            messages: メッセージデータの辞書のリスト
+
+        Returns:
+            List[int]: 新規に挿入したメッセージID（バッチ内の順序）
+        """
+        if not messages:
+            return []
+        return self._insert_messages(messages, None, collect_ids=True)[1]
 
-            for message in messages:
-                # 既存チェック
-                cursor.execute("SELECT id FROM messages WHERE id = ?", (message["id"],))
-                if cursor.fetchone() is not None:
-                    skipped += 1
-                    continue
+    def _insert_messages(
+        self,
+        messages: List[Dict],
+        checkpoints: Optional[Dict[int, int]],
+        collect_ids: bool,
+    ) -> Tuple[int, List[int]]:
+        """
+        メッセージを一括挿入（insert_messages_batch・insert_new_messagesの本体）
 
-                # 新規挿入
+        Args:
+            messages: メッセージデータの辞書のリスト（空でないこと）
+            checkpoints: 同じトランザクションで更新するチャンネルごとの取得済み位置
+            collect_ids: 新規に挿入したメッセージIDを集める場合True
+
+        Returns:
+            Tuple[int, List[int]]: (新規挿入数, 新規に挿入したメッセージID
+                （全文検索もcollect_idsも無効な場合は空）)
+        """
+        check_existing = self.fulltext_available or collect_ids
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            # 既存メッセージの確認から挿入までを書き込みロックの下で行う
+            # （確認後に別のライターが同じメッセージを挿入すると、全文検索インデックスに
+            # 二重に登録されるため）
+            if not conn.in_transaction:
+                cursor.execute("BEGIN IMMEDIATE")
+            if checkpoints:
+                self._upsert_checkpoints(cursor, checkpoints)
+            existing = set()
+            if check_existing:
+                ids = json.dumps([message["id"] for message in messages])
                 cursor.execute(
-                    """
-                    INSERT INTO messages
-                    (id, channel_id, channel_name, author_id, author_name,
-                     content, created_at, timestamp, category, importance)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        message["id"],
-                        message["channel_id"],
-                        message["channel_name"],
-                        message["author_id"],
-                        message["author_name"],
-                        message["content"],
-                        message["created_at"],
-                        message["timestamp"],
-                        message.get("category"),
-                        message.get("importance", 0),
-                    ),
+                    "SELECT id FROM messages"
+                    " WHERE id IN (SELECT value FROM json_each(?))",
+                    (ids,),
+                )
+                existing = {row[0] for row in cursor.fetchall()}
+                if len(existing) == len(messages):
+                    # 全件が既存（増分更新で多い）の場合は挿入を省略
+                    conn.commit()
+                    return 0, []
+
+            cursor.executemany(
+                """
+                INSERT OR IGNORE INTO messages
+                (id, channel_id, channel_name, author_id, author_name,
+                 content, created_at, timestamp, category, importance)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (_message_row(message) for message in messages),
+            )
+            # rowcountはexecutemany全体で実際に挿入された行数の合計
+            inserted = cursor.rowcount
+
+            # 新規に挿入した行（バッチ内の重複はINSERT OR IGNOREと同じく最初の1件）
+            new_rows = {}
+            if check_existing and inserted > 0:
+                for message in messages:
+                    if message["id"] not in existing:
+                        new_rows.setdefault(message["id"], message["content"])
+            if self.fulltext_available and new_rows:
+                # 行ごとのトリガーよりもexecutemanyの方が大幅に速いため明示的に登録
+                cursor.executemany(
+                    "INSERT INTO messages_fts(rowid, content) VALUES (?, ?)",
+                    new_rows.items(),
                 )
-                inserted += 1
+            conn.commit()
+
+        return inserted, list(new_rows)
+
+    def get_channel_checkpoints(self) -> Dict[int, int]:
+        """
+        チャンネルごとの取得済み位置を取得
+
+        Returns:
+            Dict[int, int]: チャンネルID → 取得済みの最新メッセージID
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT channel_id, last_message_id FROM channel_checkpoints"
+            )
+            return dict(cursor.fetchall())
+
+    def set_channel_checkpoints(self, checkpoints: Dict[int, int]):
+        """
+        チャンネルごとの取得済み位置を更新
+
+        既に記録されている位置より古いメッセージIDが渡された場合は更新しません。
 
+        Args:
+            checkpoints: チャンネルID → 取得済みの最新メッセージID
+        """
+        if not checkpoints:
+            return
+        with self._get_connection() as conn:
+            self._upsert_checkpoints(conn.cursor(), checkpoints)
             conn.commit()
 
-        return inserted, skipped
+    @staticmethod
+    def _upsert_checkpoints(cursor: sqlite3.Cursor, checkpoints: Dict[int, int]):
+        """取得済み位置を新しい方に更新（コミットは呼び出し側で行う）"""
+        cursor.executemany(
+            """
+            INSERT INTO channel_checkpoints (channel_id, last_message_id)
+            VALUES (?, ?)
+            ON CONFLICT(channel_id) DO UPDATE SET
+                last_message_id = MAX(last_message_id, excluded.last_message_id),
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            checkpoints.items(),
+        )
 
     def get_all_messages(
         self,
@@ -194,9 +640,9 @@ class KnowledgeDB:
         Returns:
             メッセージデータの辞書のリスト
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        with self._get_connection() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
 
             query = "SELECT * FROM messages WHERE 1=1"
             params = []
@@ -223,9 +669,9 @@ class KnowledgeDB:
         Returns:
             メッセージデータの辞書のリスト
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        with self._get_connection() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
 
             cursor.execute("""
                 SELECT m.* FROM messages m
@@ -237,44 +683,136 @@ class KnowledgeDB:
 
             return [dict(row) for row in rows]
 
-    def insert_embedding(self, message_id: int, embedding: List[float]) -> bool:
+    def count_messages_without_embeddings(self) -> int:
+        """
+        埋め込みが未生成のメッセージ数を取得
+
+        Returns:
+            埋め込みが未生成のメッセージ数
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT COUNT(*) FROM messages m
+                LEFT JOIN embeddings e ON m.id = e.message_id
+                WHERE e.message_id IS NULL
+                """)
+            return cursor.fetchone()[0]
+
+    def iter_messages_without_embeddings(
+        self, batch_size: int = 1000
+    ) -> Iterator[List[Dict]]:
+        """
+        埋め込みが未生成のメッセージを一定件数ずつ取得
+
+        メッセージIDの昇順にキーセットページングで読み込むため、
+        各ページの埋め込みを保存しながら処理しても読み飛ばしや重複は発生せず、
+        メモリ使用量はページサイズに比例した一定量に収まります。
+
+        Args:
+            batch_size: 1ページあたりの件数
+
+        Yields:
+            List[Dict]: メッセージデータの辞書のリスト（1ページ分）
+        """
+        last_id = None
+        while True:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                query = """
+                    SELECT m.* FROM messages m
+                    LEFT JOIN embeddings e ON m.id = e.message_id
+                    WHERE e.message_id IS NULL
+                """
+                params = []
+                if last_id is not None:
+                    query += " AND m.id > ?"
+                    params.append(last_id)
+                query += " ORDER BY m.id LIMIT ?"
+                params.append(batch_size)
+
+                cursor.execute(query, params)
+                page = [dict(row) for row in cursor.fetchall()]
+
+            if not page:
+                return
+            last_id = page[-1]["id"]
+            yield page
+
+    def insert_embedding(
+        self, message_id: int, embedding: Union[Sequence[float], np.ndarray]
+    ) -> bool:
         """
         埋め込みベクトルを挿入
 
+        ベクトルはリトルエンディアンfloat32のBLOBとして保存されます。
+
         Args:
             message_id: メッセージID
-            embedding: 埋め込みベクトル
+            embedding: 埋め込みベクトル（リストまたは1次元配列）
 
         Returns:
             bool: 新規挿入された場合True、既存でスキップされた場合False
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        inserted, _ = self.insert_embeddings_batch([message_id], [embedding])
+        return inserted == 1
 
-            # 既存チェック
-            cursor.execute(
-                "SELECT message_id FROM embeddings WHERE message_id = ?",
-                (message_id,),
+    def insert_embeddings_batch(
+        self,
+        message_ids: Sequence[int],
+        embeddings: Union[Sequence[Sequence[float]], np.ndarray],
+    ) -> Tuple[int, int]:
+        """
+        複数の埋め込みベクトルを1トランザクションで一括挿入
+
+        既存の埋め込み（バッチ内の重複を含む）はスキップされます。
+        新規に挿入した埋め込みには、既存の最大値より大きい連番（seq）を割り当てます。
+
+        Args:
+            message_ids: メッセージIDのシーケンス
+            embeddings: 埋め込みベクトルのシーケンス（または件数×次元数の行列）
+
+        Returns:
+            Tuple[int, int]: (新規挿入数, スキップ数)
+
+        Raises:
+            ValueError: メッセージIDと埋め込みの件数が一致しない場合
+        """
+        if len(message_ids) != len(embeddings):
+            raise ValueError(
+                "メッセージIDと埋め込みの件数が一致しません: "
+                f"{len(message_ids)}, {len(embeddings)}"
             )
-            if cursor.fetchone() is not None:
-                return False
+        if len(message_ids) == 0:
+            return 0, 0
 
-            # 新規挿入
-            cursor.execute(
+        rows = []
+        for message_id, embedding in zip(message_ids, embeddings):
+            blob, dim = _encode_vector(embedding)
+            rows.append((int(message_id), blob, dim, EMBEDDING_DTYPE))
+
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
                 """
-                INSERT INTO embeddings (message_id, embedding_vector)
-                VALUES (?, ?)
+                INSERT OR IGNORE INTO embeddings
+                (message_id, embedding_vector, dim, dtype, seq)
+                VALUES (?, ?, ?, ?,
+                        (SELECT COALESCE(MAX(seq), 0) + 1 FROM embeddings))
                 """,
-                (message_id, json.dumps(embedding)),
+                rows,
             )
+            inserted = cursor.rowcount
             conn.commit()
-            return True
+
+        return inserted, len(rows) - inserted
 
     def get_all_embeddings(
         self,
         category: Optional[str] = None,
         min_importance: Optional[int] = None,
-    ) -> Tuple[List[str], List[List[float]]]:
+    ) -> Tuple[List[str], np.ndarray]:
         """
         全埋め込みデータを取得
 
@@ -283,40 +821,229 @@ class KnowledgeDB:
             min_importance: 最小重要度でフィルタ（省略時は全て）
 
         Returns:
-            Tuple[List[str], List[List[float]]]: (テキストリスト, 埋め込みリスト)
+            Tuple[List[str], np.ndarray]: (テキストリスト, 埋め込み行列)
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
+        _, texts, matrix = self.get_embedding_matrix(category, min_importance)
+        return texts, matrix
 
-            query = """
-                SELECT m.content, e.embedding_vector
-                FROM messages m
-                INNER JOIN embeddings e ON m.id = e.message_id
-                WHERE 1=1
-            """
+    def get_embedding_matrix(
+        self,
+        category: Optional[str] = None,
+        min_importance: Optional[int] = None,
+    ) -> Tuple[np.ndarray, List[str], np.ndarray]:
+        """
+        全埋め込みデータを1つの連続したfloat32行列として取得
+
+        BLOBを連結して直接行列化するため、行ごとのデコード処理は発生しません。
+        返される行列は読み取り専用です。
+
+        Args:
+            category: カテゴリでフィルタ（省略時は全て）
+            min_importance: 最小重要度でフィルタ（省略時は全て）
+
+        Returns:
+            Tuple[np.ndarray, List[str], np.ndarray]:
+                (メッセージID配列, テキストリスト, 埋め込み行列（件数×次元数）)
+
+        Raises:
+            ValueError: 次元数の異なる埋め込みが混在している場合
+        """
+        message_ids, texts, matrix, _ = self.get_embedding_matrix_with_metadata(
+            category, min_importance
+        )
+        return message_ids, texts, matrix
+
+    def get_embedding_matrix_with_metadata(
+        self,
+        category: Optional[str] = None,
+        min_importance: Optional[int] = None,
+        after_seq: Optional[int] = None,
+    ) -> Tuple[np.ndarray, List[str], np.ndarray, Dict]:
+        """
+        埋め込み行列と、行の順序が揃ったメタデータ列をまとめて取得
+
+        メタデータは埋め込みと同じクエリで取得するため、行の対応がずれることはありません。
+
+        Args:
+            category: カテゴリでフィルタ（省略時は全て）
+            min_importance: 最小重要度でフィルタ（省略時は全て）
+            after_seq: 指定した連番より後に追加された埋め込みのみ取得（差分の読み込み）。
+                指定時は連番の順に返し、idx_embeddings_seqで差分の行だけを探索します
+
+        Returns:
+            Tuple[np.ndarray, List[str], np.ndarray, Dict]:
+                (メッセージID配列, テキストリスト, 埋め込み行列（件数×次元数）,
+                メタデータ列の辞書（channel_id, author_id, importance, timestamp,
+                category, seq）)
+
+        Raises:
+            ValueError: 次元数の異なる埋め込みが混在している場合
+        """
+        if after_seq is not None:
+            query = _EMBEDDING_DELTA_ROWS_QUERY
+            params = [after_seq]
+        else:
+            query = _EMBEDDING_ROWS_QUERY + " WHERE 1=1"
             params = []
 
-            if category is not None:
-                query += " AND m.category = ?"
-                params.append(category)
+        if category is not None:
+            query += " AND m.category = ?"
+            params.append(category)
 
-            if min_importance is not None:
-                query += " AND m.importance >= ?"
-                params.append(min_importance)
+        if min_importance is not None:
+            query += " AND m.importance >= ?"
+            params.append(min_importance)
 
-            query += " ORDER BY m.id"
+        query += " ORDER BY e.seq" if after_seq is not None else " ORDER BY m.id"
 
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
             cursor.execute(query, params)
             rows = cursor.fetchall()
 
-            texts = []
-            embeddings = []
-            for row in rows:
-                texts.append(row["content"])
-                embeddings.append(json.loads(row["embedding_vector"]))
+        return _embedding_rows_to_matrix(rows)
+
+    def iter_embedding_pages(
+        self, page_size: int = EMBEDDING_PAGE_SIZE, max_seq: Optional[int] = None
+    ) -> Iterator[Tuple[np.ndarray, List[str], np.ndarray, Dict]]:
+        """
+        埋め込み行列とメタデータ列をメッセージID順にページ単位で取得
+
+        前のページの最後のメッセージIDより後を読み込む（キーセット方式）ため、
+        件数が多くてもメモリ使用量は1ページ分に収まり、読み込み位置が後ろになっても
+        遅くなりません。
+
+        Args:
+            page_size: 1ページあたりの件数
+            max_seq: 指定した連番以下の埋め込みのみ取得（途中で追加された埋め込みを
+                含めないために使用、省略時は全て）
+
+        Yields:
+            Tuple[np.ndarray, List[str], np.ndarray, Dict]:
+                get_embedding_matrix_with_metadataと同じ形式の1ページ分のデータ
+
+        Raises:
+            ValueError: 次元数の異なる埋め込みが混在している場合
+        """
+        query = _EMBEDDING_ROWS_QUERY + " WHERE m.id > ?"
+        if max_seq is not None:
+            query += " AND e.seq <= ?"
+        query += " ORDER BY m.id LIMIT ?"
+
+        last_id = -1
+        while True:
+            params = [last_id] + ([max_seq] if max_seq is not None else [])
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, params + [max(1, page_size)])
+                rows = cursor.fetchall()
+
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield _embedding_rows_to_matrix(rows)
+
+    def count_embedded_messages(self, max_seq: Optional[int] = None) -> int:
+        """
+        埋め込みのあるメッセージ数を取得（iter_embedding_pagesで取得できる件数）
+
+        Args:
+            max_seq: 指定した連番以下の埋め込みのみ数える（省略時は全て）
+
+        Returns:
+            int: 件数
+        """
+        query = """
+            SELECT COUNT(*)
+            FROM messages m
+            INNER JOIN embeddings e ON m.id = e.message_id
+        """
+        params = []
+        if max_seq is not None:
+            query += " WHERE e.seq <= ?"
+            params.append(max_seq)
+
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            return cursor.fetchone()[0]
+
+    def search_fulltext(
+        self,
+        query: str,
+        limit: int = 20,
+        max_term_matches: int = FTS_MAX_TERM_MATCHES,
+    ) -> List[Tuple[int, float]]:
+        """
+        全文検索インデックスからBM25スコアの高い順にメッセージを検索
+
+        クエリの語のうち一致件数がmax_term_matches件以下のもの（固有名詞など
+        識別力の高い語）だけを使用するため、順位付けの対象が少なく高速です。
+        全ての語が上限を超える場合は、一致件数が上限の_FTS_FALLBACK_MATCH_FACTOR倍
+        以下であれば最も一致の少ない1語を使用します。
+        3文字未満の語は使用できません（_fulltext_termsを参照）。
+
+        Args:
+            query: 検索テキスト（3文字以上のカタカナ・漢字・英数字の語が対象）
+            limit: 取得する最大件数
+            max_term_matches: 使用する語の最大一致件数
+
+        Returns:
+            List[Tuple[int, float]]: (メッセージID, BM25スコア（大きいほど関連が高い))の
+                リスト（全文検索が利用できない場合や使用できる語が無い場合は空）
+        """
+        terms = _fulltext_terms(query)
+        if not self.fulltext_available or not terms or limit <= 0:
+            return []
+
+        max_term_matches = max(1, max_term_matches)
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
 
-            return texts, embeddings
+            def count_matches(phrase, cap):
+                # 順位付けせずに上限+1件まで数える
+                cursor.execute(
+                    "SELECT COUNT(*) FROM (SELECT rowid FROM messages_fts"
+                    " WHERE messages_fts MATCH ? LIMIT ?)",
+                    (phrase, cap + 1),
+                )
+                return cursor.fetchone()[0]
+
+            # 一致件数の多い語を除外
+            counts = {}
+            for term in terms:
+                phrase = f'"{term}"'
+                counts[phrase] = count_matches(phrase, max_term_matches)
+            phrases = [p for p, n in counts.items() if 0 < n <= max_term_matches]
+
+            if not phrases:
+                # 全ての語が上限を超えた場合は、上限の数倍まで数え直して
+                # 最も一致の少ない語を使用する
+                fallback_cap = max_term_matches * _FTS_FALLBACK_MATCH_FACTOR
+                common = {
+                    phrase: count_matches(phrase, fallback_cap)
+                    for phrase, n in counts.items()
+                    if n > 0
+                }
+                if common:
+                    rarest = min(common, key=common.__getitem__)
+                    if common[rarest] <= fallback_cap:
+                        phrases = [rarest]
+            if not phrases:
+                return []
+
+            # bm25()は関連が高いほど小さい値を返すため符号を反転
+            cursor.execute(
+                """
+                SELECT rowid, -bm25(messages_fts)
+                FROM messages_fts
+                WHERE messages_fts MATCH ?
+                ORDER BY rank
+                LIMIT ?
+                """,
+                (" OR ".join(phrases), limit),
+            )
+            return [(row[0], row[1]) for row in cursor.fetchall()]
 
     def get_message_count(self) -> int:
         """
@@ -325,21 +1052,41 @@ class KnowledgeDB:
         Returns:
             メッセージ総数
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT COUNT(*) FROM messages")
             return cursor.fetchone()[0]
 
-    def get_embedding_count(self) -> int:
+    def get_max_embedding_seq(self) -> int:
+        """
+        埋め込みの連番の最大値を取得（新しい埋め込みの有無の確認に使用）
+
+        Returns:
+            int: 連番の最大値（埋め込みが無い場合は0）
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM embeddings")
+            return cursor.fetchone()[0]
+
+    def get_embedding_count(self, max_seq: Optional[int] = None) -> int:
         """
         埋め込み総数を取得
 
+        Args:
+            max_seq: 指定した連番以下の埋め込みのみ数える（省略時は全て）
+
         Returns:
             埋め込み総数
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM embeddings")
+            if max_seq is None:
+                cursor.execute("SELECT COUNT(*) FROM embeddings")
+            else:
+                cursor.execute(
+                    "SELECT COUNT(*) FROM embeddings WHERE seq <= ?", (max_seq,)
+                )
             return cursor.fetchone()[0]
 
     def update_message_metadata(
@@ -359,7 +1106,7 @@ class KnowledgeDB:
         Returns:
             bool: 更新された場合True、存在しない場合False
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._get_connection() as conn:
             cursor = conn.cursor()
 
             # 存在チェック
@@ -392,4 +1139,23 @@ class KnowledgeDB:
             return True
 
     def close(self):
-        """データベース接続を閉じる（通常は不要: context managerを使用）"""
+        """
+        全スレッドのデータベース接続を閉じる
+
+        WALの内容をデータベースファイルに書き戻してから閉じるため、
+        スクリプト終了時に呼び出すとknowledge.db単体で完結した状態になります。
+        閉じた後に再度メソッドを呼び出した場合は、新しい接続が作成されます。
+        """
+        with self._connections_lock:
+            connections = self._connections
+            self._connections = []
+            # 各スレッドの接続を無効化するため、スレッドローカルを作り直す
+            self._local = threading.local()
+
+        for i, conn in enumerate(connections):
+            try:
+                if i == 0:
+                    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                conn.close()
+            except sqlite3.Error:
+                pass
@@ -0,0 +1,248 @@
+"""
+Discordメッセージのリアルタイム取り込みモジュール
+
+起動中のBotが受信したメッセージを、バックグラウンドのライタースレッドで
+知識データベースに追加し、埋め込みを生成して検索インデックスに反映します。
+
+- on_messageからはキューに入れるだけなので、Gatewayのイベント処理を止めない
+- キューは上限付きで、溢れたメッセージは破棄する（次回のfetch_messages.pyで取得される）
+- ライターは最大 batch_size 件、または最初のメッセージから flush_interval 秒ごとに
+  まとめてデータベースに挿入し、新規に挿入したメッセージだけを1回のencodeで埋め込む
+- 埋め込みモデルは最初の埋め込みの前に1回だけロードし、ロードに失敗した場合は
+  以降は埋め込みを行わずにメッセージの保存のみを行う（バッチごとに再試行しない）
+- 埋め込みに失敗した場合もメッセージは保存され、次回のprepare_dataset.pyで埋め込まれる
+"""
+
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from fetch_messages import message_to_record
+from knowledge_db import KnowledgeDB
+
+# デフォルト設定
+DEFAULT_MAX_QUEUE_SIZE = 10_000
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+# 破棄したメッセージ数を表示する間隔（件）
+_DROP_REPORT_INTERVAL = 100
+
+# 終了を通知するための番兵
+_STOP = object()
+
+
+class LiveIngestor:
+    """受信したメッセージを知識データに追加するバックグラウンドライター"""
+
+    def __init__(
+        self,
+        db_path: str,
+        encode_batch: Optional[Callable[[List[str]], Sequence]] = None,
+        on_indexed: Optional[Callable[[], object]] = None,
+        load_model: Optional[Callable[[], object]] = None,
+        guild_id: Optional[int] = None,
+        excluded_channels: Iterable[str] = (),
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    ):
+        """
+        ライターを初期化し、ライタースレッドを開始
+
+        Args:
+            db_path: 知識データベースのパス
+            encode_batch: テキストのリストを受け取り埋め込み行列を返す関数
+                （省略時はメッセージの保存のみ）
+            on_indexed: 埋め込みを保存した後に呼び出す関数（検索インデックスへの反映用）
+            load_model: 埋め込みモデルをロードする関数（最初の埋め込みの前に
+                ライタースレッドで1回だけ呼び出し、失敗した場合は以降の埋め込みを行わない）
+            guild_id: 取り込むギルドのID（省略時は全て）
+            excluded_channels: 取り込まないチャンネル名
+            max_queue_size: 書き込み待ちのメッセージの上限
+            batch_size: 1回にまとめて書き込む最大件数
+            flush_interval: 最初のメッセージから書き込みまでに待つ最大時間（秒）
+        """
+        self.db = KnowledgeDB(db_path)
+        self._encode_batch = encode_batch
+        self._on_indexed = on_indexed
+        self._load_model = load_model
+        self.guild_id = guild_id
+        self.excluded_channels = set(excluded_channels)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval)
+        self._queue = queue.Queue(maxsize=max(1, max_queue_size))
+        self._closed = False
+        self.dropped = 0  # キューが溢れて破棄したメッセージ数
+        self.stored = 0  # データベースに新規追加したメッセージ数
+        self.embedded = 0  # 埋め込みを保存したメッセージ数
+        self._thread = threading.Thread(
+            target=self._run, name="live_ingestor", daemon=True
+        )
+        self._thread.start()
+
+    def is_eligible(self, message) -> bool:
+        """
+        知識データとして取り込む対象のメッセージか判定
+
+        fetch_messages.pyと同じく、Bot以外が投稿した本文のあるメッセージが対象です。
+
+        Args:
+            message: discord.Message
+
+        Returns:
+            bool: 取り込む対象の場合True
+        """
+        if message.author.bot or not message.content.strip():
+            return False
+        if message.guild is None:
+            return False
+        if self.guild_id is not None and message.guild.id != self.guild_id:
+            return False
+        # スレッドは親チャンネルが除外されている場合も対象外
+        parent = getattr(message.channel, "parent", None)
+        names = {getattr(message.channel, "name", None), getattr(parent, "name", None)}
+        return not names & self.excluded_channels
+
+    def submit_message(self, message) -> bool:
+        """
+        対象のメッセージであれば書き込みキューに追加（ブロックしない）
+
+        Args:
+            message: discord.Message
+
+        Returns:
+            bool: キューに追加した場合True
+        """
+        if not self.is_eligible(message):
+            return False
+        return self.submit(message_to_record(message))
+
+    def submit(self, record: Dict) -> bool:
+        """
+        メッセージの辞書を書き込みキューに追加（ブロックしない）
+
+        Args:
+            record: KnowledgeDB.insert_messages_batchに渡すメッセージの辞書
+
+        Returns:
+            bool: キューに追加した場合True（終了済み・キューが満杯の場合False）
+        """
+        if self._closed:
+            return False
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % _DROP_REPORT_INTERVAL == 1:
+                print(
+                    "⚠️ 取り込み待ちのメッセージが上限に達したため破棄しました"
+                    f"（累計: {self.dropped}件）"
+                )
+            return False
+        return True
+
+    @property
+    def pending(self) -> int:
+        """書き込み待ちのメッセージ数"""
+        return self._queue.qsize()
+
+    def close(self):
+        """ライタースレッドを終了（キューに残ったメッセージは書き込んでから終了）"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        self.db.close()
+
+    def _collect(self):
+        """最初のメッセージを待ち、待機時間内に届いたメッセージをまとめて返す"""
+        first = self._queue.get()
+        if first is _STOP:
+            return None, True
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = (
+                    self._queue.get(timeout=remaining)
+                    if remaining > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        """ライタースレッドの本体"""
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if not batch:
+                continue
+            try:
+                self._write(batch)
+            except Exception as e:
+                print(f"⚠️ メッセージの取り込みに失敗しました: {e}")
+
+    def _write(self, batch: List[Dict]):
+        """メッセージを保存し、新規に挿入したメッセージの埋め込みを生成してインデックスに反映"""
+        new_ids = self.db.insert_new_messages(batch)
+        self.stored += len(new_ids)
+        if not new_ids or not self._embedding_available():
+            return
+
+        # 既に保存済みだったメッセージ（バッチ内の重複を含む）は埋め込まない
+        new_id_set = set(new_ids)
+        contents = {}
+        for record in batch:
+            if record["id"] in new_id_set:
+                contents.setdefault(record["id"], record["content"])
+        try:
+            embeddings = np.asarray(
+                self._encode_batch(list(contents.values())), dtype=np.float32
+            )
+        except Exception as e:
+            # メッセージは保存済みのため、次回のprepare_dataset.pyで埋め込まれる
+            print(f"⚠️ 取り込んだメッセージの埋め込みに失敗しました: {e}")
+            return
+
+        embedded, _ = self.db.insert_embeddings_batch(list(contents), embeddings)
+        self.embedded += embedded
+        if embedded > 0 and self._on_indexed is not None:
+            self._on_indexed()
+
+    def _embedding_available(self) -> bool:
+        """
+        埋め込みを行えるか判定（初回のみ埋め込みモデルをロード）
+
+        モデルのロードに失敗した場合は、その旨を1回だけ表示して以降の埋め込みを
+        行いません（メッセージの保存は続けます）。
+
+        Returns:
+            bool: 埋め込みを行える場合True
+        """
+        if self._encode_batch is None:
+            return False
+        if self._load_model is not None:
+            load_model, self._load_model = self._load_model, None
+            try:
+                load_model()
+            except Exception as e:
+                print(f"⚠️ 埋め込みモデルのロードに失敗しました: {e}")
+                print(
+                    "   💡 以降はメッセージの保存のみを行います"
+                    "（次回のprepare_dataset.pyで埋め込まれます）"
+                )
+                self._encode_batch = None
+                self._on_indexed = None
+                return False
+        return True
@@ -5,6 +5,7 @@ LLM APIエラーハンドリングモジュール
 ログ出力を行います。
 """
 
+import asyncio
 import logging
 import time
 
@@ -202,3 +203,14 @@ def wait_for_retry(wait_seconds):
     """
     if wait_seconds > 0:
         time.sleep(wait_seconds)
+
+
+async def wait_for_retry_async(wait_seconds):
+    """
+    リトライ前に待機（非同期版、待機中もイベントループを止めない）
+
+    Args:
+        wait_seconds: 待機時間（秒）
+    """
+    if wait_seconds > 0:
+        await asyncio.sleep(wait_seconds)
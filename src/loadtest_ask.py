@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+!askコマンドの同時実行ロードテストスクリプト
+
+main.on_messageに多数の!askメッセージを同時に渡し、応答生成が並行して
+処理されること（直列に待たされないこと）とイベントループの遅延を確認します。
+クエリの埋め込み計算と類似メッセージ検索は指定時間ブロックするスタブに、
+LLM API呼び出しは指定時間awaitするコルーチンのスタブに置き換えます。
+検索の同時実行数がMAX_CONCURRENT_RESPONSESを超えないことも確認できます。
+Discordへの接続やAPIキーは不要です。
+
+使用例:
+    python src/loadtest_ask.py
+    MAX_CONCURRENT_RESPONSES=16 python src/loadtest_ask.py --requests 50 --llm-latency 2
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import PropertyMock, patch
+
+# main.pyのインポートに必要な環境変数（実際には接続しない）
+os.environ.setdefault("DISCORD_TOKEN", "loadtest")
+os.environ.setdefault("TARGET_GUILD_ID", "0")
+os.environ.setdefault("GEMINI_API_KEY", "loadtest")
+
+import numpy as np  # noqa: E402
+
+import ai_chatbot  # noqa: E402
+import main  # noqa: E402
+from embedding_index import SearchResult  # noqa: E402
+
+
+class _FakeUser:
+    """Bot自身とメッセージ送信者を表すスタブ"""
+
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class _FakeChannel:
+    """送信された応答を記録するチャンネルのスタブ"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, content):
+        self.sent.append((time.perf_counter(), content))
+
+
+class _FakeMessage:
+    """!askメッセージのスタブ"""
+
+    def __init__(self, content, author, channel):
+        self.content = content
+        self.author = author
+        self.mentions = []
+        self.channel = channel
+
+
+class _ConcurrencyCounter:
+    """同時実行数を記録するカウンタ"""
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+
+    def exit(self):
+        with self._lock:
+            self.active -= 1
+
+
+class _BlockingEncoder(_ConcurrencyCounter):
+    """指定時間ブロックするencode_queryのスタブ"""
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+
+    def __call__(self, query):
+        self.enter()
+        try:
+            # マイクロバッチでの埋め込み計算の完了待ちの代わり
+            time.sleep(self.latency)
+            return np.ones(2, dtype=np.float32)
+        finally:
+            self.exit()
+
+
+class _BlockingSearch(_ConcurrencyCounter):
+    """指定時間ブロックする_search_indexのスタブ"""
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+
+    def __call__(self, query, query_emb, top_k, filters=None):
+        self.enter()
+        try:
+            # ベクトル検索・全文検索の代わり
+            time.sleep(self.latency)
+            # 質問ごとに異なる文脈を返し、応答キャッシュにはヒットさせない
+            message_id = int(query.removeprefix("質問"))
+            return [SearchResult(message_id, 0.9, f"過去メッセージ: {query}")]
+        finally:
+            self.exit()
+
+
+class _AsyncLLM(_ConcurrencyCounter):
+    """指定時間awaitするgenerate_response_with_llm_asyncのスタブ"""
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+
+    async def __call__(self, query, similar_messages):
+        self.enter()
+        try:
+            # Gemini APIの応答待ちの代わり
+            await asyncio.sleep(self.latency)
+            return f"応答: {query}", None
+        finally:
+            self.exit()
+
+
+async def _measure_loop_lag(stop, interval=0.01):
+    """イベントループの最大遅延（秒）を計測"""
+    max_lag = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        max_lag = max(max_lag, time.perf_counter() - start - interval)
+    return max_lag
+
+
+async def run_loadtest(num_requests, search_latency, llm_latency, encode_latency):
+    """
+    !askメッセージを同時に処理して結果を表示
+
+    Args:
+        num_requests: 同時に送るメッセージ数
+        search_latency: 1件あたりの類似メッセージ検索時間（秒）
+        llm_latency: 1件あたりのLLM API応答時間（秒）
+        encode_latency: 1件あたりのクエリの埋め込み待ち時間（秒）
+    """
+    encoder = _BlockingEncoder(encode_latency)
+    search = _BlockingSearch(search_latency)
+    llm = _AsyncLLM(llm_latency)
+    bot_user = _FakeUser(1)
+    author = _FakeUser(2)
+    channel = _FakeChannel()
+    messages = [
+        _FakeMessage(f"!ask 質問{i}", author, channel) for i in range(num_requests)
+    ]
+
+    with (
+        tempfile.NamedTemporaryFile(suffix=".db") as db_file,
+        patch.object(main, "DB_PATH", db_file.name),
+        patch.object(main, "generate_response", ai_chatbot.generate_response_async),
+        patch.object(ai_chatbot, "encode_query", encoder),
+        patch.object(ai_chatbot, "_search_index", search),
+        patch.object(ai_chatbot, "_get_response_cache_version", lambda: "loadtest"),
+        patch.object(ai_chatbot, "generate_response_with_llm_async", llm),
+        patch.object(ai_chatbot, "_initialized", True),
+        patch.object(
+            type(main.client), "user", new_callable=PropertyMock, return_value=bot_user
+        ),
+    ):
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(_measure_loop_lag(stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(main.on_message(m) for m in messages))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        max_lag = await lag_task
+
+    replies = [content for _, content in channel.sent if content.startswith("応答")]
+    serial = num_requests * (encode_latency + search_latency + llm_latency)
+    print(f"メッセージ数: {num_requests}, 応答数: {len(replies)}")
+    print(f"検索の同時実行数の上限: {ai_chatbot.get_max_concurrent_responses()}")
+    print(f"検索の最大同時実行数: {search.max_active}")
+    print(f"埋め込み待ちの最大同時実行数: {encoder.max_active}")
+    print(f"LLM API呼び出しの最大同時実行数: {llm.max_active}")
+    print(f"所要時間: {elapsed:.2f}秒（直列の場合: {serial:.2f}秒）")
+    print(f"高速化: {serial / elapsed:.1f}x")
+    print(f"イベントループの最大遅延: {max_lag * 1000:.1f}ms")
+
+
+def main_cli():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="!askコマンドの同時実行ロードテスト")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument(
+        "--search-latency",
+        type=float,
+        default=0.05,
+        help="1件あたりの類似メッセージ検索時間（秒）",
+    )
+    parser.add_argument(
+        "--encode-latency",
+        type=float,
+        default=0.05,
+        help="1件あたりのクエリの埋め込み待ち時間（秒）",
+    )
+    parser.add_argument(
+        "--llm-latency",
+        type=float,
+        default=1.0,
+        help="1件あたりのLLM API応答時間（秒）",
+    )
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("!askコマンド同時実行ロードテスト")
+    print("=" * 60)
+    asyncio.run(
+        run_loadtest(
+            args.requests, args.search_latency, args.llm_latency, args.encode_latency
+        )
+    )
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,8 +1,11 @@
+import asyncio
 import os
 
 import discord
 from discord import app_commands
 
+from env_config import env_number
+
 DB_PATH = os.path.join(os.path.dirname(__file__), "../data/knowledge.db")
 
 # 環境変数から機密情報を読み取る
@@ -16,6 +19,10 @@ if not GUILD_ID_STR:
 
 GUILD_ID = int(GUILD_ID_STR)
 
+
+# 1件の応答生成を待つ最大時間（秒）。超過した場合はLLM API呼び出しをキャンセルする
+RESPONSE_TIMEOUT_SECONDS = env_number("RESPONSE_TIMEOUT_SECONDS", 60.0, cast=float)
+
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
@@ -37,6 +44,12 @@ class MyClient(discord.Client):
         except Exception as e:
             print(f"⚠️ スラッシュコマンドの同期に失敗しました: {e}")
 
+    async def close(self):
+        # 取り込み待ちのメッセージを書き込んでから終了（イベントループは止めない）
+        if live_ingestor is not None:
+            await asyncio.to_thread(live_ingestor.close)
+        await super().close()
+
 
 client = MyClient(intents=intents)
 
@@ -47,7 +60,8 @@ generate_response = None
 # データベースが存在すればチャットボット機能を有効化
 if os.path.exists(DB_PATH):
     try:
-        from ai_chatbot import generate_response
+        # 応答生成はイベントループを止めない非同期版を使用
+        from ai_chatbot import generate_response_async as generate_response
 
         print("✅ AIチャットボット機能が有効化されました")
         print("   💡 モデルとデータは初回応答時に自動的にロードされます")
@@ -63,6 +77,32 @@ if os.path.exists(DB_PATH):
         print(f"❌ AIチャットボットのロード中にエラーが発生しました: {e}")
         generate_response = None
 
+# 受信したメッセージをリアルタイムで知識データに追加（LIVE_INGEST=1で有効）
+live_ingestor = None
+if generate_response and os.environ.get("LIVE_INGEST", "0") == "1":
+    try:
+        from ai_chatbot import encode_texts, load_embedding_model, refresh_index
+        from live_ingest import LiveIngestor
+
+        # 最初に取り込んだメッセージで埋め込みモデルをロードし、
+        # 埋め込みを保存した後のrefresh_indexで検索インデックスを初期化する
+        live_ingestor = LiveIngestor(
+            DB_PATH,
+            encode_batch=encode_texts,
+            on_indexed=refresh_index,
+            load_model=load_embedding_model,
+            guild_id=GUILD_ID,
+            excluded_channels=[
+                ch.strip()
+                for ch in os.environ.get("EXCLUDED_CHANNELS", "").split(",")
+                if ch.strip()
+            ],
+        )
+        print("   📥 受信したメッセージを知識データに自動で追加します")
+    except Exception as e:
+        print(f"⚠️ メッセージの自動取り込みを開始できませんでした: {e}")
+        live_ingestor = None
+
 
 @client.event
 async def on_ready():
@@ -77,7 +117,11 @@ async def on_message(message):
     if message.author == client.user:
         return
     # Botへのメンション or !ask コマンドで応答
-    if client.user in message.mentions or message.content.startswith("!ask "):
+    is_question = client.user in message.mentions or message.content.startswith("!ask ")
+    if live_ingestor is not None and not is_question:
+        # キューに入れるだけなのでイベント処理はブロックしない
+        live_ingestor.submit_message(message)
+    if is_question:
         query = (
             message.content.replace("!ask ", "")
             .replace(f"<@{client.user.id}>", "")
@@ -97,7 +141,7 @@ async def on_message(message):
             # LLMを使用して返信を生成
             try:
                 # 初回初期化の責任をai_chatbotモジュール側に持たせる
-                from ai_chatbot import ensure_initialized_with_callback
+                from ai_chatbot import ensure_initialized_async
 
                 loading_msg = None
 
@@ -105,10 +149,8 @@ async def on_message(message):
                     """初回初期化開始時のコールバック"""
                     # この時点ではasyncコンテキスト外なので、メッセージ送信は後で行う
 
-                # 初期化を実行し、初回かどうかを判定
-                was_already_initialized = ensure_initialized_with_callback(
-                    on_first_init
-                )
+                # 初期化を実行し、初回かどうかを判定（ロード中もイベントループは停止しない）
+                was_already_initialized = await ensure_initialized_async(on_first_init)
 
                 # 初回初期化の場合のみローディングメッセージを表示
                 if not was_already_initialized:
@@ -117,7 +159,9 @@ async def on_message(message):
                     )
 
                 try:
-                    response = generate_response(query)
+                    response = await asyncio.wait_for(
+                        generate_response(query), timeout=RESPONSE_TIMEOUT_SECONDS
+                    )
                 finally:
                     # エラーが発生してもローディングメッセージを削除
                     if loading_msg:
@@ -131,6 +175,10 @@ async def on_message(message):
                     )
 
                 await message.channel.send(response)
+            except asyncio.TimeoutError:
+                await message.channel.send(
+                    "⚠️ 応答の生成がタイムアウトしました。しばらくしてから再度お試しください。"
+                )
             except ValueError as e:
                 # APIキー未設定または類似メッセージ未検出
                 await message.channel.send(f"⚠️ 設定エラー: {str(e)}")
@@ -3,6 +3,21 @@
 
 メッセージデータから埋め込みベクトルを生成します。
 データベースモード: 未生成メッセージのみ処理（増分更新）
+
+未生成メッセージは一定件数ずつ読み込み、チャンクごとに埋め込みを生成して
+コミットします。メモリ使用量はチャンクサイズ（EMBEDDING_CHUNK_SIZE）で決まり、
+途中で中断しても次回は未処理のメッセージから再開されます。
+
+環境変数 EMBEDDING_WORKERS に2以上（または auto）を指定すると、
+各プロセスがモデルを保持するワーカープールで並列に埋め込みを生成します。
+データベースへの書き込みはメインプロセスのみが行います。
+
+近似最近傍インデックス（data/knowledge.ivf.npz）が存在する場合は、
+新しい埋め込みを増分追加します。環境変数 ANN_INDEX=1 を指定すると、
+インデックスが存在しない場合に新規構築します。
+
+Bot起動を高速化するため、埋め込みのスナップショット（data/knowledge_snapshot）も
+書き出します（EMBEDDING_SNAPSHOT=0で無効化）。
 """
 
 import os
@@ -10,9 +25,199 @@ import sys
 
 from sentence_transformers import SentenceTransformer
 
+from ann_index import IVFIndex
+from embedding_index import normalize_rows
+from embedding_snapshot import is_up_to_date, read_manifest, write_snapshot
+from embedding_workers import MODEL_NAME, EmbeddingWorkerPool, get_worker_count
+from env_config import env_number
 from knowledge_db import KnowledgeDB
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "../data/knowledge.db")
+ANN_INDEX_PATH = os.path.join(os.path.dirname(__file__), "../data/knowledge.ivf.npz")
+SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), "../data/knowledge_snapshot")
+
+# 1チャンクあたりのメッセージ数のデフォルト値
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def get_chunk_size():
+    """
+    環境変数 EMBEDDING_CHUNK_SIZE から1チャンクあたりの件数を取得
+
+    Returns:
+        int: チャンクサイズ（未設定・不正な値の場合はDEFAULT_CHUNK_SIZE）
+    """
+    return env_number("EMBEDDING_CHUNK_SIZE", DEFAULT_CHUNK_SIZE, minimum=1)
+
+
+def extract_texts(messages):
+    """
+    メッセージ本文のみ抽出（空コンテンツを除外しつつIDと整合性を保持）
+
+    Args:
+        messages: メッセージデータの辞書のリスト
+
+    Returns:
+        tuple: (message_ids: List[int], texts: List[str])
+    """
+    texts = []
+    message_ids = []
+    for msg in messages:
+        content = msg.get("content", "")
+        if not isinstance(content, str):
+            continue
+        if not content.strip():
+            continue
+        texts.append(content)
+        message_ids.append(msg["id"])
+    return message_ids, texts
+
+
+def load_ann_index():
+    """
+    既存の近似最近傍インデックスを読み込む
+
+    Returns:
+        IVFIndex or None: インデックス（存在しない場合はNone）
+    """
+    if not os.path.exists(ANN_INDEX_PATH):
+        return None
+    return IVFIndex.load(ANN_INDEX_PATH)
+
+
+def finalize_ann_index(db, ann, added):
+    """
+    近似最近傍インデックスを保存して結果を表示、または新規構築
+
+    既存のインデックスは追加があった場合のみ保存し、
+    存在しない場合はANN_INDEX=1が指定されたときのみ全件から構築します。
+
+    Args:
+        db: KnowledgeDBインスタンス
+        ann: 増分追加済みのIVFIndex（存在しない場合はNone）
+        added: 今回追加した件数
+    """
+    if ann is not None:
+        if added > 0:
+            ann.save(ANN_INDEX_PATH)
+        print(f"🧭 近似最近傍インデックスを更新しました（追加: {added}件）")
+    elif os.environ.get("ANN_INDEX") == "1":
+        if db.count_embedded_messages() == 0:
+            return
+        print("🧭 近似最近傍インデックスを構築中...")
+        ann = build_ann_index(db)
+        ann.save(ANN_INDEX_PATH)
+        print(f"✅ 近似最近傍インデックスを構築しました（クラスタ数: {ann.nlist}）")
+
+
+def build_ann_index(db):
+    """
+    データベースの埋め込みから近似最近傍インデックスを構築
+
+    埋め込みをページ単位で読み込み、無作為サンプルでセントロイドを学習した後に
+    ページごとにクラスタへ割り当てるため、全件の行列をメモリに載せません。
+
+    Args:
+        db: KnowledgeDBインスタンス
+
+    Returns:
+        IVFIndex: 構築したインデックス
+    """
+
+    def pages():
+        for message_ids, _, matrix, _ in db.iter_embedding_pages():
+            yield normalize_rows(matrix), message_ids
+
+    return IVFIndex.train_from_pages(pages)
+
+
+def iter_pending_chunks(db, chunk_size):
+    """
+    未生成メッセージをページ単位で読み込み、埋め込み対象のチャンクを返す
+
+    Args:
+        db: KnowledgeDBインスタンス
+        chunk_size: 1チャンクあたりのメッセージ数
+
+    Yields:
+        tuple: ((message_ids, ページの件数), texts)
+    """
+    for page in db.iter_messages_without_embeddings(chunk_size):
+        message_ids, texts = extract_texts(page)
+        yield (message_ids, len(page)), texts
+
+
+def encode_in_process(model, chunks):
+    """
+    チャンクを現在のプロセスで順番に埋め込む
+
+    Args:
+        model: SentenceTransformerモデル
+        chunks: iter_pending_chunksが返すチャンクのイテラブル
+
+    Yields:
+        tuple: (キー, 埋め込み行列)
+    """
+    for key, texts in chunks:
+        if texts:
+            yield key, model.encode(texts, show_progress_bar=False)
+        else:
+            yield key, None
+
+
+def embed_pending_messages(db, encoded_chunks, pending, ann=None):
+    """
+    埋め込み済みのチャンクをデータベースに書き込み、チャンクごとにコミット
+
+    書き込みはこの関数（単一のライター）のみが行います。
+    近似最近傍インデックスにはチャンクごとに増分追加し、保存はfinalize_ann_indexで
+    最後に1回だけ行います（途中で中断した場合も、保存されていない埋め込みは
+    Botの起動時にEmbeddingIndex.attach_annで割り当てられます）。
+
+    Args:
+        db: KnowledgeDBインスタンス
+        encoded_chunks: ((message_ids, ページの件数), 埋め込み行列)のイテラブル
+        pending: 処理対象の件数（進捗表示用）
+        ann: 増分追加する近似最近傍インデックス（省略可）
+
+    Returns:
+        tuple: (saved_count: int, ann_added: int)
+    """
+    processed = 0
+    saved_count = 0
+    ann_added = 0
+
+    for (message_ids, page_size), embeddings in encoded_chunks:
+        if message_ids:
+            inserted, _ = db.insert_embeddings_batch(message_ids, embeddings)
+            saved_count += inserted
+            if ann is not None:
+                ann_added += ann.add(normalize_rows(embeddings), message_ids)
+
+        processed += page_size
+        print(f"   進捗: {processed}/{pending}件（保存済み: {saved_count}件）")
+
+    return saved_count, ann_added
+
+
+def update_snapshot(db):
+    """
+    埋め込みスナップショットを更新（データベースと件数が異なる場合のみ）
+
+    Args:
+        db: KnowledgeDBインスタンス
+    """
+    if os.environ.get("EMBEDDING_SNAPSHOT") == "0":
+        return
+    embedding_count = db.get_embedding_count()
+    if embedding_count == 0:
+        return
+    if is_up_to_date(read_manifest(SNAPSHOT_DIR), embedding_count):
+        return
+
+    print("📸 埋め込みスナップショットを書き出し中...")
+    version_dir = write_snapshot(db, SNAPSHOT_DIR)
+    print(f"✅ スナップショットを書き出しました: {version_dir}")
 
 
 def main():
@@ -33,56 +238,70 @@ def main():
     print("📊 データベースモード: SQLite（増分更新）")
     db = KnowledgeDB(DB_PATH)
 
-    # 未生成メッセージを取得
-    messages = db.get_messages_without_embeddings()
+    # 未生成メッセージ数を取得（本文はチャンクごとに読み込む）
+    pending = db.count_messages_without_embeddings()
     total_messages = db.get_message_count()
     existing_embeddings = db.get_embedding_count()
 
     print(f"   メッセージ総数: {total_messages}件")
     print(f"   既存埋め込み: {existing_embeddings}件")
-    print(f"   未生成メッセージ: {len(messages)}件")
+    print(f"   未生成メッセージ: {pending}件")
     print()
 
-    if len(messages) == 0:
+    ann = load_ann_index()
+
+    if pending == 0:
         print("✅ 全てのメッセージに埋め込みが生成済みです")
+        finalize_ann_index(db, ann, 0)
+        update_snapshot(db)
+        db.close()
         return
 
-    # メッセージ本文のみ抽出（空コンテンツを除外しつつIDと整合性を保持）
-    texts = []
-    message_ids = []
-    for msg in messages:
-        content = msg.get("content", "")
-        if not isinstance(content, str):
-            continue
-        if not content.strip():
-            continue
-        texts.append(content)
-        message_ids.append(msg["id"])
-
-    # 埋め込みモデルのロード
-    print("🔄 埋め込みモデルをロード中...")
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    print("✅ モデルのロード完了")
-    print()
+    chunk_size = get_chunk_size()
+    workers = get_worker_count()
+    chunks = iter_pending_chunks(db, chunk_size)
 
-    # 埋め込み生成
-    print(f"🔄 {len(texts)}件のメッセージの埋め込みを生成中...")
-    embeddings = model.encode(texts, show_progress_bar=True)
-    print("✅ 埋め込み生成完了")
-    print()
+    if workers > 1:
+        # ワーカープロセスで並列に埋め込み、このプロセスでのみ書き込む
+        print(f"🔄 {workers}個のワーカープロセスで埋め込みモデルをロードします")
+        print(
+            f"🔄 {pending}件のメッセージの埋め込みを生成中（{chunk_size}件ずつ保存）..."
+        )
+        with EmbeddingWorkerPool(workers) as pool:
+            saved_count, ann_added = embed_pending_messages(
+                db, pool.imap(chunks), pending, ann
+            )
+    else:
+        # 埋め込みモデルのロード
+        print("🔄 埋め込みモデルをロード中...")
+        model = SentenceTransformer(MODEL_NAME)
+        print("✅ モデルのロード完了")
+        print()
 
-    # データベースに保存
-    print("💾 データベースに保存中...")
-    saved_count = 0
-    for message_id, embedding in zip(message_ids, embeddings):
-        if db.insert_embedding(message_id, embedding.tolist()):
-            saved_count += 1
+        # チャンクごとに埋め込みを生成してデータベースに保存
+        print(
+            f"🔄 {pending}件のメッセージの埋め込みを生成中（{chunk_size}件ずつ保存）..."
+        )
+        saved_count, ann_added = embed_pending_messages(
+            db, encode_in_process(model, chunks), pending, ann
+        )
 
     total_embeddings = db.get_embedding_count()
+    print()
     print(f"   新規追加: {saved_count}件")
     print(f"   累積総数: {total_embeddings}件")
     print()
     print(f"✅ データベースへの保存が完了しました: {DB_PATH}")
+    print()
+
+    # 近似最近傍インデックスの更新
+    finalize_ann_index(db, ann, ann_added)
+
+    # Bot起動用スナップショットの更新
+    update_snapshot(db)
+
+    # WALの内容をデータベースファイルに書き戻して閉じる
+    db.close()
 
     print()
     print("=" * 60)
@@ -0,0 +1,303 @@
+"""
+意味的応答キャッシュモジュール
+
+LLMが生成した応答を、クエリ埋め込みの類似度で再利用するキャッシュを提供します。
+次の全てが一致した場合にヒットします。
+- バージョン（プロンプト設定・LLMのモデルから算出）が同じ
+- 検索で得られた文脈メッセージのIDの並びが同じ
+- クエリ埋め込みのコサイン類似度が閾値以上
+
+バージョンが変わった古い応答は使用されず、永続化ファイルからも削除されます。
+知識データの変更はバージョンに含めません。新しいメッセージが検索結果に入る質問は
+文脈メッセージのIDの並びが一致しなくなるため再生成され、それ以外の応答は
+有効期限（TTL）まで再利用されます。
+件数が上限を超えた場合は最も古く使われた応答から削除します。
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embedding_index import normalize_rows
+
+# デフォルト設定
+DEFAULT_MAXSIZE = 256
+DEFAULT_THRESHOLD = 0.95
+
+
+class ResponseCacheStats(NamedTuple):
+    """応答キャッシュの統計情報"""
+
+    hits: int
+    misses: int
+    size: int
+    maxsize: int
+    saved_seconds: float  # ヒットにより省略できたLLM呼び出しの合計時間
+
+    @property
+    def hit_rate(self) -> float:
+        """ヒット率（0.0〜1.0、未使用の場合は0.0）"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class _Entry(NamedTuple):
+    """キャッシュされた応答"""
+
+    bucket: Tuple[str, Tuple[int, ...]]
+    embedding: np.ndarray
+    response: str
+    latency: float
+    expires_at: Optional[float]
+
+
+class SemanticResponseCache:
+    """クエリ埋め込みの類似度で応答を再利用するスレッドセーフなキャッシュ"""
+
+    def __init__(
+        self,
+        maxsize: int = DEFAULT_MAXSIZE,
+        threshold: float = DEFAULT_THRESHOLD,
+        ttl: Optional[float] = None,
+        path: Optional[str] = None,
+        version: Optional[str] = None,
+    ):
+        """
+        キャッシュを初期化
+
+        Args:
+            maxsize: 保持する最大件数（0以下の場合はキャッシュしない）
+            threshold: ヒットとみなすコサイン類似度の下限
+            ttl: 有効期限（秒、Noneまたは0以下の場合は無期限）
+            path: 永続化するSQLiteファイルのパス（Noneの場合はメモリのみ）
+            version: 現在のバージョン（指定した場合、永続化ファイルから同じバージョンの
+                応答を読み込み、それ以外を削除）
+        """
+        self.maxsize = max(0, maxsize)
+        self.threshold = threshold
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, Tuple[int, ...]], List[int]] = {}
+        self._lock = threading.Lock()
+        self._next_key = 0
+        self._conn = None
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+        if path is not None and self.maxsize > 0:
+            self._open(path)
+            if version is not None:
+                self._load(version)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(
+        self, query_embedding, context_ids: Sequence[int], version: str
+    ) -> Optional[str]:
+        """
+        類似したクエリに対する応答を検索
+
+        Args:
+            query_embedding: クエリの埋め込みベクトル
+            context_ids: 検索で得られた文脈メッセージのID（順序を含めて比較）
+            version: プロンプト設定・LLMのモデルのバージョン（知識データは含まない）
+
+        Returns:
+            Optional[str]: キャッシュされた応答（ヒットしない場合はNone）
+        """
+        bucket = (version, tuple(int(i) for i in context_ids))
+        query = normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+        now = time.monotonic()
+
+        with self._lock:
+            best_key = None
+            best_score = self.threshold
+            for key in list(self._buckets.get(bucket, ())):
+                entry = self._entries[key]
+                if entry.expires_at is not None and entry.expires_at <= now:
+                    self._remove(key)
+                    continue
+                score = float(entry.embedding @ query)
+                if score >= best_score:
+                    best_key, best_score = key, score
+
+            if best_key is None:
+                self.misses += 1
+                return None
+
+            entry = self._entries[best_key]
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            self.saved_seconds += entry.latency
+            return entry.response
+
+    def store(
+        self,
+        query_embedding,
+        context_ids: Sequence[int],
+        version: str,
+        response: str,
+        latency: float = 0.0,
+    ):
+        """
+        応答を保存（上限を超えた場合は最も古く使われた応答から削除）
+
+        Args:
+            query_embedding: クエリの埋め込みベクトル
+            context_ids: 検索で得られた文脈メッセージのID
+            version: プロンプト設定・LLMのモデルのバージョン（知識データは含まない）
+            response: LLMが生成した応答
+            latency: 応答の生成にかかった時間（秒、節約時間の集計に使用）
+        """
+        if self.maxsize == 0:
+            return
+        bucket = (version, tuple(int(i) for i in context_ids))
+        embedding = normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+        created_at = time.time()
+
+        with self._lock:
+            row_id = None
+            if self._conn is not None:
+                cursor = self._conn.execute(
+                    """
+                    INSERT INTO response_cache
+                        (version, context_ids, query_embedding, response, latency,
+                         created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        version,
+                        ",".join(str(i) for i in bucket[1]),
+                        embedding.astype("<f4").tobytes(),
+                        response,
+                        latency,
+                        created_at,
+                    ),
+                )
+                self._conn.commit()
+                row_id = cursor.lastrowid
+            self._add(bucket, embedding, response, latency, created_at, row_id)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        """全ての応答と統計情報を削除"""
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self.hits = 0
+            self.misses = 0
+            self.saved_seconds = 0.0
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM response_cache")
+                self._conn.commit()
+
+    def stats(self) -> ResponseCacheStats:
+        """
+        統計情報を取得
+
+        Returns:
+            ResponseCacheStats: ヒット数・ミス数・件数・節約できた時間
+        """
+        with self._lock:
+            return ResponseCacheStats(
+                self.hits,
+                self.misses,
+                len(self._entries),
+                self.maxsize,
+                self.saved_seconds,
+            )
+
+    def close(self):
+        """永続化ファイルを閉じる"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _open(self, path: str):
+        """永続化ファイルを開き、テーブルを作成"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                version TEXT NOT NULL,
+                context_ids TEXT NOT NULL,
+                query_embedding BLOB NOT NULL,
+                response TEXT NOT NULL,
+                latency REAL NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """)
+        self._conn.commit()
+
+    def _load(self, version: str):
+        """同じバージョンの応答を読み込み、それ以外のバージョンを削除"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE version != ?", (version,)
+            )
+            if self.ttl is not None:
+                self._conn.execute(
+                    "DELETE FROM response_cache WHERE created_at <= ?",
+                    (time.time() - self.ttl,),
+                )
+            self._conn.commit()
+
+            rows = self._conn.execute(
+                """
+                SELECT id, context_ids, query_embedding, response, latency, created_at
+                FROM response_cache ORDER BY id DESC LIMIT ?
+                """,
+                (self.maxsize,),
+            ).fetchall()
+            for row_id, context_ids, blob, response, latency, created_at in reversed(
+                rows
+            ):
+                ids = tuple(int(i) for i in context_ids.split(",") if i)
+                embedding = np.frombuffer(blob, dtype="<f4").astype(np.float32)
+                self._add(
+                    (version, ids), embedding, response, latency, created_at, row_id
+                )
+
+            # 上限を超えた古い行を削除
+            if rows:
+                self._conn.execute(
+                    "DELETE FROM response_cache WHERE id < ?", (rows[-1][0],)
+                )
+                self._conn.commit()
+
+    def _add(self, bucket, embedding, response, latency, created_at, row_id):
+        """エントリを追加（ロック取得済みで呼び出す）"""
+        if row_id is None:
+            row_id = self._next_key
+        self._next_key = max(self._next_key, row_id) + 1
+        expires_at = None
+        if self.ttl is not None:
+            # 壁時計の作成時刻を単調時計に換算
+            expires_at = time.monotonic() + (created_at + self.ttl - time.time())
+        self._entries[row_id] = _Entry(bucket, embedding, response, latency, expires_at)
+        self._buckets.setdefault(bucket, []).append(row_id)
+
+    def _remove(self, key: int):
+        """エントリを削除（ロック取得済みで呼び出す）"""
+        entry = self._entries.pop(key)
+        keys = self._buckets[entry.bucket]
+        keys.remove(key)
+        if not keys:
+            del self._buckets[entry.bucket]
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM response_cache WHERE id = ?", (key,))
+            self._conn.commit()
@@ -0,0 +1,126 @@
+"""
+リクエスト合流（シングルフライト）モジュール
+
+同じキーの処理が実行中の場合、新たに実行せずに実行中の処理の結果を共有します。
+アナウンス直後などに同じ質問が集中しても、埋め込み計算やLLM API呼び出しは1回で済みます。
+
+- SingleFlight: スレッドから呼び出す同期版
+- AsyncSingleFlight: イベントループ上のコルーチンから呼び出す非同期版
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class _Call:
+    """実行中の処理（同期版）"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """同じキーの同時呼び出しを1回の実行にまとめる（スレッドセーフ）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.coalesced = 0  # 実行中の処理に合流した呼び出し数
+
+    def do(self, key: Hashable, func: Callable, *args, **kwargs) -> Any:
+        """
+        同じキーの処理が実行中ならその結果を待ち、無ければfuncを実行
+
+        Args:
+            key: 合流の単位となるキー
+            func: 実行する関数
+            *args, **kwargs: funcに渡す引数
+
+        Returns:
+            funcの戻り値（合流した場合は実行中の処理の戻り値）
+
+        Raises:
+            funcが送出した例外（合流した呼び出しにも同じ例外を送出）
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                is_leader = True
+            else:
+                self.coalesced += 1
+                is_leader = False
+
+        if not is_leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+class _AsyncCall:
+    """実行中の処理（非同期版）"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """同じキーの同時呼び出しを1つのタスクにまとめる（イベントループ上で使用）"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _AsyncCall] = {}
+        self.coalesced = 0  # 実行中の処理に合流した呼び出し数
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        同じキーの処理が実行中ならその結果を待ち、無ければfunc()を実行
+
+        呼び出し元の1つがキャンセルされても共有の処理は続行し、
+        待っている呼び出しが全てキャンセルされた場合のみ処理をキャンセルします。
+
+        Args:
+            key: 合流の単位となるキー
+            func: コルーチンを返す引数なしの関数
+
+        Returns:
+            func()の結果（合流した場合は実行中の処理の結果）
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _AsyncCall(asyncio.ensure_future(func()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: Hashable, call: _AsyncCall):
+        """完了した処理を登録から外す"""
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -0,0 +1,307 @@
+"""
+非同期応答生成（generate_response_async）のテスト
+"""
+
+import asyncio
+import os
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+
+import ai_chatbot
+from embedding_index import SearchResult
+from response_cache import SemanticResponseCache
+
+
+class TestGenerateResponseAsync(unittest.TestCase):
+    """generate_response_asyncのテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.patches = [
+            mock.patch.dict(os.environ, {"GEMINI_API_KEY": "test_key"}),
+            # 応答キャッシュは無効化（TestResponseCacheIntegrationで確認）
+            mock.patch.object(
+                ai_chatbot, "_response_cache", SemanticResponseCache(maxsize=0)
+            ),
+            mock.patch.object(ai_chatbot, "_get_response_cache_version", lambda: "v"),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        """各テスト後のクリーンアップ"""
+        for patch in reversed(self.patches):
+            patch.stop()
+        self.executor.shutdown(wait=True)
+
+    def _blocking_search(self, query, top_k=3):
+        """指定時間ブロックする_retrieve_contextのスタブ"""
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.1)
+        with self.lock:
+            self.active -= 1
+        return np.ones(2, dtype=np.float32), [
+            SearchResult(1, 0.9, f"過去メッセージ: {query}")
+        ]
+
+    async def _llm_stub(self, query, similar_messages):
+        """待機するだけのgenerate_response_with_llm_asyncのスタブ"""
+        await asyncio.sleep(0.1)
+        return f"応答: {query}", None
+
+    def _patch_pipeline(self, llm=None):
+        """検索とLLM呼び出しをスタブに置き換える"""
+        return (
+            mock.patch.object(ai_chatbot, "_response_executor", self.executor),
+            mock.patch.object(ai_chatbot, "_retrieve_context", self._blocking_search),
+            mock.patch.object(
+                ai_chatbot, "generate_response_with_llm_async", llm or self._llm_stub
+            ),
+        )
+
+    def test_requests_overlap_within_limit(self):
+        """同時実行数の上限まで並行して処理されることのテスト"""
+
+        async def run():
+            ticks = 0
+
+            async def heartbeat():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            beat = asyncio.create_task(heartbeat())
+            start = time.perf_counter()
+            results = await asyncio.gather(
+                *(ai_chatbot.generate_response_async(f"質問{i}") for i in range(8))
+            )
+            elapsed = time.perf_counter() - start
+            beat.cancel()
+            return results, elapsed, ticks
+
+        executor_patch, search_patch, llm_patch = self._patch_pipeline()
+        with executor_patch, search_patch, llm_patch:
+            results, elapsed, ticks = asyncio.run(run())
+
+        self.assertEqual(results, [f"応答: 質問{i}" for i in range(8)])
+        self.assertEqual(self.max_active, 4)
+        # 直列なら1.6秒かかるところ、検索4並列・LLM待機は全件並行で約0.3秒
+        self.assertLess(elapsed, 0.9)
+        # 応答生成中もイベントループは動き続けている
+        self.assertGreater(ticks, 5)
+
+    def test_response_cache_runs_off_event_loop(self):
+        """応答キャッシュの照会・保存がイベントループ外のスレッドで行われることのテスト"""
+        cache = SemanticResponseCache()
+        threads = []
+
+        def record(method):
+            def wrapper(*args, **kwargs):
+                threads.append(threading.current_thread())
+                return method(*args, **kwargs)
+
+            return wrapper
+
+        executor_patch, search_patch, llm_patch = self._patch_pipeline()
+        with (
+            executor_patch,
+            search_patch,
+            llm_patch,
+            mock.patch.object(ai_chatbot, "_response_cache", cache),
+            mock.patch.object(cache, "lookup", record(cache.lookup)),
+            mock.patch.object(cache, "store", record(cache.store)),
+        ):
+            first = asyncio.run(ai_chatbot.generate_response_async("質問"))
+            second = asyncio.run(ai_chatbot.generate_response_async("質問"))
+
+        self.assertEqual(first, second)
+        self.assertEqual(cache.stats().hits, 1)
+        self.assertEqual(len(threads), 3)  # 照会2回・保存1回
+        self.assertNotIn(threading.main_thread(), threads)
+
+    def test_exception_is_propagated(self):
+        """LLM APIの失敗がRuntimeErrorとして呼び出し元に伝わることのテスト"""
+
+        async def failing_llm(query, similar_messages):
+            return None, "APIのリクエスト制限に達しました。"
+
+        executor_patch, search_patch, llm_patch = self._patch_pipeline(failing_llm)
+        with executor_patch, search_patch, llm_patch:
+            with self.assertRaises(RuntimeError):
+                asyncio.run(ai_chatbot.generate_response_async("質問"))
+
+    def test_missing_api_key(self):
+        """APIキー未設定の場合は検索前にValueErrorとなることのテスト"""
+        executor_patch, search_patch, llm_patch = self._patch_pipeline()
+        with executor_patch, search_patch, llm_patch:
+            with mock.patch.dict(os.environ, {"GEMINI_API_KEY": ""}):
+                with self.assertRaises(ValueError):
+                    asyncio.run(ai_chatbot.generate_response_async("質問"))
+        self.assertEqual(self.max_active, 0)
+
+    def test_get_max_concurrent_responses(self):
+        """環境変数から同時実行数を取得するテスト"""
+        with mock.patch.dict(os.environ, {"MAX_CONCURRENT_RESPONSES": "16"}):
+            self.assertEqual(ai_chatbot.get_max_concurrent_responses(), 16)
+        with mock.patch.dict(os.environ, {"MAX_CONCURRENT_RESPONSES": "x"}):
+            self.assertEqual(
+                ai_chatbot.get_max_concurrent_responses(),
+                ai_chatbot.DEFAULT_MAX_CONCURRENT_RESPONSES,
+            )
+
+    def test_executor_leaves_room_for_micro_batches(self):
+        """スレッドプールがマイクロバッチの最大件数分のスレッドを確保することのテスト"""
+        env = {"MAX_CONCURRENT_RESPONSES": "8", "QUERY_BATCH_SIZE": "32"}
+        for batch_size, expected in (("32", 40), ("1", 8)):
+            env["QUERY_BATCH_SIZE"] = batch_size
+            with (
+                mock.patch.dict(os.environ, env),
+                mock.patch.object(ai_chatbot, "_response_executor", None),
+            ):
+                executor = ai_chatbot._get_response_executor()
+                self.assertEqual(executor._max_workers, expected)
+                executor.shutdown()
+
+    def test_search_is_limited_while_encoding_is_not(self):
+        """埋め込みの完了待ちは制限せず、検索の同時実行数のみ上限までとなることのテスト"""
+        encoding = _ConcurrencyCounter()
+        searching = _ConcurrencyCounter()
+
+        def encode(query):
+            with encoding:
+                time.sleep(0.05)
+            return np.ones(2, dtype=np.float32)
+
+        def search(query, query_emb, top_k, filters=None):
+            with searching:
+                time.sleep(0.05)
+            return [SearchResult(1, 0.9, f"過去メッセージ: {query}")]
+
+        async def run():
+            return await asyncio.gather(
+                *(ai_chatbot.generate_response_async(f"質問{i}") for i in range(8))
+            )
+
+        executor = ThreadPoolExecutor(max_workers=8)
+        with (
+            mock.patch.object(ai_chatbot, "_response_executor", executor),
+            mock.patch.object(
+                ai_chatbot, "_search_slots", threading.BoundedSemaphore(2)
+            ),
+            mock.patch.object(ai_chatbot, "_initialized", True),
+            mock.patch.object(ai_chatbot, "encode_query", encode),
+            mock.patch.object(ai_chatbot, "_search_index", search),
+            mock.patch.object(
+                ai_chatbot, "generate_response_with_llm_async", self._llm_stub
+            ),
+        ):
+            results = asyncio.run(run())
+        executor.shutdown()
+
+        self.assertEqual(len(results), 8)
+        self.assertEqual(encoding.max_active, 8)
+        self.assertEqual(searching.max_active, 2)
+
+
+class _ConcurrencyCounter:
+    """withブロック内の同時実行数を記録するカウンタ"""
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.active -= 1
+
+
+class TestGenerateResponseWithLLMAsync(unittest.TestCase):
+    """generate_response_with_llm_asyncのテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.model = mock.MagicMock()
+        self.genai = mock.MagicMock()
+        self.patches = [
+            mock.patch.dict(os.environ, {"GEMINI_API_KEY": "test_key"}),
+            mock.patch.object(ai_chatbot, "_gemini_module", self.genai),
+            mock.patch.object(ai_chatbot, "_gemini_model", self.model),
+            mock.patch.object(ai_chatbot, "_safety_settings", []),
+            mock.patch.object(ai_chatbot, "_build_prompt", lambda q, m: q),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        """各テスト後のクリーンアップ"""
+        for patch in reversed(self.patches):
+            patch.stop()
+
+    def test_retry_uses_async_backoff(self):
+        """レート制限時にasyncio.sleepで待機してリトライすることのテスト"""
+        response = mock.MagicMock()
+        response.text = " テスト応答 "
+        self.model.generate_content_async = mock.AsyncMock(
+            side_effect=[Exception("429 rate limit"), response]
+        )
+        waits = []
+
+        async def fake_wait(seconds):
+            waits.append(seconds)
+
+        with mock.patch("llm_error_handler.wait_for_retry_async", fake_wait):
+            result, error = asyncio.run(
+                ai_chatbot.generate_response_with_llm_async("質問", ["文脈"])
+            )
+
+        self.assertEqual((result, error), ("テスト応答", None))
+        self.assertEqual(waits, [1.0])
+        self.assertEqual(self.model.generate_content_async.await_count, 2)
+        self.model.generate_content.assert_not_called()
+
+    def test_cancelled_by_timeout(self):
+        """呼び出し元のタイムアウトでAPI呼び出しがキャンセルされることのテスト"""
+        cancelled = []
+
+        async def hang(*args, **kwargs):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        self.model.generate_content_async = hang
+
+        async def run():
+            await asyncio.wait_for(
+                ai_chatbot.generate_response_with_llm_async("質問", ["文脈"]),
+                timeout=0.05,
+            )
+
+        start = time.perf_counter()
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(run())
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual(cancelled, [True])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+"""
+マイクロバッチ埋め込み（MicroBatchEncoder）のテスト
+"""
+
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from batch_encoder import MicroBatchEncoder
+
+
+class _RecordingModel:
+    """呼び出しごとのバッチサイズを記録する埋め込みモデルのスタブ"""
+
+    def __init__(self):
+        self.batch_sizes = []
+        self.lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self.lock:
+            self.batch_sizes.append(len(texts))
+        return np.array([[len(text), ord(text[-1])] for text in texts], np.float32)
+
+
+class TestMicroBatchEncoder(unittest.TestCase):
+    """MicroBatchEncoderクラスのテスト"""
+
+    def test_concurrent_queries_are_batched(self):
+        """同時に届いたクエリがまとめて埋め込まれ、各呼び出し元に返ることのテスト"""
+        model = _RecordingModel()
+        encoder = MicroBatchEncoder(model, max_batch_size=8, max_wait_ms=50)
+        texts = [f"質問{i}" for i in range(20)]
+        try:
+            with ThreadPoolExecutor(max_workers=20) as executor:
+                results = list(executor.map(encoder.encode, texts))
+        finally:
+            encoder.close()
+
+        for text, embedding in zip(texts, results):
+            np.testing.assert_array_equal(embedding, [len(text), ord(text[-1])])
+        self.assertEqual(sum(model.batch_sizes), 20)
+        self.assertLessEqual(max(model.batch_sizes), 8)
+        self.assertLess(len(model.batch_sizes), 20)
+        self.assertEqual(encoder.encoded, 20)
+        self.assertGreater(encoder.average_batch_size, 1.0)
+
+    def test_single_query_is_not_delayed_beyond_wait(self):
+        """クエリが1件だけでも待機時間の経過後に処理されることのテスト"""
+        model = _RecordingModel()
+        encoder = MicroBatchEncoder(model, max_batch_size=32, max_wait_ms=1)
+        try:
+            embedding = encoder.submit("ルールは？").result(timeout=5)
+        finally:
+            encoder.close()
+        np.testing.assert_array_equal(embedding, [5, ord("？")])
+        self.assertEqual(model.batch_sizes, [1])
+
+    def test_exception_is_propagated(self):
+        """encodeの例外がバッチ内の全ての呼び出し元に伝わることのテスト"""
+
+        def failing(texts):
+            raise RuntimeError("モデルエラー")
+
+        encoder = MicroBatchEncoder(failing, max_wait_ms=10)
+        try:
+            futures = [encoder.submit(f"質問{i}") for i in range(3)]
+            for future in futures:
+                with self.assertRaises(RuntimeError):
+                    future.result(timeout=5)
+            # エラー後も新しいクエリを受け付ける
+            with self.assertRaises(RuntimeError):
+                encoder.encode("再試行")
+        finally:
+            encoder.close()
+
+    def test_close_rejects_new_queries(self):
+        """終了後のクエリがRuntimeErrorとなることのテスト"""
+        encoder = MicroBatchEncoder(_RecordingModel())
+        encoder.close()
+        with self.assertRaises(RuntimeError):
+            encoder.encode("質問")
+
+
+if __name__ == "__main__":
+    unittest.main()
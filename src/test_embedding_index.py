@@ -0,0 +1,670 @@
+"""
+埋め込み検索インデックスのテスト
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import ai_chatbot
+from ann_index import IVFIndex
+from embedding_index import (
+    EmbeddingIndex,
+    IndexMetadata,
+    SearchFilter,
+    normalize_rows,
+    reciprocal_rank_fusion,
+    top_k_indices,
+)
+from embedding_snapshot import (
+    is_prefix_of,
+    is_up_to_date,
+    load_snapshot,
+    read_manifest,
+    write_snapshot,
+)
+from knowledge_db import KnowledgeDB
+
+
+def _insert_knowledge(db, message_ids, vectors):
+    """テスト用のメッセージと埋め込みをデータベースに挿入"""
+    db.insert_messages_batch(
+        [
+            {
+                "id": i,
+                "channel_id": 111,
+                "channel_name": "general",
+                "author_id": 222,
+                "author_name": "TestUser",
+                "content": f"メッセージ{i}です",
+                "created_at": "2024-01-01T00:00:00",
+                "timestamp": 1704067200.0 + i,
+                "category": "faq" if i % 2 == 0 else None,
+                "importance": i,
+            }
+            for i in message_ids
+        ]
+    )
+    db.insert_embeddings_batch(list(message_ids), vectors)
+
+
+class TestEmbeddingIndex(unittest.TestCase):
+    """EmbeddingIndexクラスのテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.message_ids = [10, 20, 30, 40]
+        self.texts = ["東", "北", "西", "北東"]
+        self.embeddings = np.array(
+            [[1.0, 0.0], [0.0, 2.0], [-3.0, 0.0], [1.0, 1.0]], dtype=np.float32
+        )
+        self.index = EmbeddingIndex(self.message_ids, self.texts, self.embeddings)
+
+    def test_vectors_are_normalized(self):
+        """ロード時に行列が正規化されることのテスト"""
+        norms = np.linalg.norm(self.index.vectors, axis=1)
+        np.testing.assert_allclose(norms, np.ones(4), rtol=1e-6)
+        self.assertEqual(self.index.vectors.dtype, np.float32)
+        self.assertTrue(self.index.vectors.flags["C_CONTIGUOUS"])
+        self.assertEqual(self.index.dim, 2)
+
+    def test_score_matches_cosine_similarity(self):
+        """スコアがコサイン類似度と一致することのテスト"""
+        query = np.array([2.0, 2.0])
+        scores = self.index.score(query)
+        expected = (self.embeddings @ query) / (
+            np.linalg.norm(self.embeddings, axis=1) * np.linalg.norm(query)
+        )
+        np.testing.assert_allclose(scores, expected, rtol=1e-6)
+
+    def test_search_order(self):
+        """類似度の高い順に返されることのテスト"""
+        results = self.index.search(np.array([1.0, 0.1]), top_k=3)
+        self.assertEqual([r.text for r in results], ["東", "北東", "北"])
+        self.assertEqual([r.message_id for r in results], [10, 40, 20])
+        self.assertGreater(results[0].score, results[1].score)
+        self.assertAlmostEqual(results[0].score, 1.0 / np.sqrt(1.01), places=5)
+
+    def test_search_top_k_larger_than_index(self):
+        """top_kが件数を超える場合に全件を返すことのテスト"""
+        results = self.index.search(np.array([0.0, 1.0]), top_k=10)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[-1].text, "西")
+
+    def test_search_batch_matches_search(self):
+        """一括検索の結果がクエリごとの検索と一致することのテスト"""
+        rng = np.random.default_rng(1)
+        corpus = rng.standard_normal((500, 16)).astype(np.float32)
+        index = EmbeddingIndex(np.arange(500), [str(i) for i in range(500)], corpus)
+        queries = rng.standard_normal((37, 16)).astype(np.float32)
+
+        # 小さなブロックサイズでブロック間の統合を検証
+        batch = index.search_batch(
+            queries, top_k=5, query_chunk_size=8, corpus_chunk_size=64
+        )
+        self.assertEqual(len(batch), 37)
+        for query, results in zip(queries, batch):
+            expected = index.search(query, top_k=5)
+            self.assertEqual(
+                [r.message_id for r in results], [r.message_id for r in expected]
+            )
+            self.assertEqual([r.text for r in results], [r.text for r in expected])
+            np.testing.assert_allclose(
+                [r.score for r in results], [r.score for r in expected], rtol=1e-5
+            )
+
+    def test_search_batch_edge_cases(self):
+        """一括検索の空入力・top_kが件数を超える場合のテスト"""
+        self.assertEqual(self.index.search_batch(np.empty((0, 2))), [])
+        results = self.index.search_batch(np.array([[0.0, 1.0]]), top_k=10)
+        self.assertEqual(len(results[0]), 4)
+        self.assertEqual(results[0][-1].text, "西")
+        empty = EmbeddingIndex([], [], np.empty((0, 2), dtype=np.float32))
+        self.assertEqual(empty.search_batch(np.ones((2, 2))), [[], []])
+
+    def test_search_with_filters(self):
+        """絞り込み条件に一致する行だけが検索されることのテスト"""
+        self.index.metadata = IndexMetadata.from_columns(
+            channel_ids=[1, 1, 2, 2],
+            author_ids=[7, 8, 7, 8],
+            importance=[0, 3, 5, 1],
+            timestamps=[100.0, 200.0, 300.0, 400.0],
+            categories=["faq", None, "faq", "rule"],
+        )
+        query = np.array([1.0, 0.1])
+
+        def ids(filters):
+            return [r.message_id for r in self.index.search(query, 4, filters=filters)]
+
+        self.assertEqual(ids(SearchFilter(channel_ids=[2])), [40, 30])
+        self.assertEqual(ids(SearchFilter(channel_ids=2, author_ids=[7])), [30])
+        self.assertEqual(ids(SearchFilter(category="faq")), [10, 30])
+        self.assertEqual(ids(SearchFilter(category="未登録")), [])
+        self.assertEqual(ids(SearchFilter(min_importance=3)), [20, 30])
+        self.assertEqual(ids(SearchFilter(since=200.0, until=400.0)), [20, 30])
+        self.assertEqual(ids(SearchFilter()), [10, 40, 20, 30])
+
+        batch = self.index.search_batch(
+            np.array([query, [0.0, 1.0]]), 4, filters=SearchFilter(channel_ids=[2])
+        )
+        self.assertEqual([[r.message_id for r in rs] for rs in batch], [[40, 30]] * 2)
+        self.assertEqual(
+            self.index.search_batch(query, 4, filters=SearchFilter(category="x")),
+            [[]],
+        )
+
+    def test_filter_without_metadata(self):
+        """メタデータが無いインデックスで絞り込むとValueErrorとなることのテスト"""
+        with self.assertRaises(ValueError):
+            self.index.search(np.array([1.0, 0.0]), filters=SearchFilter(category="a"))
+        # 条件が空であれば通常の検索を行う
+        self.assertEqual(len(self.index.search(np.array([1.0, 0.0]), 2)), 2)
+
+    def test_metadata_length_mismatch(self):
+        """メタデータの件数が一致しない場合にValueErrorとなることのテスト"""
+        metadata = IndexMetadata.from_columns([1], [1], [0], [0.0], [None])
+        with self.assertRaises(ValueError):
+            EmbeddingIndex(
+                self.message_ids, self.texts, self.embeddings, metadata=metadata
+            )
+
+    def test_reciprocal_rank_fusion(self):
+        """両方の順位リストで上位のキーが先頭になることのテスト"""
+        fused = reciprocal_rank_fusion([[1, 2, 3], [3, 4, 1]])
+        self.assertEqual(fused[0], 1)
+        self.assertEqual(fused[1], 3)
+        self.assertEqual(sorted(fused), [1, 2, 3, 4])
+
+    def test_search_hybrid(self):
+        """全文検索のみで見つかったメッセージも融合結果に入ることのテスト"""
+        query = np.array([1.0, 0.1])
+        # ベクトル検索では最下位の「西」が全文検索で1位
+        results = self.index.search_hybrid(query, [30], top_k=2, candidates=2)
+        self.assertEqual([r.message_id for r in results], [10, 30])
+        self.assertAlmostEqual(results[1].score, -1.0 / np.sqrt(1.01), places=5)
+
+        # 全文検索の結果が無い・インデックスに無いIDのみの場合はベクトル検索の結果
+        expected = [r.message_id for r in self.index.search(query, top_k=3)]
+        for lexical_ids in ([], [999]):
+            results = self.index.search_hybrid(query, lexical_ids, top_k=3)
+            self.assertEqual([r.message_id for r in results], expected)
+
+        # 絞り込み条件は全文検索の結果にも適用される
+        self.index.metadata = IndexMetadata.from_columns(
+            [1, 1, 2, 2], [0] * 4, [0] * 4, [0.0] * 4, [None] * 4
+        )
+        results = self.index.search_hybrid(
+            query, [30, 10], top_k=4, filters=SearchFilter(channel_ids=[1])
+        )
+        self.assertEqual(sorted(r.message_id for r in results), [10, 20])
+
+    def test_positions_of(self):
+        """メッセージIDが行番号に変換されることのテスト"""
+        positions = self.index.positions_of([40, 10, 99])
+        self.assertEqual(positions.tolist(), [3, 0, -1])
+
+    def test_top_k_indices_matches_full_sort(self):
+        """部分選択の結果が全件ソートと一致することのテスト"""
+        rng = np.random.default_rng(0)
+        scores = rng.standard_normal(1000).astype(np.float32)
+        for k in (1, 5, 999, 1000):
+            expected = np.argsort(-scores)[:k]
+            np.testing.assert_array_equal(top_k_indices(scores, k), expected)
+        self.assertEqual(len(top_k_indices(scores, 0)), 0)
+
+    def test_empty_index(self):
+        """空のインデックスで検索しても例外にならないことのテスト"""
+        index = EmbeddingIndex([], [], np.empty((0, 2), dtype=np.float32))
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.search(np.array([1.0, 0.0])), [])
+
+    def test_length_mismatch(self):
+        """件数が一致しない場合にValueErrorとなることのテスト"""
+        with self.assertRaises(ValueError):
+            EmbeddingIndex([1], ["a", "b"], np.ones((2, 2)))
+
+    def test_normalize_zero_vector(self):
+        """ゼロベクトルの正規化でNaNが発生しないことのテスト"""
+        result = normalize_rows(np.zeros((1, 3)))
+        self.assertFalse(np.isnan(result).any())
+
+
+class TestIVFIndex(unittest.TestCase):
+    """IVFIndexクラス（近似最近傍インデックス）のテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        rng = np.random.default_rng(0)
+        self.vectors = normalize_rows(rng.standard_normal((500, 16)))
+        self.message_ids = np.arange(1000, 1500)
+        self.index = EmbeddingIndex(
+            self.message_ids, [str(i) for i in self.message_ids], self.vectors
+        )
+        self.queries = normalize_rows(rng.standard_normal((20, 16)))
+
+    def test_full_probe_matches_exact(self):
+        """全クラスタを走査した場合に厳密検索と一致することのテスト"""
+        ann = IVFIndex.train(self.index.vectors, self.message_ids, nlist=8)
+        ann.nprobe = ann.nlist
+        self.index.attach_ann(ann)
+        for query in self.queries:
+            approx = self.index.search(query, top_k=5)
+            exact = self.index.search(query, top_k=5, exact=True)
+            self.assertEqual(
+                [r.message_id for r in approx], [r.message_id for r in exact]
+            )
+
+    def test_partial_probe_returns_results(self):
+        """一部のクラスタのみ走査しても結果が返ることのテスト"""
+        ann = IVFIndex.train(self.index.vectors, self.message_ids, nlist=8, nprobe=2)
+        self.index.attach_ann(ann)
+        results = self.index.search(self.queries[0], top_k=3)
+        self.assertEqual(len(results), 3)
+        scores = [r.score for r in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_save_load_and_incremental_add(self):
+        """保存・読み込みと増分追加のテスト"""
+        ann = IVFIndex.train(self.vectors[:400], self.message_ids[:400], nlist=4)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "knowledge.ivf.npz")
+            ann.save(path)
+            loaded = IVFIndex.load(path, nprobe=4)
+
+        np.testing.assert_array_equal(loaded.centroids, ann.centroids)
+        self.assertEqual(len(loaded), 400)
+        self.assertEqual(loaded.nprobe, 4)
+
+        # 追加済みのIDはスキップされる
+        added = loaded.add(self.vectors[350:], self.message_ids[350:])
+        self.assertEqual(added, 100)
+        self.assertEqual(len(loaded), 500)
+
+        # インデックスへの接続時に未登録の行が自動的に追加される
+        fresh = IVFIndex.train(self.vectors[:400], self.message_ids[:400], nlist=4)
+        self.assertEqual(self.index.attach_ann(fresh), 100)
+        self.assertEqual(len(fresh), 500)
+
+    def test_incremental_add_in_chunks(self):
+        """チャンクごとの増分追加で重複がスキップされ、配列の確保がまとめて行われることのテスト"""
+        ann = IVFIndex.train(self.vectors[:100], self.message_ids[:100], nlist=4)
+        before = ann.message_ids
+        for start in range(50, 500, 50):
+            # 前のチャンクと半分重複する範囲を追加
+            ann.add(
+                self.vectors[start : start + 100], self.message_ids[start : start + 100]
+            )
+
+        np.testing.assert_array_equal(ann.message_ids, self.message_ids)
+        np.testing.assert_array_equal(ann.assignments, ann.assign(self.vectors))
+        # 以前に取得した配列は追加の影響を受けない
+        np.testing.assert_array_equal(before, self.message_ids[:100])
+        # 容量に余裕がある間は同じ配列に書き込む
+        self.assertGreaterEqual(len(ann._message_ids), 1024)
+        self.assertEqual(ann.add(self.vectors[:10], self.message_ids[:10]), 0)
+
+    def test_train_from_pages(self):
+        """ページ単位の学習で全件が割り当てられ、サンプル数が上限内であることのテスト"""
+
+        def pages():
+            for start in range(0, 500, 64):
+                yield self.vectors[start : start + 64], self.message_ids[
+                    start : start + 64
+                ]
+
+        ann = IVFIndex.train_from_pages(pages, nlist=8, sample_size=100)
+        self.assertEqual(ann.nlist, 8)
+        np.testing.assert_array_equal(ann.message_ids, self.message_ids)
+        np.testing.assert_array_equal(ann.assignments, ann.assign(self.vectors))
+
+        ann.nprobe = ann.nlist
+        self.index.attach_ann(ann)
+        exact = self.index.search(self.queries[0], top_k=5, exact=True)
+        self.assertEqual(
+            [r.message_id for r in self.index.search(self.queries[0], top_k=5)],
+            [r.message_id for r in exact],
+        )
+
+        with self.assertRaises(ValueError):
+            IVFIndex.train_from_pages(lambda: iter(()))
+
+
+class TestEmbeddingSnapshot(unittest.TestCase):
+    """埋め込みスナップショットのテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.snapshot_dir = os.path.join(self.temp_dir.name, "knowledge_snapshot")
+        self.db = KnowledgeDB(os.path.join(self.temp_dir.name, "knowledge.db"))
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((5, 8)).astype(np.float32)
+        _insert_knowledge(self.db, range(5), self.vectors)
+
+    def tearDown(self):
+        """各テスト後のクリーンアップ"""
+        self.db.close()
+        self.temp_dir.cleanup()
+
+    def test_roundtrip_matches_db_index(self):
+        """スナップショットの検索結果がDBからの読み込みと一致することのテスト"""
+        self.assertIsNone(load_snapshot(self.snapshot_dir))
+        write_snapshot(self.db, self.snapshot_dir)
+
+        manifest = read_manifest(self.snapshot_dir)
+        self.assertEqual(manifest["count"], 5)
+        self.assertEqual(manifest["embedding_count"], 5)
+
+        snapshot_index = load_snapshot(self.snapshot_dir)
+        # mmapされた読み取り専用の配列をコピーせずに使用していること
+        self.assertFalse(snapshot_index.vectors.flags["WRITEABLE"])
+        self.assertFalse(snapshot_index.vectors.flags["OWNDATA"])
+        self.assertEqual(snapshot_index.texts[3], "メッセージ3です")
+        self.assertEqual(snapshot_index.texts[-1], "メッセージ4です")
+
+        db_index = EmbeddingIndex.from_db(self.db)
+        query = self.vectors[2]
+        self.assertEqual(
+            [r.message_id for r in snapshot_index.search(query, top_k=3)],
+            [r.message_id for r in db_index.search(query, top_k=3)],
+        )
+
+        # メタデータ列も同じ内容で読み込まれる
+        filters = SearchFilter(category="faq", min_importance=1)
+        self.assertEqual(
+            [r.message_id for r in snapshot_index.search(query, 5, filters=filters)],
+            [r.message_id for r in db_index.search(query, 5, filters=filters)],
+        )
+        self.assertEqual(
+            sorted(r.message_id for r in db_index.search(query, 5, filters=filters)),
+            [2, 4],
+        )
+
+    def test_snapshot_is_written_page_by_page(self):
+        """複数ページに分けて書き出しても全件を読み込む場合と一致することのテスト"""
+        _insert_knowledge(self.db, range(5, 12), np.ones((7, 8), dtype=np.float32))
+        with mock.patch("embedding_snapshot._WRITE_CHUNK_SIZE", 3):
+            write_snapshot(self.db, self.snapshot_dir)
+
+        snapshot_index = load_snapshot(self.snapshot_dir)
+        db_index = EmbeddingIndex.from_db(self.db)
+        np.testing.assert_array_equal(snapshot_index.message_ids, db_index.message_ids)
+        np.testing.assert_allclose(snapshot_index.vectors, db_index.vectors)
+        self.assertEqual(
+            [snapshot_index.texts[i] for i in range(12)], list(db_index.texts)
+        )
+        for name in IndexMetadata._fields:
+            np.testing.assert_array_equal(
+                getattr(snapshot_index.metadata, name), getattr(db_index.metadata, name)
+            )
+        self.assertEqual(read_manifest(self.snapshot_dir)["max_seq"], 12)
+
+    def test_old_format_is_not_up_to_date(self):
+        """フォーマットの異なるスナップショットは再生成の対象となることのテスト"""
+        write_snapshot(self.db, self.snapshot_dir)
+        manifest = read_manifest(self.snapshot_dir)
+        self.assertTrue(is_up_to_date(manifest, 5))
+        self.assertFalse(is_up_to_date(manifest, 6))
+        self.assertFalse(is_up_to_date(dict(manifest, format_version=1), 5))
+        self.assertFalse(is_up_to_date(None, 5))
+
+    def test_stale_snapshot_is_extended_with_delta(self):
+        """スナップショット作成後に追加された埋め込みが差分として読み込まれることのテスト"""
+        write_snapshot(self.db, self.snapshot_dir)
+        rng = np.random.default_rng(1)
+        _insert_knowledge(self.db, [5, 6], rng.standard_normal((2, 8)))
+
+        manifest = read_manifest(self.snapshot_dir)
+        self.assertTrue(is_prefix_of(manifest, self.db))
+        snapshot_index = load_snapshot(self.snapshot_dir)
+        index = snapshot_index.extend_from_db(self.db)
+        # スナップショットはコピーせずに基本セグメントとして共有される
+        self.assertIs(index.base, snapshot_index)
+        self.assertEqual(index.delta.message_ids.tolist(), [5, 6])
+        self.assertEqual(len(index), 7)
+        self.assertEqual(index.texts[6], "メッセージ6です")
+        self.assertEqual(index.max_seq, self.db.get_max_embedding_seq())
+
+        # データベースが別物になった場合は差分を追加できない
+        other = KnowledgeDB(os.path.join(self.temp_dir.name, "other.db"))
+        _insert_knowledge(other, [100], rng.standard_normal((1, 8)))
+        self.assertFalse(is_prefix_of(manifest, other))
+        other.close()
+
+    def test_validated_manifest_is_loaded(self):
+        """検証後に新しいスナップショットが公開されても検証済みの版を読み込むことのテスト"""
+        write_snapshot(self.db, self.snapshot_dir)
+        manifest = read_manifest(self.snapshot_dir)
+        self.assertTrue(is_prefix_of(manifest, self.db))
+
+        # 検証と読み込みの間に別のプロセスが新しいスナップショットを公開する
+        _insert_knowledge(self.db, [5, 6], np.ones((2, 8)))
+        with mock.patch("time.strftime", return_value="29991231235959"):
+            write_snapshot(self.db, self.snapshot_dir)
+        self.assertEqual(read_manifest(self.snapshot_dir)["count"], 7)
+
+        self.assertEqual(len(load_snapshot(self.snapshot_dir, manifest)), 5)
+        self.assertEqual(len(load_snapshot(self.snapshot_dir)), 7)
+
+
+class TestIndexHotReload(unittest.TestCase):
+    """インデックスの差分追加と差し替えのテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db = KnowledgeDB(os.path.join(self.temp_dir.name, "knowledge.db"))
+        self.rng = np.random.default_rng(0)
+        _insert_knowledge(self.db, range(10), self.rng.standard_normal((10, 8)))
+
+    def tearDown(self):
+        """各テスト後のクリーンアップ"""
+        self.db.close()
+        self.temp_dir.cleanup()
+
+    def test_extend_matches_full_reload(self):
+        """差分を追加したインデックスが全件の読み込みと同じ結果になることのテスト"""
+        index = EmbeddingIndex.from_db(self.db)
+        self.assertIs(index.extend_from_db(self.db), index)
+
+        _insert_knowledge(self.db, range(10, 15), self.rng.standard_normal((5, 8)))
+        extended = index.extend_from_db(self.db)
+        full = EmbeddingIndex.from_db(self.db)
+
+        # 元のインデックスは変更されず、基本セグメントとしてそのまま共有される
+        self.assertEqual(len(index), 10)
+        self.assertEqual(len(extended), 15)
+        self.assertIs(extended.base, index)
+        np.testing.assert_array_equal(extended.delta.vectors, full.vectors[10:])
+        self.assertEqual(extended.max_seq, full.max_seq)
+        self.assertEqual(list(extended.texts[i] for i in range(15)), full.texts)
+
+        query = self.rng.standard_normal(8)
+        queries = self.rng.standard_normal((3, 8))
+        filters = SearchFilter(category="faq")
+        for f in (None, filters):
+            self.assertEqual(
+                [r.message_id for r in extended.search(query, 5, filters=f)],
+                [r.message_id for r in full.search(query, 5, filters=f)],
+            )
+            self.assertEqual(
+                [
+                    [r.message_id for r in results]
+                    for results in extended.search_batch(queries, 4, filters=f)
+                ],
+                [
+                    [r.message_id for r in results]
+                    for results in full.search_batch(queries, 4, filters=f)
+                ],
+            )
+            # 全文検索の結果が両方のセグメントにまたがる場合も同じ順位になる
+            lexical_ids = [12, 3, 999, 14, 0]
+            self.assertEqual(
+                extended.search_hybrid(query, lexical_ids, 4, filters=f),
+                full.search_hybrid(query, lexical_ids, 4, filters=f),
+            )
+
+    def test_extend_reuses_buffer(self):
+        """差分セグメントへの2回目以降の追加では行列全体をコピーしないことのテスト"""
+        index = EmbeddingIndex.from_db(self.db)
+        first = index.extend([100], ["a"], self.rng.standard_normal((1, 8)))
+        second = first.extend([101], ["b"], self.rng.standard_normal((1, 8)))
+        self.assertIs(second.base, index)
+        self.assertTrue(np.shares_memory(first.delta.vectors, second.delta.vectors))
+        self.assertTrue(
+            np.shares_memory(first.delta.message_ids, second.delta.message_ids)
+        )
+        # テキストもリストを共有し、追加のたびにコピーしない
+        self.assertIs(first.delta.texts.texts, second.delta.texts.texts)
+        self.assertEqual(len(first.delta.texts), 1)
+        self.assertEqual(second.texts[-1], "b")
+
+        # 同じインデックスから別の追加を行っても、既存の後継は書き換えられない
+        before = second.delta.vectors.copy()
+        branch = first.extend([102], ["c"], self.rng.standard_normal((1, 8)))
+        np.testing.assert_array_equal(second.delta.vectors, before)
+        self.assertEqual(branch.delta.message_ids.tolist(), [100, 102])
+
+        with self.assertRaises(ValueError):
+            index.extend([103], ["d"], np.ones((1, 4)))
+        with self.assertRaises(ValueError):
+            first.extend([103], ["d"], np.ones((1, 4)))
+
+    def test_delta_metadata_keeps_category_codes(self):
+        """差分セグメントのメタデータ列を共有し、後から現れたカテゴリも絞り込めることのテスト"""
+
+        def metadata(categories):
+            count = len(categories)
+            return IndexMetadata.from_columns(
+                [1] * count, [2] * count, [0] * count, [0.0] * count, categories
+            )
+
+        index = EmbeddingIndex.from_db(self.db)
+        vectors = self.rng.standard_normal((3, 8))
+        first = index.extend(
+            [100, 101], ["a", "b"], vectors[:2], metadata=metadata(["news", None])
+        )
+        second = first.extend([102], ["c"], vectors[2:], metadata=metadata(["faq"]))
+        self.assertTrue(
+            np.shares_memory(
+                first.delta.metadata.category_codes,
+                second.delta.metadata.category_codes,
+            )
+        )
+
+        query = self.rng.standard_normal(8)
+        news = second.search(query, 20, filters=SearchFilter(category="news"))
+        self.assertEqual([r.message_id for r in news], [100])
+        faq = second.search(query, 20, filters=SearchFilter(category="faq"))
+        self.assertEqual(sorted(r.message_id for r in faq), [0, 2, 4, 6, 8, 102])
+
+    def test_delta_is_sealed_into_segments(self):
+        """差分セグメントが上限に達すると確定し、全件の読み込みと同じ結果になることのテスト"""
+        index = EmbeddingIndex.from_db(self.db)
+        ann = IVFIndex.train(index.vectors, index.message_ids, nlist=3)
+        ann.nprobe = ann.nlist
+        index.attach_ann(ann)
+
+        extended = index
+        with mock.patch("embedding_index.DELTA_SEGMENT_MAX_ROWS", 4):
+            for start in range(10, 46, 3):
+                vectors = self.rng.standard_normal((3, 8))
+                _insert_knowledge(self.db, range(start, start + 3), vectors)
+                extended = extended.extend_from_db(self.db)
+        full = EmbeddingIndex.from_db(self.db)
+
+        # 6件ずつ確定したセグメントは件数が倍になるごとにまとめられる
+        self.assertIs(extended.base, index)
+        self.assertEqual([len(s) for s in extended.sealed], [24, 12])
+        self.assertEqual(len(extended.delta), 0)
+        self.assertEqual(len(extended), 46)
+        self.assertEqual(extended.max_seq, full.max_seq)
+        self.assertEqual([extended.texts[i] for i in range(46)], full.texts)
+        # ANNインデックス自体には登録しない（基本セグメント分のまま）
+        self.assertEqual(len(ann), 10)
+
+        query = self.rng.standard_normal(8)
+        for f in (None, SearchFilter(category="faq")):
+            self.assertEqual(
+                [r.message_id for r in extended.search(query, 8, filters=f)],
+                [r.message_id for r in full.search(query, 8, filters=f)],
+            )
+            lexical_ids = [40, 3, 999, 17]
+            self.assertEqual(
+                [
+                    r.message_id
+                    for r in extended.search_hybrid(query, lexical_ids, 4, filters=f)
+                ],
+                [
+                    r.message_id
+                    for r in full.search_hybrid(query, lexical_ids, 4, filters=f)
+                ],
+            )
+
+    def test_positions_of_sorts_once_per_index(self):
+        """メッセージIDの並べ替えはインデックスごとに1回のみ行うことのテスト"""
+        index = EmbeddingIndex.from_db(self.db)
+        with mock.patch("numpy.argsort", wraps=np.argsort) as argsort:
+            self.assertEqual(index.positions_of([3, 99, 0]).tolist(), [3, -1, 0])
+            self.assertEqual(index.positions_of([9]).tolist(), [9])
+        self.assertEqual(argsort.call_count, 1)
+
+        # 追加後のインデックスは追加分を含めて検索できる
+        extended = index.extend([50], ["a"], self.rng.standard_normal((1, 8)))
+        self.assertEqual(extended.delta.positions_of([50, 3]).tolist(), [0, -1])
+        self.assertIs(index._sorter, extended.base._sorter)
+
+    def test_extend_assigns_only_new_rows_to_ann(self):
+        """差分の追加ではANNインデックスに追加分だけを割り当てることのテスト"""
+        index = EmbeddingIndex.from_db(self.db)
+        ann = IVFIndex.train(index.vectors, index.message_ids, nlist=3)
+        index.attach_ann(ann)
+
+        vectors = self.rng.standard_normal((4, 8))
+        with mock.patch.object(ann, "assign", wraps=ann.assign) as assign:
+            extended = index.extend([20, 21], ["a", "b"], vectors[:2])
+            extended = extended.extend([22, 23], ["c", "d"], vectors[2:])
+        self.assertEqual([len(c.args[0]) for c in assign.call_args_list], [2, 2])
+        # ANNインデックス自体には登録しない（基本セグメント分のまま）
+        self.assertEqual(len(ann), 10)
+        self.assertIs(extended.ann, ann)
+
+        ann.nprobe = ann.nlist
+        for query in self.rng.standard_normal((5, 8)):
+            self.assertEqual(
+                [r.message_id for r in extended.search(query, 6)],
+                [r.message_id for r in extended.search(query, 6, exact=True)],
+            )
+
+    def test_metadata_concat_remaps_categories(self):
+        """連結時にカテゴリ番号が統合後の番号に振り直されることのテスト"""
+        first = IndexMetadata.from_columns([1, 2], [0, 0], [0, 0], [0, 0], ["b", None])
+        second = IndexMetadata.from_columns([3, 4], [0, 0], [0, 0], [0, 0], ["a", "b"])
+        merged = IndexMetadata.concat(first, second)
+        names = [
+            merged.category_names[c] if c >= 0 else None for c in merged.category_codes
+        ]
+        self.assertEqual(names, ["b", None, "a", "b"])
+
+    def test_refresh_index_swaps_global_index(self):
+        """refresh_indexが差分を追加したインデックスに差し替えることのテスト"""
+        index = EmbeddingIndex.from_db(self.db)
+        with (
+            mock.patch.object(ai_chatbot, "_initialized", True),
+            mock.patch.object(ai_chatbot, "_index", index),
+            mock.patch.object(ai_chatbot, "_db", self.db),
+        ):
+            self.assertEqual(ai_chatbot.refresh_index(), 0)
+            self.assertIs(ai_chatbot._index, index)
+
+            _insert_knowledge(self.db, [10, 11], self.rng.standard_normal((2, 8)))
+            self.assertEqual(ai_chatbot.refresh_index(), 2)
+            self.assertEqual(len(ai_chatbot._index), 12)
+            self.assertEqual(len(index), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+埋め込み生成ワーカープールのテスト
+"""
+
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from embedding_workers import EmbeddingWorkerPool, get_worker_count
+
+
+class _FakeModel:
+    """テキストの長さとプロセスIDを返す埋め込みモデルのスタブ"""
+
+    def encode(self, texts, show_progress_bar=True):
+        return np.array([[len(text), os.getpid()] for text in texts], dtype=np.float32)
+
+
+def _load_fake_model(model_name, num_threads):
+    """ワーカープロセスで呼ばれるモデルのロード関数"""
+    return _FakeModel()
+
+
+class TestEmbeddingWorkerPool(unittest.TestCase):
+    """EmbeddingWorkerPoolクラスのテスト"""
+
+    def test_results_in_submission_order(self):
+        """複数のワーカーで処理しても投入順に結果が返ることのテスト"""
+        chunks = [
+            ([i * 10 + j for j in range(3)], ["x" * (i + j) for j in range(3)])
+            for i in range(12)
+        ]
+        with EmbeddingWorkerPool(2, load_model=_load_fake_model) as pool:
+            results = list(pool.imap(iter(chunks)))
+
+        self.assertEqual([key for key, _ in results], [key for key, _ in chunks])
+        for (_, texts), (_, embeddings) in zip(chunks, results):
+            self.assertEqual(embeddings.dtype, np.float32)
+            self.assertEqual(embeddings[:, 0].tolist(), [len(t) for t in texts])
+
+        # 埋め込みはメインプロセス以外で生成される
+        worker_pids = {int(pid) for _, e in results for pid in e[:, 1]}
+        self.assertNotIn(os.getpid(), worker_pids)
+
+    def test_get_worker_count(self):
+        """環境変数からワーカー数を取得するテスト"""
+        with mock.patch.dict(os.environ, {"EMBEDDING_WORKERS": "4"}):
+            self.assertEqual(get_worker_count(), 4)
+        with mock.patch.dict(os.environ, {"EMBEDDING_WORKERS": "abc"}):
+            self.assertEqual(get_worker_count(), 1)
+        with mock.patch.dict(os.environ, {"EMBEDDING_WORKERS": "auto"}):
+            self.assertGreaterEqual(get_worker_count(), 1)
+        with mock.patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(get_worker_count(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
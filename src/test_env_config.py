@@ -0,0 +1,46 @@
+"""
+環境変数の読み取り（env_number）のテスト
+"""
+
+import io
+import os
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from env_config import env_number
+
+
+class TestEnvNumber(unittest.TestCase):
+    """env_number関数のテスト"""
+
+    def test_parses_value(self):
+        """設定された値を指定した型で取得するテスト"""
+        with mock.patch.dict(os.environ, {"X": " 16 ", "Y": "0.5"}):
+            self.assertEqual(env_number("X", 4), 16)
+            self.assertEqual(env_number("Y", 1.0, cast=float), 0.5)
+
+    def test_unset_uses_default_silently(self):
+        """未設定・空文字の場合は警告なしでデフォルト値となることのテスト"""
+        output = io.StringIO()
+        with mock.patch.dict(os.environ, {"X": ""}), redirect_stdout(output):
+            self.assertEqual(env_number("X", 4), 4)
+            self.assertEqual(env_number("UNSET_ENV_NUMBER", 4), 4)
+        self.assertEqual(output.getvalue(), "")
+
+    def test_invalid_value_warns(self):
+        """不正な値の場合は警告してデフォルト値となることのテスト"""
+        output = io.StringIO()
+        with mock.patch.dict(os.environ, {"X": "abc"}), redirect_stdout(output):
+            self.assertEqual(env_number("X", 4), 4)
+        self.assertIn("Xが不正です: abc", output.getvalue())
+
+    def test_minimum(self):
+        """最小値より小さい値が最小値に切り上げられることのテスト"""
+        with mock.patch.dict(os.environ, {"X": "0"}):
+            self.assertEqual(env_number("X", 4, minimum=1), 1)
+            self.assertEqual(env_number("X", 4), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
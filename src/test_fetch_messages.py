@@ -0,0 +1,229 @@
+"""
+メッセージ取得（fetch_messages）のテスト
+"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import discord
+
+from fetch_messages import fetch_messages_from_guild
+from knowledge_db import KnowledgeDB
+
+
+class _FakeChannel:
+    """履歴の取得中に同時に取得しているチャンネル数を記録するチャンネルの代替"""
+
+    def __init__(
+        self,
+        channel_id,
+        message_ids,
+        tracker,
+        name=None,
+        forbidden=False,
+        fail_at=None,
+        parent_id=None,
+        archived=(),
+    ):
+        self.id = channel_id
+        self.name = name or f"channel-{channel_id}"
+        self.message_ids = message_ids
+        self.last_message_id = max(message_ids, default=None)
+        self.tracker = tracker
+        self.forbidden = forbidden
+        self.fail_at = fail_at  # このメッセージIDの取得時に接続エラーを発生させる
+        self.parent_id = parent_id  # スレッドの場合は親チャンネルのID
+        self.archived = archived  # アーカイブ済みのスレッド
+        self.history_kwargs = None
+
+    async def archived_threads(self, limit=100):
+        if self.forbidden:
+            raise discord.Forbidden(
+                SimpleNamespace(status=403, reason="Forbidden"), "権限なし"
+            )
+        for thread in self.archived:
+            yield thread
+
+    def _message(self, message_id):
+        return SimpleNamespace(
+            id=message_id,
+            content=f"メッセージ {message_id}",
+            author=SimpleNamespace(id=1, bot=message_id % 10 == 9),
+            channel=self,
+            created_at=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        )
+
+    async def history(self, limit=None, after=None, oldest_first=None):
+        self.history_kwargs = {"after": after, "oldest_first": oldest_first}
+        self.tracker.active += 1
+        self.tracker.peak = max(self.tracker.peak, self.tracker.active)
+        try:
+            if self.forbidden:
+                raise discord.Forbidden(
+                    SimpleNamespace(status=403, reason="Forbidden"), "権限なし"
+                )
+            ids = sorted(self.message_ids, reverse=not oldest_first)
+            for message_id in ids:
+                if after is not None and message_id <= after.id:
+                    continue
+                if message_id == self.fail_at:
+                    raise ConnectionError("接続が切断されました")
+                await asyncio.sleep(0.001)
+                yield self._message(message_id)
+        finally:
+            self.tracker.active -= 1
+
+
+class _ConcurrencyTracker:
+    """同時に取得しているチャンネル数"""
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+
+
+def _client(channels, forums=(), active_threads=()):
+    """指定したチャンネル・フォーラム・スレッドを持つギルドを返すクライアントの代替"""
+
+    async def fetch_active_threads():
+        return list(active_threads)
+
+    guild = SimpleNamespace(
+        id=1,
+        text_channels=channels,
+        forums=list(forums),
+        active_threads=fetch_active_threads,
+    )
+    return SimpleNamespace(get_guild=lambda guild_id: guild)
+
+
+class TestFetchMessagesFromGuild(unittest.TestCase):
+    """fetch_messages_from_guildのテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.db = KnowledgeDB(os.path.join(self.test_dir, "test.db"))
+        self.tracker = _ConcurrencyTracker()
+
+    def tearDown(self):
+        """各テスト後のクリーンアップ"""
+        self.db.close()
+        shutil.rmtree(self.test_dir)
+
+    def _fetch(self, channels, forums=(), active_threads=(), **kwargs):
+        """ギルドからメッセージを取得してデータベースに保存"""
+        client = _client(channels, forums, active_threads)
+        return asyncio.run(fetch_messages_from_guild(client, 1, self.db, **kwargs))
+
+    def _stored_ids(self):
+        """保存されたメッセージIDの一覧"""
+        return sorted(m["id"] for m in self.db.get_all_messages())
+
+    def test_channels_are_fetched_concurrently_within_limit(self):
+        """同時に取得するチャンネル数が上限を超えないことのテスト"""
+        channels = [
+            _FakeChannel(i, range(i * 100, i * 100 + 5), self.tracker)
+            for i in range(1, 9)
+        ]
+        result = self._fetch(channels, concurrency=3, batch_size=2)
+
+        self.assertEqual(self.tracker.peak, 3)
+        self.assertEqual((result.channels, result.fetched), (8, 40))
+        self.assertEqual((result.inserted, result.skipped), (40, 0))
+        self.assertEqual(self.db.get_message_count(), 40)
+        self.assertEqual(
+            self.db.get_channel_checkpoints(), {i: i * 100 + 4 for i in range(1, 9)}
+        )
+
+    def test_checkpoints_fetch_only_newer_messages(self):
+        """取得済み位置より新しいメッセージのみを取得することのテスト"""
+        resumed = _FakeChannel(1, [10, 11, 12, 19], self.tracker)
+        full = _FakeChannel(2, [20, 21], self.tracker)
+        result = self._fetch([resumed, full], checkpoints={1: 11}, concurrency=2)
+
+        # Botの投稿（末尾が9）は保存しないが、取得済み位置は進める
+        self.assertEqual(result.fetched, 3)
+        self.assertEqual(self._stored_ids(), [12, 20, 21])
+        self.assertEqual(self.db.get_channel_checkpoints(), {1: 19, 2: 21})
+        self.assertEqual(resumed.history_kwargs["after"].id, 11)
+        self.assertTrue(resumed.history_kwargs["oldest_first"])
+        self.assertIsNone(full.history_kwargs["after"])
+
+    def test_interrupted_channel_resumes_from_saved_batches(self):
+        """中断したチャンネルは保存済みの位置から再開できることのテスト"""
+        channel = _FakeChannel(1, range(1, 9), self.tracker, fail_at=6)
+        self._fetch([channel], batch_size=2)
+        self.assertEqual(self._stored_ids(), [1, 2, 3, 4, 5])
+        self.assertEqual(self.db.get_channel_checkpoints(), {1: 5})
+
+        channel.fail_at = None
+        result = self._fetch(
+            [channel], checkpoints=self.db.get_channel_checkpoints(), batch_size=2
+        )
+        self.assertEqual((result.fetched, result.inserted), (3, 3))
+        self.assertEqual(self._stored_ids(), list(range(1, 9)))
+
+    def test_threads_and_forum_posts_are_fetched(self):
+        """アクティブ・アーカイブ済みのスレッドとフォーラムの投稿を取得することのテスト"""
+        active = _FakeChannel(11, [110, 111], self.tracker, parent_id=1)
+        archived = _FakeChannel(12, [120], self.tracker, parent_id=1)
+        post = _FakeChannel(31, [310, 311], self.tracker, parent_id=3)
+        excluded_thread = _FakeChannel(21, [210], self.tracker, parent_id=2)
+        channels = [
+            _FakeChannel(1, [10], self.tracker, archived=[archived]),
+            _FakeChannel(2, [20], self.tracker, name="bot-log"),
+        ]
+        forum = _FakeChannel(3, [], self.tracker, archived=[post])
+        result = self._fetch(
+            channels,
+            forums=[forum],
+            active_threads=[active, excluded_thread],
+            excluded_channels={"bot-log"},
+            concurrency=2,
+        )
+
+        self.assertEqual((result.channels, result.threads), (1, 3))
+        self.assertEqual(self._stored_ids(), [10, 110, 111, 120, 310, 311])
+        self.assertEqual(
+            self.db.get_channel_checkpoints(), {1: 10, 11: 111, 12: 120, 31: 311}
+        )
+
+        # 新しい投稿の無いチャンネル・スレッドは履歴を取得しない
+        archived.message_ids = [120, 121]
+        archived.last_message_id = 121
+        for channel in (channels[0], active, archived, post):
+            channel.history_kwargs = None
+        result = self._fetch(
+            channels,
+            forums=[forum],
+            active_threads=[active],
+            excluded_channels={"bot-log"},
+            checkpoints=self.db.get_channel_checkpoints(),
+        )
+        self.assertEqual((result.fetched, result.inserted), (1, 1))
+        self.assertIsNone(channels[0].history_kwargs)
+        self.assertIsNone(post.history_kwargs)
+        self.assertEqual(archived.history_kwargs["after"].id, 120)
+
+    def test_forbidden_and_excluded_channels_are_skipped(self):
+        """権限の無いチャンネルと除外チャンネルがスキップされることのテスト"""
+        channels = [
+            _FakeChannel(1, [10], self.tracker, forbidden=True),
+            _FakeChannel(2, [20], self.tracker, name="bot-log"),
+            _FakeChannel(3, [30], self.tracker),
+        ]
+        self._fetch(channels, excluded_channels={"bot-log"}, concurrency=2)
+
+        self.assertEqual(self._stored_ids(), [30])
+        self.assertEqual(self.db.get_channel_checkpoints(), {3: 30})
+        self.assertIsNone(channels[1].history_kwargs)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,12 +2,17 @@
 知識データベース機能のテスト
 """
 
+import json
 import os
+import sqlite3
 import tempfile
+import threading
 import unittest
 from datetime import datetime
 
-from knowledge_db import KnowledgeDB
+import numpy as np
+
+from knowledge_db import _EMBEDDING_DELTA_ROWS_QUERY, KnowledgeDB
 
 
 class TestKnowledgeDB(unittest.TestCase):
@@ -23,8 +28,14 @@ class TestKnowledgeDB(unittest.TestCase):
 
     def tearDown(self):
         """各テスト後のクリーンアップ"""
-        if os.path.exists(self.db_path):
-            os.unlink(self.db_path)
+        self.db.close()
+        self._remove_db_files()
+
+    def _remove_db_files(self):
+        """データベースファイルとWAL関連ファイルを削除"""
+        for path in (self.db_path, f"{self.db_path}-wal", f"{self.db_path}-shm"):
+            if os.path.exists(path):
+                os.unlink(path)
 
     def test_insert_message(self):
         """メッセージの挿入テスト"""
@@ -77,6 +88,37 @@ class TestKnowledgeDB(unittest.TestCase):
         self.assertEqual(inserted, 0)
         self.assertEqual(skipped, 10)
 
+        # バッチ内の重複もスキップとして数える
+        duplicated = [dict(messages[0], id=500), dict(messages[0], id=500)]
+        inserted, skipped = self.db.insert_messages_batch(duplicated)
+        self.assertEqual(inserted, 1)
+        self.assertEqual(skipped, 1)
+
+        # 空のバッチ
+        self.assertEqual(self.db.insert_messages_batch([]), (0, 0))
+
+    def test_insert_new_messages(self):
+        """新規に挿入したメッセージIDのみが返されることのテスト"""
+        messages = [
+            {
+                "id": i,
+                "channel_id": 111,
+                "channel_name": "general",
+                "author_id": 222,
+                "author_name": "TestUser",
+                "content": f"メッセージ {i}",
+                "created_at": datetime.now().isoformat(),
+                "timestamp": datetime.now().timestamp(),
+            }
+            for i in (3, 1, 3)
+        ]
+        self.assertEqual(self.db.insert_new_messages(messages), [3, 1])
+        self.assertEqual(self.db.insert_new_messages(messages[:2]), [])
+        messages[0]["id"] = 2
+        self.assertEqual(self.db.insert_new_messages(messages), [2])
+        self.assertEqual(self.db.insert_new_messages([]), [])
+        self.assertEqual(self.db.get_message_count(), 3)
+
     def test_message_metadata(self):
         """メタデータ付きメッセージのテスト"""
         message = {
@@ -209,6 +251,22 @@ class TestKnowledgeDB(unittest.TestCase):
         count = self.db.get_embedding_count()
         self.assertEqual(count, 1)
 
+    def test_insert_embeddings_batch(self):
+        """埋め込みの一括挿入のテスト"""
+        vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+        inserted, skipped = self.db.insert_embeddings_batch([1, 2, 3], vectors)
+        self.assertEqual((inserted, skipped), (3, 0))
+
+        # 既存分はスキップされる
+        inserted, skipped = self.db.insert_embeddings_batch(
+            [3, 4], [vectors[0], vectors[1]]
+        )
+        self.assertEqual((inserted, skipped), (1, 1))
+        self.assertEqual(self.db.get_embedding_count(), 4)
+
+        with self.assertRaises(ValueError):
+            self.db.insert_embeddings_batch([5, 6], vectors[:1])
+
     def test_get_messages_without_embeddings(self):
         """埋め込み未生成メッセージ取得のテスト"""
         # 3つのメッセージを挿入
@@ -236,6 +294,42 @@ class TestKnowledgeDB(unittest.TestCase):
         self.assertEqual(without_embeddings[0]["id"], 2)
         self.assertEqual(without_embeddings[1]["id"], 3)
 
+    def test_iter_messages_without_embeddings(self):
+        """埋め込み未生成メッセージのページ単位取得と再開のテスト"""
+        messages = [
+            {
+                "id": i,
+                "channel_id": 111,
+                "channel_name": "general",
+                "author_id": 222,
+                "author_name": "TestUser",
+                "content": f"メッセージ {i}",
+                "created_at": datetime.now().isoformat(),
+                "timestamp": datetime.now().timestamp(),
+            }
+            for i in range(1, 8)
+        ]
+        self.db.insert_messages_batch(messages)
+        self.db.insert_embedding(3, [0.1, 0.2, 0.3])
+        self.assertEqual(self.db.count_messages_without_embeddings(), 6)
+
+        # 各ページの埋め込みを保存しながら読み進めても読み飛ばしが発生しない
+        pages = []
+        for page in self.db.iter_messages_without_embeddings(batch_size=4):
+            ids = [m["id"] for m in page]
+            pages.append(ids)
+            self.db.insert_embeddings_batch(ids, [[0.1, 0.2, 0.3]] * len(ids))
+            break
+        self.assertEqual(pages, [[1, 2, 4, 5]])
+
+        # 中断後は未処理のメッセージから再開される
+        self.assertEqual(self.db.count_messages_without_embeddings(), 2)
+        remaining = [
+            [m["id"] for m in page]
+            for page in self.db.iter_messages_without_embeddings(batch_size=4)
+        ]
+        self.assertEqual(remaining, [[6, 7]])
+
     def test_get_all_embeddings(self):
         """全埋め込み取得のテスト"""
         # メッセージと埋め込みを挿入
@@ -267,6 +361,351 @@ class TestKnowledgeDB(unittest.TestCase):
         texts, embeddings = self.db.get_all_embeddings(category="A")
         self.assertEqual(len(texts), 1)
 
+    def test_embedding_matrix_from_blob(self):
+        """BLOB形式の埋め込みを連続した行列として取得するテスト"""
+        messages = [
+            {
+                "id": i,
+                "channel_id": 111,
+                "channel_name": "general",
+                "author_id": 222,
+                "author_name": "TestUser",
+                "content": f"メッセージ {i}",
+                "created_at": datetime.now().isoformat(),
+                "timestamp": datetime.now().timestamp(),
+            }
+            for i in range(1, 4)
+        ]
+        self.db.insert_messages_batch(messages)
+        for i in range(1, 4):
+            self.db.insert_embedding(i, np.full(4, i, dtype=np.float32))
+
+        # float32のBLOBとして保存されていること
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT typeof(embedding_vector), length(embedding_vector), dim, dtype"
+                " FROM embeddings WHERE message_id = 1"
+            ).fetchone()
+        self.assertEqual(row, ("blob", 16, 4, "float32"))
+
+        message_ids, texts, matrix = self.db.get_embedding_matrix()
+        self.assertEqual(message_ids.tolist(), [1, 2, 3])
+        self.assertEqual(texts[2], "メッセージ 3")
+        self.assertEqual(matrix.shape, (3, 4))
+        self.assertEqual(matrix.dtype, np.float32)
+        self.assertTrue(matrix.flags["C_CONTIGUOUS"])
+        np.testing.assert_array_equal(matrix[1], np.full(4, 2.0))
+
+        _, _, _, metadata = self.db.get_embedding_matrix_with_metadata()
+        self.assertEqual(metadata["channel_id"].tolist(), [111] * 3)
+        self.assertEqual(metadata["author_id"].tolist(), [222] * 3)
+        self.assertEqual(metadata["timestamp"].dtype, np.float64)
+        self.assertEqual(len(metadata["category"]), 3)
+
+    def test_migrate_json_embeddings(self):
+        """JSON形式の埋め込みがBLOB形式に移行されることのテスト"""
+        self.db.close()
+        self._remove_db_files()
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("""
+                CREATE TABLE messages (
+                    id INTEGER PRIMARY KEY,
+                    channel_id INTEGER NOT NULL,
+                    channel_name TEXT NOT NULL,
+                    author_id INTEGER NOT NULL,
+                    author_name TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    timestamp REAL NOT NULL,
+                    category TEXT DEFAULT NULL,
+                    importance INTEGER DEFAULT 0,
+                    created_in_db TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE embeddings (
+                    message_id INTEGER PRIMARY KEY,
+                    embedding_vector TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.execute(
+                "INSERT INTO messages (id, channel_id, channel_name, author_id,"
+                " author_name, content, created_at, timestamp)"
+                " VALUES (1, 111, 'general', 222, 'TestUser', '旧形式', '', 0)"
+            )
+            conn.execute(
+                "INSERT INTO embeddings (message_id, embedding_vector) VALUES (1, ?)",
+                (json.dumps([0.5, -1.0, 2.0]),),
+            )
+
+        db = KnowledgeDB(self.db_path)
+
+        with sqlite3.connect(self.db_path) as conn:
+            vector_type = conn.execute(
+                "SELECT typeof(embedding_vector) FROM embeddings"
+            ).fetchone()[0]
+        self.assertEqual(vector_type, "blob")
+
+        texts, embeddings = db.get_all_embeddings()
+        self.assertEqual(texts, ["旧形式"])
+        np.testing.assert_array_equal(embeddings[0], [0.5, -1.0, 2.0])
+
+        # 既存の埋め込みに連番が割り当てられていること
+        self.assertEqual(db.get_max_embedding_seq(), 1)
+
+        # 既存のメッセージが全文検索インデックスに登録されていること
+        self.assertEqual([i for i, _ in db.search_fulltext("旧形式")], [1])
+        db.close()
+
+    def test_embedding_seq_delta(self):
+        """埋め込みの連番により差分だけを取得できることのテスト"""
+        messages = [
+            {
+                "id": i,
+                "channel_id": 111,
+                "channel_name": "general",
+                "author_id": 222,
+                "author_name": "TestUser",
+                "content": f"メッセージ {i}",
+                "created_at": datetime.now().isoformat(),
+                "timestamp": datetime.now().timestamp(),
+            }
+            for i in (30, 10, 20)
+        ]
+        self.db.insert_messages_batch(messages)
+        self.assertEqual(self.db.get_max_embedding_seq(), 0)
+
+        self.db.insert_embeddings_batch([30, 10], np.ones((2, 4)))
+        seq = self.db.get_max_embedding_seq()
+        self.assertEqual(seq, 2)
+
+        # 既存の埋め込みは連番を消費しない
+        self.db.insert_embeddings_batch([10, 20], np.ones((2, 4)))
+        self.assertEqual(self.db.get_max_embedding_seq(), 3)
+
+        ids, texts, _, metadata = self.db.get_embedding_matrix_with_metadata(
+            after_seq=seq
+        )
+        self.assertEqual(ids.tolist(), [20])
+        self.assertEqual(texts, ["メッセージ 20"])
+        self.assertEqual(metadata["seq"].tolist(), [3])
+        self.assertEqual(self.db.get_embedding_count(max_seq=seq), 2)
+        self.assertEqual(self.db.get_embedding_count(), 3)
+
+        # ページ単位の読み込みはメッセージID順で、指定した連番以下のみ
+        pages = list(self.db.iter_embedding_pages(page_size=1, max_seq=seq))
+        self.assertEqual([page[0].tolist() for page in pages], [[10], [30]])
+        self.assertEqual(pages[1][1], ["メッセージ 30"])
+        self.assertEqual(self.db.count_embedded_messages(max_seq=seq), 2)
+        self.assertEqual(self.db.count_embedded_messages(), 3)
+
+    def test_embedding_delta_uses_seq_index(self):
+        """差分の読み込みが連番のインデックスを使い、全件走査しないことのテスト"""
+        query = _EMBEDDING_DELTA_ROWS_QUERY + " ORDER BY e.seq"
+        with self.db._get_connection() as conn:
+            plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", [0])]
+        self.assertTrue(plan[0].startswith("SEARCH e USING"), plan)
+        self.assertIn("idx_embeddings_seq", plan[0])
+        self.assertFalse(any(detail.startswith("SCAN") for detail in plan), plan)
+
+    def test_channel_checkpoints(self):
+        """チャンネルごとの取得済み位置の記録と更新のテスト"""
+        self.assertEqual(self.db.get_channel_checkpoints(), {})
+
+        message = {
+            "id": 120,
+            "channel_id": 111,
+            "channel_name": "general",
+            "author_id": 222,
+            "author_name": "TestUser",
+            "content": "メッセージ",
+            "created_at": datetime.now().isoformat(),
+            "timestamp": datetime.now().timestamp(),
+        }
+        self.db.insert_messages_batch([message], checkpoints={111: 125, 333: 300})
+        self.assertEqual(self.db.get_channel_checkpoints(), {111: 125, 333: 300})
+
+        # 古い位置では戻らない
+        self.db.set_channel_checkpoints({111: 100, 333: 310})
+        self.assertEqual(self.db.get_channel_checkpoints(), {111: 125, 333: 310})
+
+        # 全件が既存・メッセージが空の場合も位置は更新される
+        self.db.insert_messages_batch([message], checkpoints={111: 130})
+        self.db.insert_messages_batch([], checkpoints={444: 1})
+        self.assertEqual(
+            self.db.get_channel_checkpoints(), {111: 130, 333: 310, 444: 1}
+        )
+
+    def test_search_fulltext(self):
+        """全文検索インデックスが挿入に同期し、BM25の高い順に返すことのテスト"""
+        contents = [
+            "ボイスチャンネルへの参加方法はこちら",
+            "/setup コマンドで初期設定ができます",
+            "今日は晴れ",
+            "Minecraftサーバーのアドレス",
+        ]
+        self.db.insert_messages_batch(
+            [
+                {
+                    "id": i,
+                    "channel_id": 111,
+                    "channel_name": "general",
+                    "author_id": 222,
+                    "author_name": "TestUser",
+                    "content": content,
+                    "created_at": datetime.now().isoformat(),
+                    "timestamp": datetime.now().timestamp(),
+                }
+                for i, content in enumerate(contents)
+            ]
+        )
+
+        # 分かち書きの無い日本語・大文字小文字の違いでも部分一致する
+        self.assertEqual(self.db.search_fulltext("ボイスチャンネルに入るには")[0][0], 0)
+        self.assertEqual([i for i, _ in self.db.search_fulltext("SETUPの使い方")], [1])
+        self.assertEqual([i for i, _ in self.db.search_fulltext("minecraft")], [3])
+        # 3文字未満の語・ひらがなのみのクエリは空
+        self.assertEqual(self.db.search_fulltext("VC"), [])
+        self.assertEqual(self.db.search_fulltext("こちらです"), [])
+        self.assertEqual(self.db.search_fulltext('"; DROP'), [])
+
+        # 本文の更新・削除もトリガーで反映される
+        with self.db._get_connection() as conn:
+            conn.execute("UPDATE messages SET content = '明日の天気予報' WHERE id = 2")
+            conn.execute("DELETE FROM messages WHERE id = 3")
+        self.assertEqual([i for i, _ in self.db.search_fulltext("天気予報は？")], [2])
+        self.assertEqual(self.db.search_fulltext("minecraft"), [])
+
+    def test_search_fulltext_common_terms(self):
+        """一致件数の多い語の除外と、全ての語が多い場合の最も少ない語の使用のテスト"""
+        contents = ["サーバーのボイスチャンネル"] + [f"サーバー{i}" for i in range(4)]
+        contents += ["マイクラサーバーの設定"] * 3
+        self.db.insert_messages_batch(
+            [
+                {
+                    "id": i,
+                    "channel_id": 111,
+                    "channel_name": "general",
+                    "author_id": 222,
+                    "author_name": "TestUser",
+                    "content": content,
+                    "created_at": datetime.now().isoformat(),
+                    "timestamp": datetime.now().timestamp(),
+                }
+                for i, content in enumerate(contents)
+            ]
+        )
+
+        def search(query):
+            return [i for i, _ in self.db.search_fulltext(query, max_term_matches=2)]
+
+        # 上限を超える「サーバー」は除外し、一致の少ない語のみで検索する
+        self.assertEqual(search("サーバーのボイスチャンネル"), [0])
+        # 全ての語が上限を超える場合は最も一致の少ない語を使う（「設定」は2文字で対象外）
+        self.assertEqual(sorted(search("マイクラサーバーの設定")), [5, 6, 7])
+        self.assertEqual(len(search("サーバーは？")), 8)
+
+    def test_persistent_connection_per_thread(self):
+        """スレッドごとに永続接続が再利用されることのテスト"""
+        conn = self.db._get_connection()
+        self.assertIs(self.db._get_connection(), conn)
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, "wal")
+
+        other = []
+        thread = threading.Thread(
+            target=lambda: other.append(self.db._get_connection())
+        )
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], conn)
+
+        # 閉じた後は新しい接続が作成される
+        self.db.close()
+        self.assertIsNot(self.db._get_connection(), conn)
+
+    def test_read_during_uncommitted_write(self):
+        """書き込みトランザクション中でも読み込みがブロックされないことのテスト"""
+        message = {
+            "id": 1,
+            "channel_id": 111,
+            "channel_name": "general",
+            "author_id": 222,
+            "author_name": "TestUser",
+            "content": "テストメッセージ",
+            "created_at": datetime.now().isoformat(),
+            "timestamp": datetime.now().timestamp(),
+        }
+        self.db.insert_message(message)
+
+        writer = sqlite3.connect(self.db_path, timeout=0)
+        try:
+            writer.execute("BEGIN IMMEDIATE")
+            writer.execute(
+                "INSERT INTO messages (id, channel_id, channel_name, author_id,"
+                " author_name, content, created_at, timestamp)"
+                " VALUES (2, 111, 'general', 222, 'TestUser', '未コミット', '', 0)"
+            )
+            # 未コミットの行は見えず、ロック待ちも発生しない
+            self.assertEqual(self.db.get_message_count(), 1)
+            writer.commit()
+        finally:
+            writer.close()
+        self.assertEqual(self.db.get_message_count(), 2)
+
+    def test_concurrent_writers_do_not_duplicate_fulltext_rows(self):
+        """別の接続と同時に同じメッセージを挿入しても全文検索に二重登録しないことのテスト"""
+        messages = [
+            {
+                "id": i,
+                "channel_id": 111,
+                "channel_name": "general",
+                "author_id": 222,
+                "author_name": "TestUser",
+                "content": f"ボイスチャンネル {i}",
+                "created_at": datetime.now().isoformat(),
+                "timestamp": datetime.now().timestamp(),
+            }
+            for i in (1, 2)
+        ]
+
+        # 別のライターがメッセージ1を挿入中（未コミット）に一括挿入を開始する
+        writer = sqlite3.connect(self.db_path)
+        result = []
+        try:
+            writer.execute("BEGIN IMMEDIATE")
+            writer.execute(
+                "INSERT INTO messages (id, channel_id, channel_name, author_id,"
+                " author_name, content, created_at, timestamp)"
+                " VALUES (1, 111, 'general', 222, 'TestUser', 'ボイスチャンネル 1',"
+                " '', 0)"
+            )
+            writer.execute(
+                "INSERT INTO messages_fts(rowid, content)"
+                " VALUES (1, 'ボイスチャンネル 1')"
+            )
+            thread = threading.Thread(
+                target=lambda: result.append(self.db.insert_messages_batch(messages))
+            )
+            thread.start()
+            thread.join(0.3)
+            writer.commit()
+            thread.join()
+        finally:
+            writer.close()
+
+        self.assertEqual(result, [(1, 1)])
+        with self.db._get_connection() as conn:
+            # 外部コンテンツとの整合性を検査（二重登録があると破損として検出される）
+            conn.execute(
+                "INSERT INTO messages_fts(messages_fts, rank)"
+                " VALUES ('integrity-check', 1)"
+            )
+        self.assertEqual(
+            sorted(i for i, _ in self.db.search_fulltext("ボイスチャンネル")), [1, 2]
+        )
+
     def test_incremental_update(self):
         """増分更新のテスト"""
         # 初回: 100メッセージ挿入
@@ -0,0 +1,213 @@
+"""
+リアルタイム取り込み（LiveIngestor）のテスト
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import numpy as np
+
+from fetch_messages import message_to_record
+from knowledge_db import KnowledgeDB
+from live_ingest import LiveIngestor
+
+
+def _message(message_id, content="ボイスチャンネルの使い方", bot=False, channel="雑談"):
+    """テスト用のdiscord.Messageの代替"""
+    return SimpleNamespace(
+        id=message_id,
+        content=content,
+        author=SimpleNamespace(id=10, bot=bot),
+        channel=SimpleNamespace(id=100, name=channel),
+        guild=SimpleNamespace(id=1),
+        created_at=datetime(2024, 1, 1, tzinfo=timezone.utc),
+    )
+
+
+def _encode(texts):
+    """テキスト長を埋め込みとする埋め込みモデルのスタブ"""
+    return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+
+class TestLiveIngestor(unittest.TestCase):
+    """LiveIngestorクラスのテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "test.db")
+        self.db = KnowledgeDB(self.db_path)
+
+    def tearDown(self):
+        """各テスト後のクリーンアップ"""
+        self.db.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_messages_are_stored_and_embedded(self):
+        """受信したメッセージがまとめて保存・埋め込みされることのテスト"""
+        indexed = []
+        ingestor = LiveIngestor(
+            self.db_path,
+            encode_batch=_encode,
+            on_indexed=lambda: indexed.append(True),
+            batch_size=8,
+            flush_interval=10,
+        )
+        try:
+            for i in range(8):
+                self.assertTrue(ingestor.submit_message(_message(i + 1)))
+        finally:
+            ingestor.close()
+
+        self.assertEqual(self.db.get_message_count(), 8)
+        self.assertEqual(self.db.get_embedding_count(), 8)
+        self.assertEqual((ingestor.stored, ingestor.embedded), (8, 8))
+        self.assertEqual(len(indexed), 1)
+        self.assertEqual(self.db.get_all_messages()[0]["channel_name"], "雑談")
+
+    def test_ineligible_messages_are_skipped(self):
+        """Bot・空・除外チャンネル・別ギルドのメッセージが取り込まれないことのテスト"""
+        ingestor = LiveIngestor(self.db_path, guild_id=1, excluded_channels=["bot-log"])
+        other_guild = _message(4)
+        other_guild.guild = SimpleNamespace(id=2)
+        try:
+            self.assertFalse(ingestor.submit_message(_message(1, bot=True)))
+            self.assertFalse(ingestor.submit_message(_message(2, content="  ")))
+            self.assertFalse(ingestor.submit_message(_message(3, channel="bot-log")))
+            self.assertFalse(ingestor.submit_message(other_guild))
+            thread = _message(6, channel="質問スレッド")
+            thread.channel.parent = SimpleNamespace(name="bot-log")
+            self.assertFalse(ingestor.submit_message(thread))
+            self.assertTrue(ingestor.submit_message(_message(5)))
+        finally:
+            ingestor.close()
+        self.assertEqual(self.db.get_message_count(), 1)
+
+    def test_full_queue_drops_without_blocking(self):
+        """書き込み待ちが上限に達した場合はブロックせずに破棄することのテスト"""
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_encode(texts):
+            started.set()
+            release.wait(5)
+            return _encode(texts)
+
+        ingestor = LiveIngestor(
+            self.db_path,
+            encode_batch=slow_encode,
+            max_queue_size=2,
+            batch_size=1,
+            flush_interval=0,
+        )
+        try:
+            ingestor.submit_message(_message(1))
+            self.assertTrue(started.wait(5))
+            results = [ingestor.submit_message(_message(i)) for i in range(2, 6)]
+            self.assertEqual(results, [True, True, False, False])
+            self.assertEqual(ingestor.dropped, 2)
+        finally:
+            release.set()
+            ingestor.close()
+        self.assertEqual(self.db.get_message_count(), 3)
+
+    def test_encode_failure_keeps_messages(self):
+        """埋め込みに失敗してもメッセージは保存されることのテスト"""
+
+        def failing(texts):
+            raise RuntimeError("モデルエラー")
+
+        ingestor = LiveIngestor(self.db_path, encode_batch=failing, flush_interval=0)
+        try:
+            ingestor.submit_message(_message(1))
+        finally:
+            ingestor.close()
+        self.assertEqual(self.db.get_message_count(), 1)
+        self.assertEqual(self.db.get_embedding_count(), 0)
+
+    def test_only_new_messages_are_embedded(self):
+        """保存済みのメッセージとバッチ内の重複は埋め込まないことのテスト"""
+        self.db.insert_messages_batch([message_to_record(_message(1))])
+        encoded = []
+
+        def encode(texts):
+            encoded.append(list(texts))
+            return _encode(texts)
+
+        ingestor = LiveIngestor(
+            self.db_path, encode_batch=encode, batch_size=3, flush_interval=10
+        )
+        try:
+            ingestor.submit_message(_message(1))
+            ingestor.submit_message(_message(2, content="新しい質問"))
+            ingestor.submit_message(_message(2, content="新しい質問"))
+        finally:
+            ingestor.close()
+        self.assertEqual(encoded, [["新しい質問"]])
+        self.assertEqual((ingestor.stored, ingestor.embedded), (1, 1))
+        self.assertEqual(self.db.count_messages_without_embeddings(), 1)
+
+    def test_model_load_failure_disables_embedding(self):
+        """モデルのロードに失敗した場合は1回だけ試し、以降は保存のみ行うことのテスト"""
+        loads = []
+        encoded = []
+
+        def load_model():
+            loads.append(True)
+            raise RuntimeError("モデルのロードに失敗しました")
+
+        ingestor = LiveIngestor(
+            self.db_path,
+            encode_batch=lambda texts: encoded.append(texts),
+            load_model=load_model,
+            batch_size=1,
+            flush_interval=0,
+        )
+        try:
+            for i in range(3):
+                ingestor.submit_message(_message(i + 1))
+        finally:
+            ingestor.close()
+        self.assertEqual((len(loads), len(encoded)), (1, 0))
+        self.assertEqual(self.db.get_message_count(), 3)
+        self.assertEqual(self.db.get_embedding_count(), 0)
+
+    def test_encode_failure_is_retried(self):
+        """埋め込みの失敗はモデルのロードの失敗と異なり、次のバッチで再試行することのテスト"""
+        calls = []
+
+        def flaky(texts):
+            calls.append(texts)
+            if len(calls) == 1:
+                raise RuntimeError("一時的なエラー")
+            return _encode(texts)
+
+        ingestor = LiveIngestor(
+            self.db_path,
+            encode_batch=flaky,
+            load_model=lambda: None,
+            batch_size=1,
+            flush_interval=0,
+        )
+        try:
+            for i in range(3):
+                ingestor.submit_message(_message(i + 1))
+        finally:
+            ingestor.close()
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(self.db.get_embedding_count(), 2)
+
+    def test_close_rejects_new_messages(self):
+        """終了後のメッセージは受け付けないことのテスト"""
+        ingestor = LiveIngestor(self.db_path)
+        ingestor.close()
+        self.assertFalse(ingestor.submit_message(_message(1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+意味的応答キャッシュのテスト
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import ai_chatbot
+from embedding_index import SearchResult
+from response_cache import SemanticResponseCache
+
+
+class TestSemanticResponseCache(unittest.TestCase):
+    """SemanticResponseCacheクラスのテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.query = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+        self.similar = np.array([1.0, 0.05, 0.0], dtype=np.float32)
+        self.different = np.array([1.0, 1.0, 0.0], dtype=np.float32)
+
+    def test_hit_requires_similarity_context_and_version(self):
+        """類似度・文脈ID・バージョンが全て一致した場合のみヒットすることのテスト"""
+        cache = SemanticResponseCache(threshold=0.95)
+        cache.store(self.query, [1, 2], "v1", "応答", latency=1.5)
+
+        self.assertEqual(cache.lookup(self.similar, [1, 2], "v1"), "応答")
+        self.assertIsNone(cache.lookup(self.different, [1, 2], "v1"))
+        self.assertIsNone(cache.lookup(self.query, [2, 1], "v1"))
+        self.assertIsNone(cache.lookup(self.query, [1, 2], "v2"))
+
+        stats = cache.stats()
+        self.assertEqual((stats.hits, stats.misses), (1, 3))
+        self.assertAlmostEqual(stats.saved_seconds, 1.5)
+        self.assertAlmostEqual(stats.hit_rate, 0.25)
+
+    def test_lru_eviction(self):
+        """上限を超えると最も古く使われた応答から削除されることのテスト"""
+        cache = SemanticResponseCache(maxsize=2)
+        cache.store(self.query, [1], "v1", "応答1")
+        cache.store(self.query, [2], "v1", "応答2")
+        cache.lookup(self.query, [1], "v1")
+        cache.store(self.query, [3], "v1", "応答3")
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.lookup(self.query, [1], "v1"), "応答1")
+        self.assertIsNone(cache.lookup(self.query, [2], "v1"))
+
+    def test_persistence_and_invalidation(self):
+        """永続化した応答が同じバージョンでのみ引き継がれることのテスト"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "response_cache.db")
+            cache = SemanticResponseCache(path=path, version="v1")
+            cache.store(self.query, [1, 2], "v1", "応答", latency=2.0)
+            cache.close()
+
+            reopened = SemanticResponseCache(path=path, version="v1")
+            self.assertEqual(reopened.lookup(self.similar, [1, 2], "v1"), "応答")
+            reopened.close()
+
+            # プロンプトや知識データが変わるとバージョンが変わり、古い応答は削除される
+            changed = SemanticResponseCache(path=path, version="v2")
+            self.assertEqual(len(changed), 0)
+            changed.close()
+            again = SemanticResponseCache(path=path, version="v1")
+            self.assertEqual(len(again), 0)
+            again.close()
+
+
+class TestResponseCacheIntegration(unittest.TestCase):
+    """generate_responseと応答キャッシュの統合テスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.embeddings = {
+            "ボイスチャンネルに入るには？": np.array([1.0, 0.0], dtype=np.float32),
+            "ボイスチャンネルに入るには?": np.array([1.0, 0.01], dtype=np.float32),
+            "ルールは？": np.array([0.0, 1.0], dtype=np.float32),
+        }
+        self.llm = mock.MagicMock(side_effect=lambda q, m: (f"応答: {q}", None))
+        self.patches = [
+            mock.patch.dict(os.environ, {"GEMINI_API_KEY": "test_key"}),
+            mock.patch.object(ai_chatbot, "_initialized", True),
+            mock.patch.object(ai_chatbot, "_retrieve_context", self._retrieve),
+            mock.patch.object(ai_chatbot, "generate_response_with_llm", self.llm),
+            mock.patch.object(ai_chatbot, "_response_cache", SemanticResponseCache()),
+            mock.patch.object(ai_chatbot, "_get_response_cache_version", lambda: "v"),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        """各テスト後のクリーンアップ"""
+        for patch in reversed(self.patches):
+            patch.stop()
+
+    def _retrieve(self, query, top_k):
+        """_retrieve_contextのスタブ"""
+        return self.embeddings[query], [SearchResult(7, 0.9, "過去メッセージ")]
+
+    def test_similar_question_reuses_response(self):
+        """ほぼ同じ質問ではLLMを呼ばずに応答を再利用することのテスト"""
+        first = ai_chatbot.generate_response("ボイスチャンネルに入るには？")
+        second = ai_chatbot.generate_response("ボイスチャンネルに入るには?")
+        third = ai_chatbot.generate_response("ルールは？")
+
+        self.assertEqual(first, second)
+        self.assertEqual(third, "応答: ルールは？")
+        self.assertEqual(self.llm.call_count, 2)
+
+        stats = ai_chatbot.get_response_cache_stats()
+        self.assertEqual((stats.hits, stats.misses), (1, 2))
+
+
+class TestResponseCacheVersion(unittest.TestCase):
+    """応答キャッシュのバージョンのテスト"""
+
+    def test_version_ignores_knowledge_updates(self):
+        """知識データの追加ではバージョンが変わらず、モデル名の変更では変わることのテスト"""
+        with mock.patch.object(ai_chatbot, "_response_cache_version", None):
+            with mock.patch.object(ai_chatbot, "_index", object()):
+                version = ai_chatbot._get_response_cache_version()
+            with mock.patch.object(ai_chatbot, "_index", object()):
+                self.assertEqual(ai_chatbot._get_response_cache_version(), version)
+            with mock.patch.object(ai_chatbot, "get_model_name", lambda: "other"):
+                self.assertNotEqual(ai_chatbot._get_response_cache_version(), version)
+
+
+if __name__ == "__main__":
+    unittest.main()
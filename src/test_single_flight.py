@@ -0,0 +1,193 @@
+"""
+リクエスト合流（シングルフライト）のテスト
+"""
+
+import asyncio
+import os
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import ai_chatbot
+from single_flight import AsyncSingleFlight, SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    """SingleFlightクラス（同期版）のテスト"""
+
+    def test_concurrent_calls_share_one_execution(self):
+        """同じキーの同時呼び出しが1回の実行にまとめられることのテスト"""
+        flight = SingleFlight()
+        calls = []
+        started = threading.Event()
+
+        def slow(value):
+            calls.append(value)
+            started.set()
+            time.sleep(0.2)
+            return f"結果{value}"
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            leader = executor.submit(flight.do, "key", slow, 1)
+            started.wait()
+            followers = [executor.submit(flight.do, "key", slow, 2) for _ in range(7)]
+            results = [leader.result()] + [f.result() for f in followers]
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ["結果1"] * 8)
+        self.assertEqual(flight.coalesced, 7)
+
+        # 完了後の呼び出しは新たに実行される
+        self.assertEqual(flight.do("key", slow, 3), "結果3")
+
+    def test_exception_is_shared(self):
+        """実行中の処理の例外が合流した呼び出しにも送出されることのテスト"""
+        flight = SingleFlight()
+        started = threading.Event()
+
+        def failing():
+            started.set()
+            time.sleep(0.1)
+            raise RuntimeError("LLM APIからの応答取得に失敗しました")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(flight.do, "key", failing)
+            started.wait()
+            follower = executor.submit(flight.do, "key", failing)
+            for future in (leader, follower):
+                with self.assertRaises(RuntimeError):
+                    future.result()
+
+
+class TestAsyncSingleFlight(unittest.TestCase):
+    """AsyncSingleFlightクラス（非同期版）のテスト"""
+
+    def test_concurrent_calls_share_one_task(self):
+        """同じキーのコルーチンが1つのタスクにまとめられることのテスト"""
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def slow(value):
+            calls.append(value)
+            await asyncio.sleep(0.05)
+            return f"結果{value}"
+
+        async def run():
+            return await asyncio.gather(
+                *(flight.do("key", lambda i=i: slow(i)) for i in range(5)),
+                flight.do("other", lambda: slow("other")),
+            )
+
+        results = asyncio.run(run())
+        self.assertEqual(results, ["結果0"] * 5 + ["結果other"])
+        self.assertEqual(calls, [0, "other"])
+        self.assertEqual(flight.coalesced, 4)
+
+    def test_cancel_one_waiter_keeps_shared_task(self):
+        """一部の呼び出しがキャンセルされても共有の処理は続行することのテスト"""
+        flight = AsyncSingleFlight()
+        cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(0.1)
+                return "結果"
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def run():
+            impatient = asyncio.ensure_future(
+                asyncio.wait_for(flight.do("key", slow), timeout=0.01)
+            )
+            patient = asyncio.ensure_future(flight.do("key", slow))
+            with self.assertRaises(asyncio.TimeoutError):
+                await impatient
+            return await patient
+
+        self.assertEqual(asyncio.run(run()), "結果")
+        self.assertEqual(cancelled, [])
+
+    def test_cancel_all_waiters_cancels_task(self):
+        """全ての呼び出しがキャンセルされた場合は処理もキャンセルされることのテスト"""
+        flight = AsyncSingleFlight()
+        cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def run():
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(flight.do("key", slow), timeout=0.01)
+            await asyncio.sleep(0)
+
+        asyncio.run(run())
+        self.assertEqual(cancelled, [True])
+
+
+class TestGenerateResponseCoalescing(unittest.TestCase):
+    """generate_responseのリクエスト合流のテスト"""
+
+    def test_identical_questions_call_llm_once(self):
+        """表記揺れを含む同じ質問の同時リクエストでLLMが1回だけ呼ばれることのテスト"""
+        calls = []
+        started = threading.Event()
+
+        def generate(query, top_k):
+            calls.append(query)
+            started.set()
+            time.sleep(0.2)
+            return f"応答: {query}"
+
+        questions = ["ルールは？", " ルールは? ", "ルールは？", "ﾙｰﾙは？"]
+        with (
+            mock.patch.object(ai_chatbot, "_response_flight", SingleFlight()),
+            mock.patch.object(ai_chatbot, "_generate_response", generate),
+        ):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                first = executor.submit(ai_chatbot.generate_response, questions[0])
+                started.wait()
+                rest = [
+                    executor.submit(ai_chatbot.generate_response, q)
+                    for q in questions[1:]
+                ]
+                results = [first.result()] + [f.result() for f in rest]
+
+        self.assertEqual(calls, ["ルールは？"])
+        self.assertEqual(results, ["応答: ルールは？"] * 4)
+
+    def test_async_identical_questions_call_llm_once(self):
+        """非同期版でも同じ質問が1回の処理にまとめられることのテスト"""
+        calls = []
+
+        async def generate(query, top_k):
+            calls.append(query)
+            await asyncio.sleep(0.05)
+            return f"応答: {query}"
+
+        async def run():
+            return await asyncio.gather(
+                *(ai_chatbot.generate_response_async("ルールは？") for _ in range(10))
+            )
+
+        with mock.patch.dict(os.environ, {"GEMINI_API_KEY": "test_key"}):
+            with (
+                mock.patch.object(
+                    ai_chatbot, "_response_flight_async", AsyncSingleFlight()
+                ),
+                mock.patch.object(ai_chatbot, "_generate_response_async", generate),
+            ):
+                results = asyncio.run(run())
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["応答: ルールは？"] * 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+TTL付きLRUキャッシュとクエリ埋め込みキャッシュのテスト
+"""
+
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import ai_chatbot
+from ttl_cache import TTLCache
+
+
+class _FakeClock:
+    """テスト用の時計"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache(unittest.TestCase):
+    """TTLCacheクラスのテスト"""
+
+    def test_lru_eviction(self):
+        """上限を超えると最も古く使われた値から削除されることのテスト"""
+        cache = TTLCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)  # aを最近使用に更新
+        cache.set("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl_expiry(self):
+        """有効期限を過ぎた値はミスとなることのテスト"""
+        clock = _FakeClock()
+        cache = TTLCache(maxsize=10, ttl=60, timer=clock)
+        cache.set("a", 1)
+        clock.now = 59
+        self.assertEqual(cache.get("a"), 1)
+        clock.now = 61
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_stats(self):
+        """ヒット数・ミス数・ヒット率のテスト"""
+        cache = TTLCache(maxsize=10)
+        self.assertEqual(cache.stats().hit_rate, 0.0)
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("a")
+        cache.get("b")
+
+        stats = cache.stats()
+        self.assertEqual((stats.hits, stats.misses, stats.size), (2, 1, 1))
+        self.assertAlmostEqual(stats.hit_rate, 2 / 3)
+
+    def test_disabled(self):
+        """maxsize=0の場合は何も保存しないことのテスト"""
+        cache = TTLCache(maxsize=0)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+
+class TestQueryEmbeddingCache(unittest.TestCase):
+    """ai_chatbotのクエリ埋め込みキャッシュのテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.model = mock.MagicMock()
+        self.model.encode.side_effect = lambda texts, **kwargs: np.array(
+            [[len(text), 1.0] for text in texts], dtype=np.float32
+        )
+        self.patches = [
+            mock.patch.object(ai_chatbot, "_initialized", True),
+            mock.patch.object(ai_chatbot, "_model", self.model),
+            mock.patch.object(ai_chatbot, "_query_cache", None),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        """各テスト後のクリーンアップ"""
+        for patch in reversed(self.patches):
+            patch.stop()
+
+    def test_normalize_query(self):
+        """表記揺れが同じキーに正規化されることのテスト"""
+        self.assertEqual(
+            ai_chatbot._normalize_query("  How do I   join ＶＯＩＣＥ？ "),
+            "how do i join voice?",
+        )
+
+    def test_repeat_query_skips_model(self):
+        """同じ質問の2回目以降はモデルの推論を行わないことのテスト"""
+        first = ai_chatbot.encode_query("ルールは？")
+        second = ai_chatbot.encode_query("  ルールは? ")
+
+        self.assertEqual(self.model.encode.call_count, 1)
+        self.assertIs(first, second)
+        self.assertFalse(first.flags["WRITEABLE"])
+
+        stats = ai_chatbot.get_query_cache_stats()
+        self.assertEqual((stats.hits, stats.misses), (1, 1))
+
+    def test_cache_size_from_env(self):
+        """環境変数でキャッシュを無効化できることのテスト"""
+        with mock.patch.dict(os.environ, {"QUERY_CACHE_SIZE": "0"}):
+            ai_chatbot.encode_query("ルールは？")
+            ai_chatbot.encode_query("ルールは？")
+        self.assertEqual(self.model.encode.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+TTL付きLRUキャッシュモジュール
+
+件数の上限と有効期限（TTL）を持つスレッドセーフなLRUキャッシュを提供します。
+ヒット数・ミス数を記録し、キャッシュの効果を確認できます。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, NamedTuple, Optional
+
+
+class CacheStats(NamedTuple):
+    """キャッシュの統計情報"""
+
+    hits: int
+    misses: int
+    size: int
+    maxsize: int
+
+    @property
+    def hit_rate(self) -> float:
+        """ヒット率（0.0〜1.0、未使用の場合は0.0）"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class TTLCache:
+    """件数の上限と有効期限を持つスレッドセーフなLRUキャッシュ"""
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: Optional[float] = None,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        """
+        キャッシュを初期化
+
+        Args:
+            maxsize: 保持する最大件数（0以下の場合はキャッシュしない）
+            ttl: 有効期限（秒、Noneまたは0以下の場合は無期限）
+            timer: 現在時刻を返す関数（テスト用）
+        """
+        self.maxsize = max(0, maxsize)
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self._timer = timer
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        値を取得（期限切れの場合は削除してdefaultを返す）
+
+        Args:
+            key: キー
+            default: 見つからない場合の戻り値
+
+        Returns:
+            キャッシュされた値、またはdefault
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > self._timer():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any):
+        """
+        値を保存（上限を超えた場合は最も古く使われたものから削除）
+
+        Args:
+            key: キー
+            value: 値
+        """
+        if self.maxsize == 0:
+            return
+        expires_at = self._timer() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """全ての値と統計情報を削除"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> CacheStats:
+        """
+        統計情報を取得
+
+        Returns:
+            CacheStats: ヒット数・ミス数・現在の件数・最大件数
+        """
+        with self._lock:
+            return CacheStats(self.hits, self.misses, len(self._entries), self.maxsize)